@@ -0,0 +1,65 @@
+# benchmarks/corpus.py
+"""
+Textos de tamanho real para os benchmarks: respostas brutas (antes do pós-processo)
+com os vícios que os estágios corrigem — listas, formalismos, cenário trocado,
+derailers, 3ª pessoa e metacena — e prompts de usuário para os turnos.
+"""
+from typing import Dict, List
+
+RESPOSTAS: List[str] = [
+    # Mary: praia, com formalismos e um derailer no meio
+    "Eu sorrio e afundo os pés na areia morna. A brisa do mar bagunça meu cabelo e eu nem tento arrumar. "
+    "Contudo, eu percebo que você está quieto demais, então encosto o ombro no seu e espero. "
+    "O quiosque ao fundo toca uma música antiga que eu adoro. — Lembra dessa? Tocou no dia em que a gente se conheceu.\n\n"
+    "Meu celular vibra na bolsa, mas eu ignoro. Hoje é só a gente. Eu pego sua mão e puxo você até a beira da água. "
+    "Entretanto, a onda vem mais forte e molha a barra do meu vestido. Eu rio alto, sem vergonha nenhuma.\n\n"
+    "— Vem, entra comigo. Só até o joelho, prometo. Eu te olho de lado, esperando sua resposta, "
+    "e aperto seus dedos devagar. O sol está baixando e pinta o mar de laranja.",
+    # Mary: casa, com lista e metacena
+    "[Cena: apartamento, noite]\n"
+    "Eu fecho a porta e deixo as chaves na mesinha da sala. O sofá ainda tem a manta que você esqueceu aqui.\n"
+    "- tiro os sapatos\n- acendo a luz baixa\n- ligo a música\n"
+    "Eu vou até a cozinha e pego duas taças. Dessa forma, a noite fica do jeito que eu imaginei. "
+    "— Vinho ou chá? Eu pergunto, já sabendo a resposta.\n\n"
+    "Eu me sento ao seu lado e dobro as pernas em cima do sofá. Meu joelho encosta no seu. "
+    "No entanto, eu não me afasto; fico ali, sentindo seu calor. "
+    "A chuva começa lá fora e bate na janela do quarto. Eu encosto a cabeça no seu ombro e respiro fundo.",
+    # Laura: boate, com conflito e cenário misturado
+    "A música da boate vibra no meu peito quando eu desço do palco. O camarim está vazio e eu respiro aliviada. "
+    "Mary olha para você do outro lado do salão e sorri. Eu ajeito o salto e caminho até o balcão. "
+    "— Você veio mesmo. Achei que não ia aparecer hoje.\n\n"
+    "O DJ troca a batida e as luzes ficam vermelhas. Eu apoio o cotovelo no balcão e te olho de perto. "
+    "Todavia, eu sei que o Janio pode chegar a qualquer momento, e isso me deixa inquieta. "
+    "O dono da boate passa por trás de mim e eu finjo que não vejo.\n\n"
+    "— Me paga uma água? Hoje eu não bebo. Eu sorrio de canto e toco seu braço, só por um segundo. "
+    "Mediante o barulho, eu chego mais perto para você me ouvir. Meu perfume é de baunilha e eu sei que você repara.",
+    # Narith: retórica e contagens que o refinador corta
+    "Eu deslizo pela penumbra do templo e os tendrils se enrolam no meu pulso, quentes. "
+    "Humanos são frágeis e previsíveis, sempre correndo atrás do que não entendem. "
+    "3 tendrils tocam seu rosto com cuidado, medindo cada respiração sua. "
+    "Eu inclino a cabeça e meus olhos brilham em âmbar. — Você voltou. Eu sabia que voltaria.\n\n"
+    "O ar cheira a incenso e chuva. Eu caminho em volta de você, devagar, e a luz das velas treme. "
+    "Contudo, eu não tenho pressa; o tempo aqui dentro obedece a mim. "
+    "Meus dedos roçam sua nuca e eu sinto seu arrepio. Eu sorrio, satisfeita.\n\n"
+    "— Fique. A noite é longa e eu quero ouvir sua voz. Os tendrils recuam e eu paro bem à sua frente.",
+    # resposta longa genérica, vários parágrafos
+    ("Eu ajeito o cabelo atrás da orelha e te olho de lado. O café ainda está quente e a loja está quase vazia. "
+     "A vitrine reflete a rua molhada e as pessoas passando apressadas. Eu dobro a última blusa do estoque. ") * 3
+    + "\n\n— Você chegou na hora certa. Eu estava pensando em você. Aguardo você sempre nesse horário, sabia? "
+    "Eu puxo a cadeira do caixa para perto. Nossos joelhos se tocam e eu não me afasto. "
+    "Por conseguinte, a tarde fica leve, do jeito que eu gosto.",
+]
+
+PROMPTS: List[str] = [
+    "Oi, cheguei. Vamos dar uma volta na praia?",
+    "Me conta como foi seu dia, sem pressa.",
+    "Você está linda hoje. Posso sentar do seu lado?",
+    "Vamos para casa? Está começando a chover.",
+    "Fica mais um pouco comigo.",
+]
+
+LOCAIS: Dict[str, str] = {
+    "Mary": "praia",
+    "Laura": "boate",
+    "Narith": "",
+}
@@ -0,0 +1,224 @@
+# benchmarks/run.py
+"""
+Benchmarks dos caminhos quentes de um turno, herméticos: repositório em memória
+(REPO_BACKEND=memoria) e provedor `local/` com latência zero, então o tempo medido
+é só o nosso (montagem do contexto, pós-processo, persistência).
+REPO_BACKEND=sqlite mede o backend SQLite (arquivo temporário) no lugar da memória.
+
+Uso:
+    python -m benchmarks.run                          # tudo, grava bench_output.json
+    python -m benchmarks.run --so toklen,pos          # só alguns grupos
+    python -m benchmarks.run --base antes.json        # compara e falha se regrediu
+
+Grupos: toklen, pos (_pos_processar_seguro), historico (_montar_historico),
+turno (gerar_resposta para Mary/Laura/Narith com 10, 400 e 5.000 turnos).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# settings são lidas no import de core.*: o ambiente do benchmark vem antes
+os.environ.setdefault("REPO_BACKEND", "memoria")
+os.environ.setdefault("SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.sqlite3"))
+os.environ.setdefault("HIST_JANELA_TURNOS", "0")  # compactação em 2º plano distorce as medidas
+os.environ.setdefault("MARY_ESPECULATIVO", "off")
+os.environ.setdefault("CACHE_TIER", "")
+os.environ.setdefault("METRICS_DESTINO", "")
+
+from core.config import settings  # noqa: E402
+from core.database import get_col  # noqa: E402
+from core.repositories import ensure_indexes, save_interaction  # noqa: E402
+from core.service import _montar_historico, _pos_processar_seguro, gerar_resposta  # noqa: E402
+from core.tokens import toklen  # noqa: E402
+
+from .corpus import LOCAIS, PROMPTS, RESPOSTAS  # noqa: E402
+
+MODELO = "local/bench?latencia_ms=0&ttft_ms=0&chunks_s=0&erro=0"
+PERSONAGENS = ("Mary", "Laura", "Narith")
+TAMANHOS = (10, 400, 5000)
+GRUPOS = ("toklen", "pos", "historico", "turno")
+_COLECOES = (
+    "mary_historia", "mary_state", "mary_eventos", "mary_perfil", "mary_resumo", "mary_indice", "mary_uso",
+)
+
+
+def _medir(nome: str, fn: Callable[[], Any], repeticoes: int, aquecimento: int = 1) -> Dict[str, Any]:
+    for _ in range(aquecimento):
+        fn()
+    amostras: List[float] = []
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        fn()
+        amostras.append((time.perf_counter() - t0) * 1000.0)
+    amostras.sort()
+    p95 = amostras[min(len(amostras) - 1, int(round(0.95 * (len(amostras) - 1))))]
+    res = {
+        "nome": nome,
+        "n": len(amostras),
+        "min_ms": round(amostras[0], 3),
+        "p50_ms": round(statistics.median(amostras), 3),
+        "p95_ms": round(p95, 3),
+        "media_ms": round(statistics.fmean(amostras), 3),
+    }
+    print(f"{nome:<40} p50 {res['p50_ms']:>10.3f} ms   p95 {res['p95_ms']:>10.3f} ms   (n={res['n']})", flush=True)
+    return res
+
+
+def _usuario_key(usuario: str, char: str) -> str:
+    # mesma regra de core.service._preparar_turno
+    return usuario if char.lower() == "mary" else f"{usuario}::{char.lower()}"
+
+
+def _limpar() -> None:
+    for nome in _COLECOES:
+        get_col(nome).delete_many({})
+
+
+def _semear(usuario_key: str, turnos: int) -> None:
+    for i in range(turnos):
+        save_interaction(
+            usuario_key,
+            PROMPTS[i % len(PROMPTS)],
+            RESPOSTAS[i % len(RESPOSTAS)],
+            "Local:bench",
+        )
+
+
+# ---------------- grupos ----------------
+def bench_toklen(rep: int) -> List[Dict[str, Any]]:
+    curto = PROMPTS[0]
+    medio = RESPOSTAS[0]
+    longo = "\n\n".join(RESPOSTAS * 40)
+    return [
+        _medir("toklen/curto", lambda: toklen(curto), rep * 20),
+        _medir("toklen/resposta", lambda: toklen(medio), rep * 20),
+        _medir(f"toklen/longo_{len(longo)//1000}k_chars", lambda: toklen(longo), rep),
+    ]
+
+
+def bench_pos(rep: int) -> List[Dict[str, Any]]:
+    out = []
+    for char in PERSONAGENS:
+        def _rodar(char: str = char) -> None:
+            for i, txt in enumerate(RESPOSTAS):
+                _pos_processar_seguro(
+                    txt,
+                    local_atual=LOCAIS[char],
+                    character=char,
+                    user_prompt=PROMPTS[i % len(PROMPTS)],
+                    ultima_resposta=RESPOSTAS[i - 1],
+                )
+        out.append(_medir(f"pos/{char.lower()}/corpus_{len(RESPOSTAS)}", _rodar, rep * 4))
+    return out
+
+
+def bench_historico(rep: int) -> List[Dict[str, Any]]:
+    out = []
+    for n in TAMANHOS:
+        _limpar()
+        u = f"bench-hist-{n}"
+        _semear(u, n)
+        out.append(_medir(f"historico/{n}_turnos", lambda u=u: _montar_historico(u, []), rep))
+    _limpar()
+    return out
+
+
+def bench_turno(rep: int) -> List[Dict[str, Any]]:
+    out = []
+    for n in TAMANHOS:
+        for char in PERSONAGENS:
+            _limpar()
+            usuario = f"bench-{n}"
+            _semear(_usuario_key(usuario, char), n)
+            prompts = iter(PROMPTS * (rep + 2))
+            out.append(_medir(
+                f"turno/{char.lower()}/{n}_turnos",
+                lambda usuario=usuario, char=char: gerar_resposta(usuario, next(prompts), MODELO, char),
+                rep,
+            ))
+    _limpar()
+    return out
+
+
+_BENCHES: Dict[str, Callable[[int], List[Dict[str, Any]]]] = {
+    "toklen": bench_toklen,
+    "pos": bench_pos,
+    "historico": bench_historico,
+    "turno": bench_turno,
+}
+
+
+# ---------------- saída ----------------
+def _git_rev() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _comparar(atual: List[Dict[str, Any]], base_path: str, tolerancia: float) -> List[str]:
+    with open(base_path, encoding="utf-8") as f:
+        base = {r["nome"]: r for r in json.load(f).get("resultados", [])}
+    piores = []
+    for r in atual:
+        b = base.get(r["nome"])
+        if b and b["p50_ms"] > 0 and r["p50_ms"] > b["p50_ms"] * (1 + tolerancia):
+            piores.append(f"{r['nome']}: p50 {b['p50_ms']:.3f} -> {r['p50_ms']:.3f} ms")
+    return piores
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Benchmarks dos caminhos quentes do turno.")
+    ap.add_argument("--so", default=",".join(GRUPOS), help="grupos separados por vírgula")
+    ap.add_argument("--repeticoes", type=int, default=5)
+    ap.add_argument("--out", default="bench_output.json")
+    ap.add_argument("--base", default="", help="JSON de uma execução anterior para comparar")
+    ap.add_argument("--tolerancia", type=float, default=0.25, help="regressão tolerada no p50 (fração)")
+    args = ap.parse_args(argv)
+
+    grupos = [g.strip() for g in args.so.split(",") if g.strip()]
+    desconhecidos = set(grupos) - set(GRUPOS)
+    if desconhecidos:
+        ap.error(f"grupos desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    ensure_indexes()
+    resultados: List[Dict[str, Any]] = []
+    for g in grupos:
+        resultados.extend(_BENCHES[g](args.repeticoes))
+
+    relatorio = {
+        "meta": {
+            "quando": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "plataforma": platform.platform(),
+            "repeticoes": args.repeticoes,
+            "modelo": MODELO,
+            "backend": settings.REPO_BACKEND,
+        },
+        "resultados": resultados,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(relatorio, f, ensure_ascii=False, indent=2)
+    print(f"→ {args.out}")
+
+    if args.base:
+        piores = _comparar(resultados, args.base, args.tolerancia)
+        for linha in piores:
+            print(f"REGRESSÃO {linha}", file=sys.stderr)
+        return 1 if piores else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
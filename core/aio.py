@@ -0,0 +1,77 @@
+# core/aio.py
+"""
+Ponte entre o Streamlit (código síncrono, uma thread por sessão) e um único event
+loop asyncio por processo, rodando numa thread daemon. Todas as sessões submetem
+corrotinas para o mesmo loop e, assim, compartilham os clientes HTTP assíncronos
+(pool de conexões keep-alive / HTTP/2) em vez de cada uma prender uma thread em I/O.
+"""
+import asyncio
+import queue
+import threading
+from typing import Any, AsyncIterator, Awaitable, Iterator, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Loop compartilhado do processo (criado na primeira chamada)."""
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="aio-bridge", daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def run(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """Roda a corrotina no loop compartilhado e bloqueia a thread chamadora até o fim."""
+    fut = asyncio.run_coroutine_threadsafe(coro, get_loop())
+    try:
+        return fut.result(timeout)
+    except BaseException:
+        fut.cancel()
+        raise
+
+
+def gather(*coros: Awaitable[Any]) -> List[Any]:
+    """Várias corrotinas em paralelo no loop compartilhado; resultados na ordem dada."""
+    async def _all() -> List[Any]:
+        return list(await asyncio.gather(*coros))
+    return run(_all())
+
+
+_FIM = object()
+
+
+def iterate(agen: AsyncIterator[T]) -> Iterator[T]:
+    """
+    Consome um gerador assíncrono no loop compartilhado e entrega os itens como um
+    iterador síncrono (para o streaming no Streamlit). Fechar o iterador cancela o stream.
+    """
+    q: "queue.Queue[Any]" = queue.Queue()
+
+    async def _pump() -> None:
+        try:
+            async for item in agen:
+                q.put(item)
+        except BaseException as e:  # inclui CancelledError: repassa para quem consome
+            q.put(e)
+        finally:
+            q.put(_FIM)
+
+    fut = asyncio.run_coroutine_threadsafe(_pump(), get_loop())
+    try:
+        while True:
+            item = q.get()
+            if item is _FIM:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not fut.done():
+            fut.cancel()
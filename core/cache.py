@@ -0,0 +1,205 @@
+# core/cache.py
+"""
+Cache endereçado por conteúdo para chamadas auxiliares ao LLM (ex.: reescrita em
+1ª pessoa). Chave = sha256(modelo + mensagens normalizadas + parâmetros de geração).
+
+Camadas:
+  1) LRU em processo (sempre), com TTL;
+  2) opcional, por settings.CACHE_TIER: "mongo" (coleção `mary_cache`, índice TTL)
+     ou "disco" (SQLite em settings.CACHE_PATH), ambas com teto de tamanho.
+"""
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from .config import settings
+
+_PARAMS = ("max_tokens", "temperature", "top_p", "stop")
+
+
+def cache_key(model: str, payload: Dict[str, Any]) -> str:
+    msgs = [
+        {"role": m.get("role", ""), "content": re.sub(r"\s+", " ", (m.get("content") or "")).strip()}
+        for m in payload.get("messages") or []
+    ]
+    base = {"model": model, "messages": msgs, **{k: payload.get(k) for k in _PARAMS}}
+    return hashlib.sha256(json.dumps(base, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class _LRU:
+    def __init__(self, max_items: int, ttl_s: int):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._d: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._d.get(key)
+            if item is None:
+                return None
+            ts, val = item
+            if time.time() - ts > self.ttl_s:
+                del self._d[key]
+                return None
+            self._d.move_to_end(key)
+            return val
+
+    def put(self, key: str, val: Any) -> None:
+        with self._lock:
+            self._d[key] = (time.time(), val)
+            self._d.move_to_end(key)
+            while len(self._d) > self.max_items:
+                self._d.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._d)
+
+
+class _MongoTier:
+    """Coleção `mary_cache` com índice TTL em `criado_em` e poda dos mais antigos."""
+
+    _PODA_A_CADA = 50
+
+    def __init__(self, max_items: int, ttl_s: int):
+        from .database import get_col
+        self.col = get_col("mary_cache")
+        self.max_items = max_items
+        self.col.create_index("criado_em", expireAfterSeconds=ttl_s)
+        self._escritas = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        d = self.col.find_one({"_id": key}, {"data": 1})
+        return d.get("data") if d else None
+
+    def put(self, key: str, val: Any) -> None:
+        self.col.replace_one({"_id": key}, {"_id": key, "data": val, "criado_em": datetime.utcnow()}, upsert=True)
+        self._escritas += 1
+        if self._escritas % self._PODA_A_CADA == 0:
+            excesso = self.col.estimated_document_count() - self.max_items
+            if excesso > 0:
+                velhos = [d["_id"] for d in self.col.find({}, {"_id": 1}).sort("criado_em", 1).limit(excesso)]
+                self.col.delete_many({"_id": {"$in": velhos}})
+
+
+class _DiskTier:
+    """SQLite local (WAL): uma tabela chave -> JSON, com TTL e teto de itens."""
+
+    def __init__(self, path: str, max_items: int, ttl_s: int):
+        self.max_items = max_items
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS cache (k TEXT PRIMARY KEY, v TEXT, ts REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS cache_ts ON cache(ts)")
+        self.db.commit()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self.db.execute("SELECT v, ts FROM cache WHERE k = ?", (key,)).fetchone()
+        if not row or time.time() - row[1] > self.ttl_s:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, val: Any) -> None:
+        with self._lock:
+            self.db.execute("REPLACE INTO cache (k, v, ts) VALUES (?, ?, ?)", (key, json.dumps(val), time.time()))
+            self.db.execute("DELETE FROM cache WHERE ts < ?", (time.time() - self.ttl_s,))
+            self.db.execute(
+                "DELETE FROM cache WHERE k IN (SELECT k FROM cache ORDER BY ts DESC LIMIT -1 OFFSET ?)",
+                (self.max_items,),
+            )
+            self.db.commit()
+
+
+class ResponseCache:
+    def __init__(self) -> None:
+        ttl_s = settings.CACHE_TTL_S
+        self.lru = _LRU(settings.CACHE_MAX_ITENS, ttl_s)
+        self.tier: Any = None
+        self.stats: Dict[str, int] = {"hits_mem": 0, "hits_tier": 0, "misses": 0, "erros_tier": 0}
+        self._lock = threading.Lock()
+        try:
+            if settings.CACHE_TIER == "mongo":
+                self.tier = _MongoTier(settings.CACHE_MAX_ITENS_TIER, ttl_s)
+            elif settings.CACHE_TIER == "disco":
+                self.tier = _DiskTier(settings.CACHE_PATH, settings.CACHE_MAX_ITENS_TIER, ttl_s)
+        except Exception:
+            self.tier = None
+
+    def _conta(self, nome: str) -> None:
+        with self._lock:
+            self.stats[nome] += 1
+
+    def get(self, key: str) -> Optional[Any]:
+        val = self.lru.get(key)
+        if val is not None:
+            self._conta("hits_mem")
+            return val
+        if self.tier is not None:
+            try:
+                val = self.tier.get(key)
+            except Exception:
+                self._conta("erros_tier")
+                val = None
+            if val is not None:
+                self._conta("hits_tier")
+                self.lru.put(key, val)
+                return val
+        self._conta("misses")
+        return None
+
+    def put(self, key: str, val: Any) -> None:
+        self.lru.put(key, val)
+        if self.tier is not None:
+            try:
+                self.tier.put(key, val)
+            except Exception:
+                self._conta("erros_tier")
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self.stats)
+        out["itens_mem"] = len(self.lru)
+        return out
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
+
+def cache_stats() -> Dict[str, int]:
+    """Contadores de hit/miss do cache de chamadas auxiliares."""
+    return get_cache().snapshot()
+
+def cached_chat(
+    model: str,
+    payload: Dict[str, Any],
+    route: Callable[[str, Dict[str, Any]], Tuple[Dict[str, Any], str, str]],
+) -> Tuple[Dict[str, Any], str, str]:
+    """
+    Mesmo contrato de `route_chat_strict`, servido do cache quando possível.
+    Só respostas com texto são guardadas.
+    """
+    cache = get_cache()
+    key = cache_key(model, payload)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit["data"], hit["used_model"], hit["provider"]
+    data, used_model, provider = route(model, payload)
+    if ((data.get("choices") or [{}])[0].get("message") or {}).get("content"):
+        cache.put(key, {"data": data, "used_model": used_model, "provider": provider})
+    return data, used_model, provider
@@ -0,0 +1,101 @@
+# core/catalog.py
+"""
+Catálogo dos modelos do seletor (main.py MODEL_OPTIONS):
+
+- preço por 1M de tokens (entrada/saída, USD) para estimar o custo de cada
+  chamada. Os preços são os de tabela dos provedores e mudam; quando o provedor
+  informa `usage.cost`, vale o dele;
+- janela de contexto, teto de saída do provedor e família do tokenizador, que
+  definem o `max_tokens` do turno e o orçamento do histórico no prompt
+  (`max_tokens` e `orcamento_prompt`). `raciocinio` reserva saída extra para
+  modelos que pensam antes de responder.
+
+Modelos fora do catálogo custam 0 e recebem limites conservadores (`_PADRAO`).
+Chave: o nome como o usuário escolhe (com o prefixo "together/" ou "local/").
+"""
+import math
+from typing import Any, Dict, Optional
+
+_CATALOGO: Dict[str, Dict[str, Any]] = {
+    # OpenRouter
+    "deepseek/deepseek-chat-v3-0324": {
+        "entrada": 0.27, "saida": 1.10, "contexto": 163_840, "saida_max": 8_192, "tokenizador": "deepseek",
+    },
+    "anthropic/claude-3.5-haiku": {
+        "entrada": 0.80, "saida": 4.00, "contexto": 200_000, "saida_max": 8_192, "tokenizador": "claude",
+    },
+    "thedrummer/anubis-70b-v1.1": {
+        "entrada": 0.50, "saida": 0.80, "contexto": 131_072, "saida_max": 4_096, "tokenizador": "llama3",
+    },
+    "qwen/qwen3-max": {
+        "entrada": 1.20, "saida": 6.00, "contexto": 262_144, "saida_max": 32_768, "tokenizador": "qwen",
+    },
+    "nousresearch/hermes-3-llama-3.1-405b": {
+        "entrada": 1.00, "saida": 1.00, "contexto": 131_072, "saida_max": 8_192, "tokenizador": "llama3",
+    },
+    # Together
+    "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo": {
+        "entrada": 3.50, "saida": 3.50, "contexto": 130_815, "saida_max": 8_192, "tokenizador": "llama3",
+    },
+    "together/Qwen/Qwen2.5-72B-Instruct": {
+        "entrada": 1.20, "saida": 1.20, "contexto": 32_768, "saida_max": 8_192, "tokenizador": "qwen",
+    },
+    "together/Qwen/QwQ-32B": {
+        "entrada": 1.20, "saida": 1.20, "contexto": 32_768, "saida_max": 16_384, "tokenizador": "qwen",
+        "raciocinio": 4_096,
+    },
+}
+
+# limites de quem não está no catálogo; "local/..." é o provedor de mentira (sem custo)
+_PADRAO: Dict[str, Any] = {"contexto": 32_768, "saida_max": 4_096, "tokenizador": ""}
+_LOCAL: Dict[str, Any] = {"contexto": 131_072, "saida_max": 4_096, "tokenizador": "cl100k"}
+
+# tokens do modelo ÷ tokens cl100k (o que core/tokens.toklen conta), em texto pt-BR;
+# aproximado e para cima: o orçamento erra para sobrar, não para estourar
+_FATOR_TOKENIZADOR = {"cl100k": 1.0, "llama3": 1.0, "qwen": 1.1, "deepseek": 1.1, "claude": 1.2}
+_FATOR_DESCONHECIDO = 1.25
+
+_FOLGA = 0.95  # formatação das mensagens (papéis, separadores) que o toklen não vê
+
+_PREFIXO = {"Together": "together/", "Local": "local/"}
+
+
+def chave(provider: str, used_model: str) -> str:
+    """Nome de catálogo a partir do que o router devolve (provider, used_model)."""
+    return _PREFIXO.get(provider, "") + used_model
+
+
+def modelo(nome: str) -> Optional[Dict[str, Any]]:
+    return _CATALOGO.get(nome)
+
+
+def limites(nome: str) -> Dict[str, Any]:
+    """Contexto, teto de saída e tokenizador do modelo (com os padrões para quem falta)."""
+    nome = (nome or "").partition("?")[0]  # "local/x?latencia_ms=..." -> "local/x"
+    base = _LOCAL if nome.startswith("local/") else _PADRAO
+    return {**base, **_CATALOGO.get(nome, {})}
+
+
+def fator_tokens(nome: str) -> float:
+    return _FATOR_TOKENIZADOR.get(limites(nome)["tokenizador"], _FATOR_DESCONHECIDO)
+
+
+def max_tokens(nome: str, alvo: int) -> int:
+    """`max_tokens` para uma resposta de ~`alvo` tokens (cl100k) neste modelo."""
+    m = limites(nome)
+    n = math.ceil(alvo * fator_tokens(nome)) + int(m.get("raciocinio") or 0)
+    return max(1, min(n, int(m["saida_max"])))
+
+
+def orcamento_prompt(nome: str, max_saida: int) -> int:
+    """Tokens (cl100k) que o prompt pode ocupar sem estourar a janela, com `max_saida` reservados."""
+    m = limites(nome)
+    return max(0, int((int(m["contexto"]) - max_saida) / fator_tokens(nome) * _FOLGA))
+
+
+def custo(nome: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Custo estimado em USD de uma chamada (0 para modelos sem preço)."""
+    m = _CATALOGO.get(nome)
+    if not m:
+        return 0.0
+    return round((prompt_tokens * m["entrada"] + completion_tokens * m["saida"]) / 1_000_000, 8)
@@ -0,0 +1,108 @@
+# core/compaction.py
+"""
+Memória de cena: dobra os turnos que saíram da janela crua num resumo persistente
+por usuario_key (coleção `mary_resumo`). O resumo entra no prompt no lugar desses
+turnos e é atualizado de forma incremental (resumo anterior + turnos novos).
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+from . import scheduler
+from .config import settings
+from .repositories import history_aged_out, get_scene_summary, save_scene_summary
+from .service_router import route_chat_strict
+from .tokens import toklen
+
+# teto de texto cru por chamada de resumo; o que passar fica para a próxima rodada
+_LOTE_TOKENS = 12_000
+
+_RESUMO_SYSTEM = (
+    "Você mantém a MEMÓRIA DE CENA de um roleplay. Receberá o resumo atual e novos turnos antigos. "
+    "Devolva o resumo ATUALIZADO em português, em tópicos curtos, preservando: fatos canônicos, "
+    "nomes, relações, locais visitados, decisões, promessas, eventos marcantes e o estado emocional atual. "
+    "Não invente nada; não escreva a próxima cena; no máximo ~400 palavras."
+)
+
+_em_andamento: set = set()
+_lock = threading.Lock()
+
+
+def _transcricao(docs: List[Dict[str, Any]]) -> str:
+    linhas: List[str] = []
+    for d in docs:
+        linhas.append(f"USUÁRIO: {(d.get('mensagem_usuario') or '').strip()}")
+        linhas.append(f"PERSONAGEM: {(d.get('resposta_mary') or '').strip()}")
+    return "\n".join(linhas)
+
+
+def _lote(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Prefixo dos turnos que cabe em `_LOTE_TOKENS` (ao menos um)."""
+    total, out = 0, []
+    for d in docs:
+        t = (d.get("tok_usuario") or 0) + (d.get("tok_resposta") or 0) or toklen(
+            (d.get("mensagem_usuario") or "") + " " + (d.get("resposta_mary") or "")
+        )
+        if out and total + t > _LOTE_TOKENS:
+            break
+        out.append(d)
+        total += t
+    return out
+
+
+def compactar(usuario_key: str, model: str, janela: Optional[int] = None) -> int:
+    """
+    Dobra no resumo os turnos fora da janela que ainda não foram resumidos.
+    Devolve quantos turnos entraram no resumo (0 se não havia nada a fazer).
+    """
+    janela = settings.HIST_JANELA_TURNOS if janela is None else janela
+    if janela <= 0:
+        return 0
+    modelo = settings.RESUMO_MODELO or model
+    feitos = 0
+    while True:
+        atual = get_scene_summary(usuario_key) or {}
+        pendentes = history_aged_out(usuario_key, janela, apos_id=atual.get("ate_id"))
+        lote = _lote(pendentes)
+        if not lote:
+            return feitos
+        messages = [
+            {"role": "system", "content": _RESUMO_SYSTEM},
+            {"role": "user", "content": (
+                f"RESUMO ATUAL:\n{atual.get('resumo') or '—'}\n\n"
+                f"TURNOS NOVOS (mais antigos primeiro):\n{_transcricao(lote)}"
+            )},
+        ]
+        data, _, _ = route_chat_strict(modelo, {
+            "model": modelo, "messages": messages, "max_tokens": 900, "temperature": 0.2,
+        })
+        resumo = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
+        if not resumo.strip():
+            return feitos
+        save_scene_summary(usuario_key, resumo.strip(), lote[-1]["_id"], len(lote))
+        feitos += len(lote)
+
+
+def agendar_compactacao(usuario_key: str, model: str) -> None:
+    """
+    Roda `compactar` numa thread daemon; no máximo uma por usuario_key e
+    settings.RESUMO_WORKERS no processo. Quem não coube fica para o próximo turno.
+    """
+    if settings.HIST_JANELA_TURNOS <= 0:
+        return
+    with _lock:
+        if usuario_key in _em_andamento or len(_em_andamento) >= max(1, settings.RESUMO_WORKERS):
+            return
+        _em_andamento.add(usuario_key)
+
+    def _run() -> None:
+        try:
+            with scheduler.em_nome_de(usuario_key):  # o resumo entra no uso do usuário
+                compactar(usuario_key, model)
+        except Exception:
+            # resumo é otimização: se falhar, o histórico cru continua valendo
+            pass
+        finally:
+            with _lock:
+                _em_andamento.discard(usuario_key)
+
+    threading.Thread(target=_run, name=f"compactacao:{usuario_key}", daemon=True).start()
@@ -27,6 +27,21 @@ class _Settings:
     MONGO_USER = _get("MONGO_USER", "")
     MONGO_PASS = _get("MONGO_PASS", "")
     MONGO_CLUSTER = _get("MONGO_CLUSTER", "")
+    # Backend dos repositórios: "mongo" (padrão, Atlas) | "memoria" (em processo,
+    # core/memstore.py) | "sqlite" (arquivo local em WAL, core/sqlstore.py)
+    REPO_BACKEND = _get("REPO_BACKEND", "mongo").strip().lower()
+    SQLITE_PATH = _get("SQLITE_PATH", "roleplay.sqlite3")
+
+    # Escritas do fim do turno numa fila em 2º plano ("0" grava na hora)
+    WRITE_BEHIND = _get("WRITE_BEHIND", "1").strip().lower() not in {"0", "false", "off"}
+    WB_MAX_PENDENTES = int(_get("WB_MAX_PENDENTES", "5000") or 5000)
+    WB_LOTE = int(_get("WB_LOTE", "200") or 200)
+    WB_TIMEOUT_S = float(_get("WB_TIMEOUT_S", "10") or 10)  # espera máx. antes de ler / ao sair
+    # Escrita que falha volta à fila com backoff (WB_BACKOFF_S, dobrando, até 30s) por até
+    # WB_TENTATIVAS vezes: com os padrões o banco pode sumir por ~30s sem perder nada; depois
+    # disso a escrita é descartada (só log e o contador de erros). $inc que falhou não volta
+    WB_TENTATIVAS = int(_get("WB_TENTATIVAS", "6") or 1)
+    WB_BACKOFF_S = float(_get("WB_BACKOFF_S", "1") or 0)
 
     # OpenRouter
     OPENROUTER_TOKEN = _get("OPENROUTER_TOKEN", "")
@@ -35,4 +50,74 @@ class _Settings:
     TOGETHER_API_KEY = _get("TOGETHER_API_KEY", "")
     TOGETHER_BASE_URL = _get("TOGETHER_BASE_URL", "https://api.together.xyz/v1")
 
+    # Provedor local de mentira (modelos "local/..."): latência, TTFT, ritmo e erros
+    LOCAL_LATENCIA_MS = float(_get("LOCAL_LATENCIA_MS", "800") or 0)
+    LOCAL_TTFT_MS = float(_get("LOCAL_TTFT_MS", "250") or 0)
+    LOCAL_CHUNKS_S = float(_get("LOCAL_CHUNKS_S", "30") or 0)
+    LOCAL_ERRO_TAXA = float(_get("LOCAL_ERRO_TAXA", "0") or 0)
+
+    # Clientes HTTP assíncronos com pool compartilhado ("0" força o cliente síncrono)
+    ASYNC_HTTP = _get("ASYNC_HTTP", "1").strip().lower()
+
+    # Transporte (core/transport.py): prazo do turno, timeout por tentativa, backoff e disjuntor
+    PROVIDER_PRAZO_S = float(_get("PROVIDER_PRAZO_S", "90") or 90)
+    PROVIDER_TIMEOUT_S = float(_get("PROVIDER_TIMEOUT_S", "60") or 60)
+    PROVIDER_TENTATIVAS = int(_get("PROVIDER_TENTATIVAS", "3") or 1)  # total, com a primeira
+    PROVIDER_BACKOFF_S = float(_get("PROVIDER_BACKOFF_S", "0.5") or 0)
+    PROVIDER_BACKOFF_MAX_S = float(_get("PROVIDER_BACKOFF_MAX_S", "8") or 0)
+    CB_FALHAS = int(_get("CB_FALHAS", "5") or 1)  # falhas seguidas que abrem o circuito
+    CB_ABERTO_S = float(_get("CB_ABERTO_S", "30") or 0)
+
+    # Agendador (core/scheduler.py): cotas por minuto "Provedor:n;..." (sem entrada = sem limite)
+    # e chamadas simultâneas por usuario_key (0 = sem limite)
+    LIMITE_RPM = _get("LIMITE_RPM", "")
+    LIMITE_TPM = _get("LIMITE_TPM", "")
+    LIMITE_RAJADA = float(_get("LIMITE_RAJADA", "0.25") or 1)  # fração da cota que pode sair de uma vez
+    USUARIO_CONCORRENCIA = int(_get("USUARIO_CONCORRENCIA", "2") or 0)
+
+    # Hedge (opt-in, requer httpx): "primario>equivalente;..." — passado o p95 do primário,
+    # dispara a mesma chamada no equivalente e fica com a primeira que der certo
+    HEDGE_EQUIVALENTES = _get("HEDGE_EQUIVALENTES", "")
+    LATENCIA_JANELA = int(_get("LATENCIA_JANELA", "200") or 1)  # amostras por provedor:modelo
+    HEDGE_MIN_AMOSTRAS = int(_get("HEDGE_MIN_AMOSTRAS", "20") or 1)  # antes disso não há p95 confiável
+
+    # Teto do histórico cru no prompt (tokens), além da janela de cada modelo (core/catalog.py):
+    # contexto longo sai caro em toda chamada
+    HIST_TETO_TOKENS = int(_get("HIST_TETO_TOKENS", "120000") or 120000)
+
+    # Memória de cena (opt-in): turnos fora da janela viram resumo numa chamada extra
+    # ao modelo em 2º plano (0 = desligada). Aponte RESUMO_MODELO para um modelo barato
+    HIST_JANELA_TURNOS = int(_get("HIST_JANELA_TURNOS", "0") or 0)
+    RESUMO_MODELO = _get("RESUMO_MODELO", "")  # vazio = mesmo modelo do turno
+    RESUMO_WORKERS = int(_get("RESUMO_WORKERS", "2") or 1)  # compactações simultâneas no processo
+
+    # Mary: reforço canônico especulativo: "off" | "paralelo" (normal + reforçada juntas)
+    # | "stream" (aborta o stream na 1ª frase que violar e refaz reforçada)
+    MARY_ESPECULATIVO = _get("MARY_ESPECULATIVO", "off").strip().lower()
+
+    # Cache de chamadas auxiliares: LRU em memória + camada opcional "mongo" | "disco"
+    CACHE_TIER = _get("CACHE_TIER", "").strip().lower()
+    CACHE_PATH = _get("CACHE_PATH", ".cache_llm.sqlite3")
+    CACHE_TTL_S = int(_get("CACHE_TTL_S", "86400") or 86400)
+    CACHE_MAX_ITENS = int(_get("CACHE_MAX_ITENS", "512") or 512)
+    CACHE_MAX_ITENS_TIER = int(_get("CACHE_MAX_ITENS_TIER", "20000") or 20000)
+
+    # Tempos por etapa de cada turno: "" (padrão: só o painel da sessão) | "jsonl" |
+    # "colecao" (opt-in: um documento em mary_metrics por turno)
+    METRICS_DESTINO = _get("METRICS_DESTINO", "").strip().lower()
+    METRICS_PATH = _get("METRICS_PATH", "metrics.jsonl")
+
+    # Sidebar: fatos/eventos ficam em cache na sessão até uma escrita do app ou este TTL
+    SIDEBAR_CACHE_TTL_S = float(_get("SIDEBAR_CACHE_TTL_S", "30") or 0)
+
+    # Busca no histórico (BM25, core/retrieval.py): turnos antigos injetados por pedido (0 desliga)
+    RECALL_TOP_K = int(_get("RECALL_TOP_K", "3") or 0)
+    RECALL_MAX_POSTAGENS = int(_get("RECALL_MAX_POSTAGENS", "800") or 0)  # teto de leitura por consulta
+
+    # Anti-eco: quantas respostas anteriores entram na comparação por impressão de sentença
+    ANTI_ECO_JANELA = int(_get("ANTI_ECO_JANELA", "3") or 0)
+
+    # Pós-processo: estágios desligados (nomes separados por vírgula, ver POS_PIPELINE)
+    POS_ESTAGIOS_OFF = _get("POS_ESTAGIOS_OFF", "")
+
 settings = _Settings()
@@ -1,12 +1,19 @@
+"""
+Acesso às coleções. Os repositórios só falam com `get_col(nome)` e usam um subconjunto
+da API do pymongo; `settings.REPO_BACKEND` escolhe quem atende:
+  - "mongo":   Atlas (mongodb+srv), padrão;
+  - "memoria": coleções em processo (core/memstore.py) — testes e benchmarks;
+  - "sqlite":  arquivo local em WAL (core/sqlstore.py) — deploy de um nó só.
+"""
 from urllib.parse import quote_plus
-from pymongo import MongoClient
 from .config import settings
 
 _client = None
 
-def get_client() -> MongoClient:
+def get_client():
     global _client
     if _client is None:
+        from pymongo import MongoClient
         uri = (
             f"mongodb+srv://{settings.MONGO_USER}:{quote_plus(settings.MONGO_PASS)}"
             f"@{settings.MONGO_CLUSTER}/?retryWrites=true&w=majority&appName={settings.APP_NAME}"
@@ -18,4 +25,11 @@ def get_db():
     return get_client().get_database(settings.APP_NAME)
 
 def get_col(name: str):
+    backend = settings.REPO_BACKEND
+    if backend == "memoria":
+        from .memstore import get_col as mem_col
+        return mem_col(name)
+    if backend == "sqlite":
+        from .sqlstore import get_col as sql_col
+        return sql_col(name)
     return get_db().get_collection(name)
@@ -0,0 +1,45 @@
+# core/latencia.py
+"""
+Latência recente por provedor:modelo (as últimas settings.LATENCIA_JANELA chamadas
+que deram certo), separada em "total" (chamada em bloco, ou stream até o fim) e
+"ttft" (até o primeiro pedaço do stream). Alimentada por core/transport.py; o
+service_router lê o p95 para decidir quando disparar o hedge.
+"""
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .config import settings
+
+_series: Dict[Tuple[str, str], Deque[float]] = {}
+_lock = threading.Lock()
+
+
+def registrar(chave: str, tipo: str, ms: float) -> None:
+    with _lock:
+        s = _series.get((chave, tipo))
+        if s is None:
+            s = _series[(chave, tipo)] = deque(maxlen=settings.LATENCIA_JANELA)
+        s.append(ms)
+
+
+def percentis(chave: str, tipo: str) -> Optional[Tuple[float, float]]:
+    """(p50, p95) em ms, ou None com menos de settings.HEDGE_MIN_AMOSTRAS amostras."""
+    with _lock:
+        amostras = sorted(_series.get((chave, tipo)) or ())
+    if len(amostras) < settings.HEDGE_MIN_AMOSTRAS:
+        return None
+    ultimo = len(amostras) - 1
+    return amostras[ultimo // 2], amostras[min(ultimo, int(round(0.95 * ultimo)))]
+
+
+def resumo() -> Dict[str, Dict[str, Tuple[float, float]]]:
+    """{provedor:modelo: {tipo: (p50, p95)}} de tudo que já tem amostras suficientes."""
+    with _lock:
+        chaves = list(_series)
+    out: Dict[str, Dict[str, Tuple[float, float]]] = {}
+    for chave, tipo in chaves:
+        p = percentis(chave, tipo)
+        if p is not None:
+            out.setdefault(chave, {})[tipo] = p
+    return out
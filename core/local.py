@@ -0,0 +1,130 @@
+# core/local.py
+"""
+Provedor local de mentira (OpenAI-like, em processo) para testes de carga e latência
+sem rede nem custo. Modelos com prefixo `local/` caem aqui pelo service_router.
+
+Respostas são determinísticas: o texto sai de um corpus fixo escolhido pelo hash das
+mensagens. Latência, TTFT, ritmo do stream e taxa de erro vêm de settings.LOCAL_* e
+podem ser sobrescritos no nome do modelo, ex.:
+    local/mary?ttft_ms=300&latencia_ms=1200&chunks_s=40&erro=0.05
+"""
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
+from urllib.parse import parse_qsl
+
+from .config import settings
+from .tokens import toklen
+from .transport import ErroProvedor
+
+_CORPUS: List[str] = [
+    "Eu sorrio devagar e encosto meu ombro no seu. — Fica mais um pouco comigo.\n\n"
+    "A luz da rua entra pela janela e desenha seu rosto. Eu respiro fundo, sem pressa.\n\n"
+    "Meus dedos acham os seus sobre a mesa. — Me conta do seu dia, quero ouvir tudo.",
+    "Eu ajeito o cabelo atrás da orelha e te olho de lado. O café ainda está quente.\n\n"
+    "— Você chegou na hora certa. Eu estava pensando em você.\n\n"
+    "Eu puxo a cadeira para perto. Nossos joelhos se tocam e eu não me afasto.",
+    "A brisa do mar levanta meu vestido de leve. Eu rio e seguro a barra com uma mão.\n\n"
+    "Com a outra, eu pego sua mão e caminho pela areia. — Vem, quero ver o pôr do sol.\n\n"
+    "Eu paro na beira da água e encosto a cabeça no seu peito.",
+    "Eu fecho a porta devagar e encosto as costas nela. Meu coração acelera.\n\n"
+    "— Aqui é só a gente. Eu gosto disso.\n\n"
+    "Eu dou um passo na sua direção e toco seu rosto com a ponta dos dedos.",
+]
+
+
+def _params(model: str) -> Tuple[str, Dict[str, float]]:
+    nome, _, qs = (model or "").partition("?")
+    p = {
+        "latencia_ms": float(settings.LOCAL_LATENCIA_MS),
+        "ttft_ms": float(settings.LOCAL_TTFT_MS),
+        "chunks_s": float(settings.LOCAL_CHUNKS_S),
+        "erro": float(settings.LOCAL_ERRO_TAXA),
+    }
+    for k, v in parse_qsl(qs):
+        if k in p:
+            p[k] = float(v)
+    return nome, p
+
+
+def _semente(payload: Dict[str, Any]) -> int:
+    base = json.dumps([payload.get("model"), payload.get("messages")], sort_keys=True, ensure_ascii=False)
+    return int.from_bytes(hashlib.sha256(base.encode("utf-8")).digest()[:8], "big")
+
+
+def _plano(payload: Dict[str, Any]) -> Tuple[str, Dict[str, float], str, bool]:
+    """(modelo, parâmetros, texto, falhar?) — tudo derivado do payload, sem aleatoriedade global."""
+    nome, p = _params(payload.get("model") or "")
+    seed = _semente(payload)
+    texto = _CORPUS[seed % len(_CORPUS)]
+    falhar = random.Random(seed).random() < p["erro"]
+    return nome, p, texto, falhar
+
+
+def _chunks(texto: str, tamanho: int = 12) -> List[str]:
+    return [texto[i:i + tamanho] for i in range(0, len(texto), tamanho)]
+
+
+def _resposta(nome: str, payload: Dict[str, Any], texto: str) -> Dict[str, Any]:
+    prompt_tokens = sum(toklen(m.get("content") or "") for m in payload.get("messages") or [])
+    completion_tokens = toklen(texto)
+    return {
+        "id": f"local-{_semente(payload):x}",
+        "model": nome,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": texto}, "finish_reason": "stop"}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def _estourou(ms: float, timeout: float) -> None:
+    # provedor "pendurado": a espera passou do timeout, como um ReadTimeout de verdade
+    if ms / 1000.0 > timeout:
+        raise ErroProvedor("Local error: timeout")
+
+
+def chat(payload: dict, timeout: int = 120, retries: int = 0) -> dict:
+    nome, p, texto, falhar = _plano(payload)
+    time.sleep(min(p["latencia_ms"] / 1000.0, timeout))
+    _estourou(p["latencia_ms"], timeout)
+    if falhar:
+        raise ErroProvedor("Local error: falha injetada", 503)
+    return _resposta(nome, payload, texto)
+
+def chat_stream(payload: dict, timeout: int = 120) -> Iterator[str]:
+    _nome, p, texto, falhar = _plano(payload)
+    time.sleep(min(p["ttft_ms"] / 1000.0, timeout))
+    _estourou(p["ttft_ms"], timeout)
+    if falhar:
+        raise ErroProvedor("Local error: falha injetada", 503)
+    passo = 1.0 / p["chunks_s"] if p["chunks_s"] > 0 else 0.0
+    for i, piece in enumerate(_chunks(texto)):
+        if i and passo:
+            time.sleep(passo)
+        yield piece
+
+async def achat(payload: dict, timeout: int = 120, retries: int = 0) -> dict:
+    nome, p, texto, falhar = _plano(payload)
+    await asyncio.sleep(min(p["latencia_ms"] / 1000.0, timeout))
+    _estourou(p["latencia_ms"], timeout)
+    if falhar:
+        raise ErroProvedor("Local error: falha injetada", 503)
+    return _resposta(nome, payload, texto)
+
+async def achat_stream(payload: dict, timeout: int = 120) -> AsyncIterator[str]:
+    _nome, p, texto, falhar = _plano(payload)
+    await asyncio.sleep(min(p["ttft_ms"] / 1000.0, timeout))
+    _estourou(p["ttft_ms"], timeout)
+    if falhar:
+        raise ErroProvedor("Local error: falha injetada", 503)
+    passo = 1.0 / p["chunks_s"] if p["chunks_s"] > 0 else 0.0
+    for i, piece in enumerate(_chunks(texto)):
+        if i and passo:
+            await asyncio.sleep(passo)
+        yield piece
@@ -0,0 +1,391 @@
+# core/memstore.py
+"""
+Coleções em memória com o subconjunto da API do pymongo que `core/repositories.py`
+usa (insert/find/update/delete, cursores com sort/skip/limit, projeções e os
+operadores $set/$unset/$inc/$setOnInsert, $gt/$gte/$lt/$lte/$ne/$in/$exists).
+Usado com REPO_BACKEND=memoria: testes e benchmarks herméticos, sem Atlas.
+`create_index` vira um mapa de igualdade (tupla dos campos -> docs): filtros que
+fixam todos os campos do índice (valor ou $in) não varrem a coleção.
+As funções de filtro/projeção/update também servem ao backend SQLite (core/sqlstore.py).
+"""
+import copy
+import itertools
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+_FALTA = object()
+_MULTI = object()  # chave dos docs com lista/subdocumento num campo indexado (sempre candidatos)
+_Sort = Union[str, Sequence[Tuple[str, int]]]
+
+
+def _get_path(doc: Dict[str, Any], path: str) -> Any:
+    cur: Any = doc
+    for part in path.split("."):
+        if not isinstance(cur, dict) or part not in cur:
+            return _FALTA
+        cur = cur[part]
+    return cur
+
+
+def _set_path(doc: Dict[str, Any], path: str, value: Any) -> None:
+    parts = path.split(".")
+    cur = doc
+    for part in parts[:-1]:
+        nxt = cur.get(part)
+        if not isinstance(nxt, dict):
+            nxt = {}
+            cur[part] = nxt
+        cur = nxt
+    cur[parts[-1]] = value
+
+
+def _unset_path(doc: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    cur = doc
+    for part in parts[:-1]:
+        cur = cur.get(part)
+        if not isinstance(cur, dict):
+            return
+    cur.pop(parts[-1], None)
+
+
+def _cmp(a: Any, b: Any, op: str) -> bool:
+    try:
+        if op == "$gt":
+            return a > b
+        if op == "$gte":
+            return a >= b
+        if op == "$lt":
+            return a < b
+        return a <= b
+    except TypeError:
+        return False
+
+
+def _match_cond(val: Any, cond: Any) -> bool:
+    if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+        for op, arg in cond.items():
+            if op == "$exists":
+                if (val is not _FALTA) != bool(arg):
+                    return False
+            elif op == "$in":
+                vals = val if isinstance(val, list) else [val]
+                if not any(v in arg for v in vals):
+                    return False
+            elif op == "$ne":
+                if _match_cond(val, arg):
+                    return False
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if val is _FALTA or not _cmp(val, arg, op):
+                    return False
+            else:
+                raise ValueError(f"operador não suportado: {op}")
+        return True
+    if val is _FALTA:
+        return cond is None
+    if isinstance(val, list) and not isinstance(cond, list):
+        return cond in val
+    return val == cond
+
+
+def matches(doc: Dict[str, Any], flt: Optional[Dict[str, Any]]) -> bool:
+    return all(_match_cond(_get_path(doc, k), v) for k, v in (flt or {}).items())
+
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(doc)
+    incluir = {k for k, v in projection.items() if v and k != "_id"}
+    sem_id = projection.get("_id", 1) in (0, False)
+    if not incluir:
+        # projeção só de exclusão
+        out = copy.deepcopy(doc)
+        for k, v in projection.items():
+            if not v:
+                _unset_path(out, k)
+        return out
+    out: Dict[str, Any] = {}
+    if not sem_id and "_id" in doc:
+        out["_id"] = doc["_id"]
+    for path in incluir:
+        val = _get_path(doc, path)
+        if val is not _FALTA:
+            _set_path(out, path, copy.deepcopy(val))
+    return out
+
+
+def _norm_sort(sort: _Sort, direction: int = 1) -> List[Tuple[str, int]]:
+    if isinstance(sort, str):
+        return [(sort, direction)]
+    return list(sort)
+
+
+def sort_docs(docs: List[Dict[str, Any]], spec: List[Tuple[str, int]]) -> List[Dict[str, Any]]:
+    for field, direction in reversed(spec):
+        def key(d: Dict[str, Any], f: str = field) -> Tuple[int, Any]:
+            v = _get_path(d, f)
+            return (0, None) if v is _FALTA or v is None else (1, v)
+        docs = sorted(docs, key=key, reverse=direction < 0)
+    return docs
+
+
+def apply_update(d: Dict[str, Any], update: Dict[str, Any], inserting: bool) -> None:
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for k, v in fields.items():
+                _set_path(d, k, copy.deepcopy(v))
+        elif op == "$unset":
+            for k in fields:
+                _unset_path(d, k)
+        elif op == "$inc":
+            for k, v in fields.items():
+                cur = _get_path(d, k)
+                _set_path(d, k, (0 if cur is _FALTA else cur) + v)
+        elif op != "$setOnInsert":
+            raise ValueError(f"operador de update não suportado: {op}")
+
+
+def upsert_doc(flt: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento novo de um upsert: igualdades do filtro + update com $setOnInsert."""
+    novo = {}
+    for k, v in flt.items():
+        if not (isinstance(v, dict) and any(op.startswith("$") for op in v)):
+            _set_path(novo, k, copy.deepcopy(v))
+    apply_update(novo, update, inserting=True)
+    return novo
+
+
+class Result:
+    """Resultado no formato do pymongo (inserted_id, matched_count, deleted_count...)."""
+
+    def __init__(self, **kw: Any):
+        self.__dict__.update(kw)
+
+
+class MemCursor:
+    def __init__(self, loader, projection: Optional[Dict[str, Any]]):
+        self._loader = loader
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._it: Optional[Iterator[Dict[str, Any]]] = None
+
+    def sort(self, key: _Sort, direction: int = 1) -> "MemCursor":
+        self._sort = _norm_sort(key, direction)
+        return self
+
+    def skip(self, n: int) -> "MemCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "MemCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, _n: int) -> "MemCursor":
+        return self
+
+    def close(self) -> None:
+        self._it = iter(())
+
+    def _run(self) -> Iterator[Dict[str, Any]]:
+        docs = self._loader()
+        if self._sort:
+            docs = sort_docs(docs, self._sort)
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return (project(d, self._projection) for d in docs)
+
+    def __iter__(self) -> "MemCursor":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._it is None:
+            self._it = self._run()
+        return next(self._it)
+
+
+def _chave_doc(d: Dict[str, Any], campos: Tuple[str, ...]) -> Any:
+    vals = []
+    for c in campos:
+        v = _get_path(d, c)
+        if v is _FALTA:
+            v = None
+        elif isinstance(v, (list, dict)):
+            return _MULTI
+        vals.append(v)
+    return tuple(vals)
+
+
+def _chaves_busca(flt: Dict[str, Any], campos: Tuple[str, ...]) -> Optional[List[Tuple[Any, ...]]]:
+    """Chaves do índice que o filtro alcança, ou None se ele não fixa todos os campos."""
+    opcoes = []
+    for c in campos:
+        cond = flt.get(c, _FALTA)
+        if isinstance(cond, dict) and list(cond) == ["$in"]:
+            opcoes.append(list(cond["$in"]))
+        elif cond is _FALTA or cond is None or isinstance(cond, (dict, list)):
+            return None
+        else:
+            opcoes.append([cond])
+    return list(itertools.product(*opcoes))
+
+
+class MemCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: List[Dict[str, Any]] = []
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._indices: List[Tuple[str, ...]] = []
+        self._mapas: Optional[List[Dict[Any, List[Dict[str, Any]]]]] = None  # None = refazer na leitura
+
+    # -------- índices --------
+    def _indexar(self, d: Dict[str, Any]) -> None:
+        if self._mapas is not None:
+            for campos, mapa in zip(self._indices, self._mapas):
+                mapa.setdefault(_chave_doc(d, campos), []).append(d)
+
+    def _mexe_no_indice(self, update: Dict[str, Any]) -> bool:
+        campos = {c for idx in self._indices for c in idx}
+        return any(
+            k == c or k.startswith(c + ".") or c.startswith(k + ".")
+            for fields in update.values() for k in fields for c in campos
+        )
+
+    def _candidatos(self, flt: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        if not flt or not self._indices:
+            return self._docs
+        if self._mapas is None:
+            self._mapas = [{} for _ in self._indices]
+            for d in self._docs:
+                self._indexar(d)
+        for campos, mapa in zip(self._indices, self._mapas):
+            chaves = _chaves_busca(flt, campos)
+            if chaves is None:
+                continue
+            try:
+                out = [d for k in chaves for d in mapa.get(k, ())]
+            except TypeError:  # valor não-hasheável no filtro
+                continue
+            return out + mapa.get(_MULTI, [])
+        return self._docs
+
+    # -------- leitura --------
+    def _select(self, flt: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [d for d in self._candidatos(flt) if matches(d, flt)]
+
+    def find(self, flt: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> MemCursor:
+        return MemCursor(lambda: self._select(flt), projection)
+
+    def find_one(
+        self, flt: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+        sort: Optional[_Sort] = None,
+    ) -> Optional[Dict[str, Any]]:
+        cur = self.find(flt, projection)
+        if sort:
+            cur.sort(sort)
+        return next(iter(cur.limit(1)), None)
+
+    def count_documents(self, flt: Optional[Dict[str, Any]] = None) -> int:
+        return len(self._select(flt))
+
+    def estimated_document_count(self) -> int:
+        return len(self._docs)
+
+    # -------- escrita --------
+    def insert_one(self, doc: Dict[str, Any]) -> Result:
+        with self._lock:
+            d = copy.deepcopy(doc)
+            d.setdefault("_id", next(self._ids))
+            doc.setdefault("_id", d["_id"])
+            self._docs.append(d)
+            self._indexar(d)
+            return Result(inserted_id=d["_id"])
+
+    def insert_many(self, docs: Sequence[Dict[str, Any]]) -> Result:
+        return Result(inserted_ids=[self.insert_one(d).inserted_id for d in docs])
+
+    def update_one(self, flt: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> Result:
+        with self._lock:
+            for d in self._candidatos(flt):
+                if matches(d, flt):
+                    apply_update(d, update, inserting=False)
+                    if self._mexe_no_indice(update):
+                        self._mapas = None
+                    return Result(matched_count=1, modified_count=1, upserted_id=None)
+            if not upsert:
+                return Result(matched_count=0, modified_count=0, upserted_id=None)
+            novo = upsert_doc(flt, update)
+            novo.setdefault("_id", next(self._ids))
+            self._docs.append(novo)
+            self._indexar(novo)
+            return Result(matched_count=0, modified_count=0, upserted_id=novo["_id"])
+
+    def update_many(self, flt: Dict[str, Any], update: Dict[str, Any]) -> Result:
+        with self._lock:
+            n = 0
+            for d in self._docs:
+                if matches(d, flt):
+                    apply_update(d, update, inserting=False)
+                    n += 1
+            if n and self._mexe_no_indice(update):
+                self._mapas = None
+            return Result(matched_count=n, modified_count=n)
+
+    def replace_one(self, flt: Dict[str, Any], doc: Dict[str, Any], upsert: bool = False) -> Result:
+        with self._lock:
+            for i, d in enumerate(self._docs):
+                if matches(d, flt):
+                    novo = copy.deepcopy(doc)
+                    novo.setdefault("_id", d["_id"])
+                    self._docs[i] = novo
+                    self._mapas = None
+                    return Result(matched_count=1, modified_count=1)
+            if upsert:
+                self.insert_one(doc)
+            return Result(matched_count=0, modified_count=0)
+
+    def delete_many(self, flt: Dict[str, Any]) -> Result:
+        with self._lock:
+            antes = len(self._docs)
+            self._docs = [d for d in self._docs if not matches(d, flt)]
+            self._mapas = None
+            return Result(deleted_count=antes - len(self._docs))
+
+    def delete_one(self, flt: Dict[str, Any]) -> Result:
+        with self._lock:
+            for i, d in enumerate(self._docs):
+                if matches(d, flt):
+                    del self._docs[i]
+                    self._mapas = None
+                    return Result(deleted_count=1)
+            return Result(deleted_count=0)
+
+    def create_index(self, keys: _Sort, **_k: Any) -> str:
+        campos = tuple(c for c, _ in _norm_sort(keys))
+        with self._lock:
+            if campos not in self._indices:
+                self._indices.append(campos)
+                self._indices.sort(key=len, reverse=True)  # o mais específico primeiro
+                self._mapas = None
+        return "_".join(campos)
+
+
+_cols: Dict[str, MemCollection] = {}
+_cols_lock = threading.Lock()
+
+def get_col(name: str) -> MemCollection:
+    with _cols_lock:
+        col = _cols.get(name)
+        if col is None:
+            col = _cols[name] = MemCollection(name)
+        return col
+
+def reset() -> None:
+    """Esvazia todas as coleções em memória (útil entre cenários de benchmark)."""
+    with _cols_lock:
+        _cols.clear()
@@ -0,0 +1,183 @@
+# core/metrics.py
+"""
+Cronometragem por etapa de um turno. `turno(...)` abre o registro (num ContextVar,
+então só vale para a thread/contexto do turno) e `span(nome)` mede um trecho
+dentro dele; fora de um turno, `span` e `cronometrado` não custam nada.
+
+Ao fechar, o turno vira um documento {total_ms, spans [nome, inicio_ms, dur_ms,
+nivel, attrs], tokens, provedor...} que fica em `ultimo_turno()` e é gravado
+conforme settings.METRICS_DESTINO: "" (padrão, não grava), "jsonl"
+(settings.METRICS_PATH) ou "colecao" (`mary_metrics`, pela fila write-behind).
+"""
+import functools
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+from .config import settings
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+class _Trace:
+    __slots__ = ("t0", "spans", "pilha", "attrs")
+
+    def __init__(self, attrs: Dict[str, Any]):
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.pilha: List[Dict[str, Any]] = []
+        self.attrs = attrs
+
+    def agora_ms(self) -> float:
+        return (time.perf_counter() - self.t0) * 1000.0
+
+
+_trace: ContextVar[Optional[_Trace]] = ContextVar("mary_trace", default=None)
+_ultimo: ContextVar[Optional[Dict[str, Any]]] = ContextVar("mary_ultimo_turno", default=None)
+
+
+@contextmanager
+def span(nome: str, **attrs: Any) -> Iterator[Dict[str, Any]]:
+    """Mede o bloco. O dict devolvido recebe atributos extras (tokens, provedor...)."""
+    tr = _trace.get()
+    if tr is None:
+        yield {}
+        return
+    reg = {"nome": nome, "inicio_ms": tr.agora_ms(), "dur_ms": 0.0, "nivel": len(tr.pilha), "attrs": attrs}
+    tr.spans.append(reg)
+    tr.pilha.append(reg)
+    try:
+        yield attrs
+    finally:
+        reg["dur_ms"] = tr.agora_ms() - reg["inicio_ms"]
+        tr.pilha.pop()
+
+
+def cronometrado(nome: Optional[str] = None) -> Callable[[F], F]:
+    """Decorador: a função vira um span (só quando há turno aberto)."""
+    def deco(fn: F) -> F:
+        rotulo = nome or fn.__name__
+
+        @functools.wraps(fn)
+        def wrap(*a: Any, **k: Any) -> Any:
+            if _trace.get() is None:
+                return fn(*a, **k)
+            with span(rotulo):
+                return fn(*a, **k)
+        return wrap  # type: ignore[return-value]
+    return deco
+
+
+def sub_tempos(tempos: Sequence[Tuple[str, float]]) -> None:
+    """Pendura (nome, segundos) já medidos — ex.: `ctx["_tempos"]` do pipeline — no span aberto."""
+    tr = _trace.get()
+    if tr is None or not tr.pilha:
+        return
+    pai = tr.pilha[-1]
+    cursor = pai["inicio_ms"]
+    for nome, seg in tempos:
+        dur = seg * 1000.0
+        tr.spans.append({"nome": nome, "inicio_ms": cursor, "dur_ms": dur, "nivel": len(tr.pilha), "attrs": {}})
+        cursor += dur
+
+
+def ativo() -> bool:
+    """Há um turno sendo medido neste contexto?"""
+    return _trace.get() is not None
+
+
+def anotar(**attrs: Any) -> None:
+    tr = _trace.get()
+    if tr is not None:
+        tr.attrs.update(attrs)
+
+
+def somar(**contadores: float) -> None:
+    """Acumula contadores do turno (ex.: tokens de todas as chamadas ao modelo)."""
+    tr = _trace.get()
+    if tr is not None:
+        for k, v in contadores.items():
+            tr.attrs[k] = tr.attrs.get(k, 0) + (v or 0)
+
+
+def usage_do(data: Dict[str, Any]) -> Dict[str, int]:
+    u = (data or {}).get("usage") or {}
+    return {
+        "prompt_tokens": int(u.get("prompt_tokens") or 0),
+        "completion_tokens": int(u.get("completion_tokens") or 0),
+    }
+
+
+@contextmanager
+def turno(**attrs: Any) -> Iterator[None]:
+    """Registro do turno; ao sair, fecha, guarda em `ultimo_turno()` e grava."""
+    tr = _Trace(dict(attrs))
+    token = _trace.set(tr)
+    erro: Optional[BaseException] = None
+    try:
+        yield
+    except BaseException as e:
+        erro = e
+        raise
+    finally:
+        try:
+            _trace.reset(token)
+        except ValueError:  # gerador finalizado em outro contexto
+            _trace.set(None)
+        doc = {
+            **tr.attrs,
+            "ts": datetime.utcnow(),
+            "total_ms": round(tr.agora_ms(), 3),
+            "erro": repr(erro) if erro is not None and not isinstance(erro, GeneratorExit) else None,
+            "spans": [
+                {**s, "inicio_ms": round(s["inicio_ms"], 3), "dur_ms": round(s["dur_ms"], 3)}
+                for s in tr.spans
+            ],
+        }
+        _ultimo.set(doc)
+        _gravar(doc)
+
+
+def ultimo_turno() -> Optional[Dict[str, Any]]:
+    """Registro do último turno concluído neste contexto (sessão do Streamlit)."""
+    return _ultimo.get()
+
+
+# -------- gravação --------
+_jsonl_lock = threading.Lock()
+
+def _gravar(doc: Dict[str, Any]) -> None:
+    destino = settings.METRICS_DESTINO
+    try:
+        if destino == "colecao":
+            if settings.WRITE_BEHIND:
+                from .writebehind import get_writer
+                get_writer().submit("\x00metrics", "mary_metrics", ("insert_one", dict(doc)))
+            else:
+                from .database import get_col
+                get_col("mary_metrics").insert_one(dict(doc))
+        elif destino == "jsonl":
+            linha = json.dumps(doc, ensure_ascii=False, default=str)
+            with _jsonl_lock, open(settings.METRICS_PATH, "a", encoding="utf-8") as f:
+                f.write(linha + "\n")
+    except Exception as e:
+        print(f"[metrics] falha ao gravar: {e!r}", file=sys.stderr)
+
+
+# -------- exibição --------
+def cascata(doc: Dict[str, Any], largura: int = 24) -> str:
+    """Waterfall em texto: um span por linha, barra posicionada no tempo do turno."""
+    total = max(float(doc.get("total_ms") or 0), 1e-6)
+    linhas = []
+    for s in doc.get("spans") or []:
+        ini = int(s["inicio_ms"] / total * largura)
+        tam = max(1, int(round(s["dur_ms"] / total * largura)))
+        barra = (" " * ini + "█" * tam)[:largura].ljust(largura)
+        nome = ("  " * s["nivel"] + s["nome"])[:26]
+        linhas.append(f"{nome:<26} {barra} {s['dur_ms']:8.1f} ms")
+    return "\n".join(linhas)
@@ -0,0 +1,29 @@
+# core/migrate.py
+"""
+Migração única para a chave normalizada de usuário e o índice de busca do histórico.
+
+    python -m core.migrate
+
+Grava `usuario_norm` nos documentos antigos (usuários que só diferem na caixa têm
+estado, perfil e resumo fundidos, e a lista sai no relatório), cria os índices
+compostos e indexa os turnos antigos para a busca (core/retrieval.py).
+Pode ser rodado de novo sem efeito colateral.
+"""
+from .repositories import backfill_indice, backfill_usuario_norm, ensure_indexes
+
+
+def main() -> None:
+    out = backfill_usuario_norm()
+    colisoes = out.pop("colisoes", {})
+    for nome, n in out.items():
+        print(f"{nome}: {n} documento(s) atualizados")
+    for chave, usuarios in colisoes.items():
+        print(f"colisão {chave}: {', '.join(usuarios)} fundidos num documento só")
+    ensure_indexes()
+    print("índices ok")
+    n = backfill_indice()["hist"]
+    print(f"índice de busca: {n} turno(s) indexados")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 # core/nsfw.py
 from __future__ import annotations
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 import re
 from .repositories import get_fact
 
+if TYPE_CHECKING:
+    from .repositories import StateSnapshot
+
 # --- padrões SEGUROS (sem \c) ---
 _PRIV_LOC_PATTERNS = [
     r"\b(apartament\w+|apto\b|kitnet|loft|casa|sobrado|ph\b|penthous\w*|su[ií]te|hotel|motel|chal[eé]|airbnb|pousada|cabana)\b",
@@ -29,15 +32,18 @@ def is_private_location(local_atual: Optional[str]) -> bool:
         return True
     return False
 
-def nsfw_enabled(usuario: str, local_atual: Optional[str] = None) -> bool:
+def nsfw_enabled(usuario: str, local_atual: Optional[str] = None, snap: Optional["StateSnapshot"] = None) -> bool:
     """
     Gate NSFW:
       1) Override manual (sidebar): on/off/auto
       2) Se local privado/deserto => ON
       3) Caso contrário, mantém regra anterior (virgem / primeira_vez)
+    Com `snap`, lê os fatos do snapshot do turno em vez de ir ao banco.
     """
+    fact = snap.get_fact if snap is not None else (lambda k, d=None: get_fact(usuario, k, d))
+
     # 1) override manual
-    override = (get_fact(usuario, "nsfw_override", "") or "").lower()
+    override = (fact("nsfw_override", "") or "").lower()
     if override == "on":
         return True
     if override == "off":
@@ -48,11 +54,11 @@ def nsfw_enabled(usuario: str, local_atual: Optional[str] = None) -> bool:
         return True
 
     # 3) legado (mantém compatibilidade)
-    virgem = bool(get_fact(usuario, "virgem", True))
+    virgem = bool(fact("virgem", True))
     if not virgem:
         return True
     # Se você grava um flag após primeira_vez, respeite aqui:
-    if bool(get_fact(usuario, "primeira_vez_unlock", False)):
+    if bool(fact("primeira_vez_unlock", False)):
         return True
 
     return False
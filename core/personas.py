@@ -59,3 +59,15 @@ def get_persona(character: str):
     if name in ("elfa", "nerith", "narith"):
         return PERSONA_ELFA, HISTORY_BOOT_ELFA
     return PERSONA_MARY, HISTORY_BOOT_MARY
+
+# Tamanho-alvo da resposta (tokens cl100k): 3–5 parágrafos curtos, com folga para
+# não cortar a última frase. Narith descreve mais (sensorial), então vai mais longe.
+ALVO_SAIDA_TOKENS = {"mary": 700, "laura": 700, "elfa": 900}
+
+
+def get_alvo_saida(character: str) -> int:
+    """Tokens de saída esperados para a personagem (mesmos apelidos de `get_persona`)."""
+    name = (character or "Mary").strip().lower()
+    if name in ("elfa", "nerith", "narith"):
+        name = "elfa"
+    return ALVO_SAIDA_TOKENS.get(name, ALVO_SAIDA_TOKENS["mary"])
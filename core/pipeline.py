@@ -0,0 +1,147 @@
+# core/pipeline.py
+"""
+Motor do pós-processamento: segmenta a resposta em sentenças UMA vez e roda todos
+os estágios sobre essa lista compartilhada. Os estágios são declarados num lugar só
+(ver `core/service.py`), cronometrados a cada execução e podem ser desligados por nome.
+
+Tipos de estágio:
+  - texto:   fn(texto, ctx) -> texto          (antes da segmentação; ex.: metacena)
+  - mapa:    fn(sentenca, ctx) -> sentenca    (reescrita por sentença)
+  - filtro:  fn(sentenca, ctx) -> bool        (True = descarta; se descartar tudo, mantém)
+  - doc:     fn(sentencas, ctx) -> sentencas  (visão do conjunto; ex.: anti-eco, pontes)
+"""
+import re
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+Ctx = Dict[str, Any]
+Cond = Optional[Callable[[Ctx], bool]]
+
+
+class Stage:
+    __slots__ = ("name", "kind", "fn", "when")
+
+    def __init__(self, name: str, kind: str, fn: Callable, when: Cond = None):
+        self.name = name
+        self.kind = kind
+        self.fn = fn
+        self.when = when
+
+    def __repr__(self) -> str:
+        return f"Stage({self.name!r}, {self.kind})"
+
+
+def texto(name: str, fn: Callable[[str, Ctx], str], when: Cond = None) -> Stage:
+    return Stage(name, "texto", fn, when)
+
+def mapa(name: str, fn: Callable[[str, Ctx], str], when: Cond = None) -> Stage:
+    return Stage(name, "mapa", fn, when)
+
+def filtro(name: str, fn: Callable[[str, Ctx], bool], when: Cond = None) -> Stage:
+    return Stage(name, "filtro", fn, when)
+
+def doc(name: str, fn: Callable[[List[str], Ctx], List[str]], when: Cond = None) -> Stage:
+    return Stage(name, "doc", fn, when)
+
+
+class Pipeline:
+    """
+    Sequência declarada de estágios. `run` devolve o texto final e grava em
+    `ctx["_tempos"]` a lista (estágio, segundos) da execução.
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        segment: Callable[[str], List[str]],
+        layout: Callable[[List[str], Ctx], str],
+        desligados: Iterable[str] = (),
+    ):
+        vistos_sent = False
+        for st in stages:
+            if st.kind == "texto" and vistos_sent:
+                raise ValueError(f"estágio de texto '{st.name}' depois da segmentação")
+            vistos_sent = vistos_sent or st.kind != "texto"
+        self.stages = list(stages)
+        self.segment = segment
+        self.layout = layout
+        self.desligados = set(desligados)
+
+    @property
+    def nomes(self) -> List[str]:
+        return [st.name for st in self.stages]
+
+    def toggle(self, name: str, ligado: bool) -> None:
+        if name not in self.nomes:
+            raise KeyError(name)
+        if ligado:
+            self.desligados.discard(name)
+        else:
+            self.desligados.add(name)
+
+    def run(self, txt: str, ctx: Ctx) -> str:
+        tempos: List[Tuple[str, float]] = []
+        ctx["_tempos"] = tempos
+        sents: Optional[List[str]] = None
+        clock = time.perf_counter
+        for st in self.stages:
+            if st.name in self.desligados or (st.when is not None and not st.when(ctx)):
+                continue
+            t0 = clock()
+            if st.kind == "texto":
+                txt = st.fn(txt, ctx)
+            else:
+                if sents is None:
+                    t_seg = clock()
+                    sents = self.segment(txt)
+                    tempos.append(("segmentar", clock() - t_seg))
+                    t0 = clock()
+                if st.kind == "mapa":
+                    sents = [st.fn(s, ctx) for s in sents]
+                elif st.kind == "filtro":
+                    kept = [s for s in sents if not st.fn(s, ctx)]
+                    sents = kept or sents
+                else:
+                    sents = st.fn(sents, ctx)
+            tempos.append((st.name, clock() - t0))
+        if sents is None:
+            sents = self.segment(txt)
+        t0 = clock()
+        out = self.layout([s for s in sents if s], ctx)
+        tempos.append(("layout", clock() - t0))
+        return out
+
+
+_Regra = Union[Tuple[re.Pattern, str], Tuple[str, str]]
+
+
+class SubstitutionTable:
+    """
+    Várias regras (padrão -> troca) compiladas numa única alternação com grupos
+    nomeados; `m.lastgroup` despacha para a troca. Uma varredura por texto em vez
+    de uma por regra. Flags por regra viram grupos inline (`(?i:...)`).
+    Regras são tentadas na ordem dada quando casam na mesma posição.
+    """
+
+    def __init__(self, regras: Sequence[_Regra]):
+        partes: List[str] = []
+        self._trocas: Dict[str, str] = {}
+        for i, (pat, repl) in enumerate(regras):
+            if isinstance(pat, re.Pattern):
+                src = pat.pattern
+                if pat.flags & re.IGNORECASE:
+                    src = f"(?i:{src})"
+            else:
+                src = pat
+            nome = f"r{i}"
+            partes.append(f"(?P<{nome}>{src})")
+            self._trocas[nome] = repl
+        self._re = re.compile("|".join(partes)) if partes else None
+
+    def _troca(self, m: "re.Match[str]") -> str:
+        return self._trocas[m.lastgroup]
+
+    def sub(self, txt: str) -> str:
+        if self._re is None or not txt:
+            return txt
+        return self._re.sub(self._troca, txt)
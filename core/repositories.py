@@ -1,60 +1,354 @@
 # core/repositories.py
-from datetime import datetime
-from typing import Any, Dict, List, Optional
 import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence
 
+from . import retrieval
+from .config import settings
 from .database import get_col
+from .metrics import cronometrado, span
+from .textproc import impressoes
+from .tokens import toklen
+from .writebehind import aguardar, get_writer
 
 # --- Coleções (helpers) ---
+_HIST, _STATE, _EVENTS, _INDEX = "mary_historia", "mary_state", "mary_eventos", "mary_indice"
+_USO = "mary_uso"
+
 def _hist():
-    return get_col("mary_historia")
+    return get_col(_HIST)
 
 def _state():
-    return get_col("mary_state")
+    return get_col(_STATE)
 
 def _events():
-    return get_col("mary_eventos")
+    return get_col(_EVENTS)
+
+def _indice():
+    return get_col(_INDEX)
+
+def _uso():
+    return get_col(_USO)
 
 def _profile():
     return get_col("mary_perfil")
 
+def _summary():
+    return get_col("mary_resumo")
+
+def norm_user(usuario: str) -> str:
+    """Chave normalizada do usuário (case-insensitive), gravada em `usuario_norm`."""
+    return (usuario or "").lower()
+
+# há documentos sem `usuario_norm` (antes de `python -m core.migrate`)? Só o Mongo
+# tem dados legados; None = ainda não verificado neste processo. Enquanto houver,
+# a verificação se repete a cada _LEGADO_REVER_S: a migração pode rodar em outro
+# processo com este servidor no ar. Sem legado, não volta (toda escrita grava a chave)
+_legado: Optional[bool] = None
+_legado_visto = 0.0
+_LEGADO_REVER_S = 60.0
+
+def _ha_legado() -> bool:
+    global _legado, _legado_visto
+    if _legado is None or (_legado and time.monotonic() - _legado_visto >= _LEGADO_REVER_S):
+        _legado = settings.REPO_BACKEND == "mongo" and any(
+            col.find_one({"usuario_norm": {"$exists": False}}, {"_id": 1}) is not None
+            for col in (_hist(), _state(), _events(), _profile(), _summary())
+        )
+        _legado_visto = time.monotonic()
+    return _legado
+
 def _uq(usuario: str) -> Dict[str, Any]:
-    """Filtro ancorado e case-insensitive por usuário."""
-    return {"usuario": {"$regex": f"^{re.escape(usuario)}$", "$options": "i"}}
+    """
+    Filtro por igualdade na chave normalizada (usa índice; substitui o $regex /i).
+    Enquanto houver documentos sem a chave, também casa os antigos pelo `usuario`
+    (o $regex /i de antes), para o estado não sumir antes da migração.
+    """
+    un = norm_user(usuario)
+    if not _ha_legado():
+        return {"usuario_norm": un}
+    return {"$or": [
+        {"usuario_norm": un},
+        {"usuario_norm": {"$exists": False}, "usuario": {"$regex": f"^{re.escape(usuario)}$", "$options": "i"}},
+    ]}
+
+# versão dos dados de cada usuário neste processo: toda escrita do app incrementa
+_versoes: Dict[str, int] = {}
+_versoes_lock = threading.Lock()
+
+def _tocar(usuario: str) -> None:
+    k = norm_user(usuario)
+    with _versoes_lock:
+        _versoes[k] = _versoes.get(k, 0) + 1
+
+def state_version(usuario: str) -> int:
+    """Carimbo que muda a cada escrita do app para o usuário (caches da UI comparam com ele)."""
+    return _versoes.get(norm_user(usuario), 0)
+
+def _escrever(usuario: str, colecao: str, op: tuple) -> None:
+    """Escrita do turno: vai para a fila write-behind (ou direto, com WRITE_BEHIND=0)."""
+    _tocar(usuario)
+    if settings.WRITE_BEHIND:
+        get_writer().submit(norm_user(usuario), colecao, op)
+    elif op[0] == "insert_one":
+        get_col(colecao).insert_one(op[1])
+    elif op[0] == "insert_many":
+        get_col(colecao).insert_many(op[1])
+    else:
+        get_col(colecao).update_one(op[1], op[2], upsert=op[3])
+
+def _sync(usuario: str) -> None:
+    """Leitura vê as próprias escritas: espera a fila do usuário esvaziar."""
+    if settings.WRITE_BEHIND:
+        aguardar(norm_user(usuario), settings.WB_TIMEOUT_S)
+
+_indexes_ready = False
+
+def ensure_indexes() -> None:
+    """Cria os índices compostos por `usuario_norm` (idempotente; uma vez por processo)."""
+    global _indexes_ready
+    if _indexes_ready:
+        return
+    _hist().create_index([("usuario_norm", 1), ("_id", 1)])
+    _hist().create_index([("usuario_norm", 1), ("seq", 1)])
+    _indice().create_index([("usuario_norm", 1), ("termo", 1)])
+    _state().create_index([("usuario_norm", 1)])
+    _events().create_index([("usuario_norm", 1), ("tipo", 1), ("ts", -1)])
+    _profile().create_index([("usuario_norm", 1)])
+    _summary().create_index([("usuario_norm", 1)])
+    _uso().create_index([("usuario_norm", 1), ("modelo", 1)])
+    _indexes_ready = True
 
 # -------- CRUD básico --------
+@cronometrado("repo.save_interaction")
 def save_interaction(usuario: str, user_msg: str, mary_msg: str, modelo: str = "") -> None:
-    _hist().insert_one({
+    agora = datetime.utcnow()
+    seq = retrieval.seq_de(agora)
+    _escrever(usuario, _HIST, ("insert_one", {
         "usuario": usuario,
+        "usuario_norm": norm_user(usuario),
         "mensagem_usuario": user_msg,
         "resposta_mary": mary_msg,
         "modelo": modelo,
-        "timestamp": datetime.utcnow().isoformat(),
-    })
+        "timestamp": agora.isoformat(),
+        "seq": seq,
+        # contagens guardadas: o histórico do prompt soma inteiros em vez de re-tokenizar
+        "tok_usuario": toklen(user_msg),
+        "tok_resposta": toklen(mary_msg),
+        # impressões de 64 bits das sentenças: o anti-eco dos próximos turnos compara inteiros
+        "frases_h": impressoes(mary_msg),
+    }))
+    _indexar(usuario, seq, f"{user_msg}\n{mary_msg}")
 
+def _indexar(usuario: str, seq: int, texto: str) -> None:
+    """Postagens do turno em `mary_indice` (um insert_many) + totais do usuário."""
+    posts, dl = retrieval.postagens(seq, texto)
+    if not posts:
+        return
+    un = norm_user(usuario)
+    _escrever(usuario, _INDEX, ("insert_many", [{"usuario_norm": un, **p} for p in posts]))
+    _escrever(usuario, _INDEX, (
+        "update_one",
+        {"usuario_norm": un, "termo": retrieval.TOTAIS},
+        {"$inc": retrieval.incremento_totais(posts, dl)},
+        True,
+    ))
+
+@cronometrado("repo.search_history")
+def search_history(
+    usuario: str, termos: List[str], antes_de: Optional[int] = None, k: int = 3
+) -> List[Dict[str, Any]]:
+    """
+    Os k turnos mais relevantes (BM25) para `termos`, anteriores a `antes_de` (seq),
+    em ordem de relevância. Lê os df na linha de totais, as postagens dos termos
+    escolhidos e por fim os k turnos.
+    """
+    _sync(usuario)
+    if not termos or k <= 0:
+        return []
+    totais = _indice().find_one(
+        {**_uq(usuario), "termo": retrieval.TOTAIS},
+        {"n": 1, "soma_dl": 1, **{f"df.{t}": 1 for t in termos}},
+    )
+    escolhidos = retrieval.escolher_termos(totais or {}, termos, settings.RECALL_MAX_POSTAGENS)
+    if not escolhidos:
+        return []
+    linhas = _indice().find(
+        {**_uq(usuario), "termo": {"$in": escolhidos}}, {"_id": 0, "termo": 1, "seq": 1, "tf": 1, "dl": 1}
+    )
+    seqs = retrieval.ranquear(linhas, totais, antes_de, k)
+    if not seqs:
+        return []
+    achados = {
+        d["seq"]: d
+        for d in _hist().find({**_uq(usuario), "seq": {"$in": seqs}}, {"mensagem_usuario": 1, "resposta_mary": 1, "seq": 1})
+    }
+    return [achados[s] for s in seqs if s in achados]
+
+@cronometrado("repo.get_history_docs")
 def get_history_docs(usuario: str, limit: int = 400) -> List[Dict[str, Any]]:
-    cur = _hist().find(_uq(usuario)).sort([("_id", 1)]).limit(limit)
+    """Últimos `limit` turnos, em ordem cronológica."""
+    _sync(usuario)
+    cur = _hist().find(_uq(usuario)).sort([("_id", -1)]).limit(limit)
+    return list(reversed(list(cur)))
+
+@cronometrado("repo.get_last_interaction")
+def get_last_interaction(usuario: str) -> Optional[Dict[str, Any]]:
+    """Só o turno mais recente (sort _id -1, limit 1), projetado nas mensagens."""
+    _sync(usuario)
+    return _hist().find_one(
+        _uq(usuario),
+        {"mensagem_usuario": 1, "resposta_mary": 1, "modelo": 1, "timestamp": 1},
+        sort=[("_id", -1)],
+    )
+
+# campos que o contexto do prompt precisa (mensagens + contagens salvas)
+_HIST_CTX_FIELDS = {"mensagem_usuario": 1, "resposta_mary": 1, "tok_usuario": 1, "tok_resposta": 1, "seq": 1}
+
+@cronometrado("repo.get_recent_replies")
+def get_recent_replies(usuario: str, n: int) -> List[Dict[str, Any]]:
+    """Últimas `n` respostas (mais recente primeiro), projetadas nas impressões e no texto."""
+    _sync(usuario)
+    if n <= 0:
+        return []
+    return list(_hist().find(_uq(usuario), {"resposta_mary": 1, "frases_h": 1}).sort([("_id", -1)]).limit(n))
+
+def iter_history_tail(usuario: str, batch_size: int = 50) -> Iterator[Dict[str, Any]]:
+    """
+    Histórico do mais recente para o mais antigo (cursor por `_id` decrescente),
+    projetado nos campos de contexto. O consumidor para quando o orçamento fecha;
+    só os lotes efetivamente lidos trafegam.
+    """
+    _sync(usuario)
+    cur = _hist().find(_uq(usuario), _HIST_CTX_FIELDS).sort([("_id", -1)]).batch_size(batch_size)
+    try:
+        yield from cur
+    finally:
+        cur.close()
+
+@cronometrado("repo.history_aged_out")
+def history_aged_out(
+    usuario: str, janela: int, apos_id: Any = None, limit: int = 200
+) -> List[Dict[str, Any]]:
+    """
+    Turnos que saíram da janela crua (todos menos os `janela` mais recentes) e que
+    ainda não entraram no resumo (`_id > apos_id`), em ordem cronológica.
+    """
+    _sync(usuario)
+    corte = list(_hist().find(_uq(usuario), {"_id": 1}).sort([("_id", -1)]).skip(janela).limit(1))
+    if not corte:
+        return []
+    faixa: Dict[str, Any] = {"$lte": corte[0]["_id"]}
+    if apos_id is not None:
+        faixa["$gt"] = apos_id
+    cur = _hist().find({**_uq(usuario), "_id": faixa}, _HIST_CTX_FIELDS).sort([("_id", 1)]).limit(limit)
     return list(cur)
 
-def set_fact(usuario: str, key: str, value: Any, meta: Optional[Dict[str, Any]] = None) -> None:
-    _state().update_one(
-        {"usuario": usuario},
-        {"$set": {
-            f"fatos.{key}": value,
-            f"meta.{key}": (meta or {}),
-            "atualizado_em": datetime.utcnow(),
-        }},
+# -------- Memória de cena (resumo incremental) --------
+@cronometrado("repo.get_scene_summary")
+def get_scene_summary(usuario: str) -> Optional[Dict[str, Any]]:
+    """Resumo persistente dos turnos antigos: {resumo, ate_id, turnos} ou None."""
+    return _summary().find_one(_uq(usuario), {"resumo": 1, "ate_id": 1, "turnos": 1})
+
+@cronometrado("repo.save_scene_summary")
+def save_scene_summary(usuario: str, resumo: str, ate_id: Any, turnos: int) -> None:
+    _tocar(usuario)
+    _summary().update_one(
+        _uq(usuario),
+        {
+            "$set": {
+                "usuario_norm": norm_user(usuario),
+                "resumo": resumo,
+                "ate_id": ate_id,
+                "atualizado_em": datetime.utcnow(),
+            },
+            "$inc": {"turnos": turnos},
+            "$setOnInsert": {"usuario": usuario},
+        },
         upsert=True,
     )
 
+@cronometrado("repo.set_fact")
+def set_fact(usuario: str, key: str, value: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+    _escrever(usuario, _STATE, (
+        "update_one",
+        _uq(usuario),
+        {
+            "$set": {
+                "usuario_norm": norm_user(usuario),
+                f"fatos.{key}": value,
+                f"meta.{key}": (meta or {}),
+                "atualizado_em": datetime.utcnow(),
+            },
+            "$setOnInsert": {"usuario": usuario},
+        },
+        True,
+    ))
+
+@cronometrado("repo.get_fact")
 def get_fact(usuario: str, key: str, default=None):
-    d = _state().find_one({"usuario": usuario}, {f"fatos.{key}": 1})
+    _sync(usuario)
+    d = _state().find_one(_uq(usuario), {f"fatos.{key}": 1})
     return (d or {}).get("fatos", {}).get(key, default)
 
+@cronometrado("repo.get_facts")
 def get_facts(usuario: str) -> Dict[str, Any]:
+    _sync(usuario)
     d = _state().find_one(_uq(usuario), {"fatos": 1}) or {}
     return (d.get("fatos") or {})
 
+class StateSnapshot:
+    """
+    Unidade de trabalho do turno sobre `mary_state`: lê o documento do usuário uma vez
+    e serve `get_fact`/`get_facts` da memória. `set_fact` fica no buffer e vai para o
+    banco num único `update_one` em `flush()` (também chamado ao sair do `with`).
+    """
+
+    @cronometrado("repo.state_snapshot")
+    def __init__(self, usuario: str):
+        self.usuario = usuario
+        _sync(usuario)
+        d = _state().find_one(_uq(usuario), {"fatos": 1}) or {}
+        self._fatos: Dict[str, Any] = dict(d.get("fatos") or {})
+        self._pendentes: Dict[str, Any] = {}
+
+    def get_fact(self, key: str, default=None):
+        return self._fatos.get(key, default)
+
+    def get_facts(self) -> Dict[str, Any]:
+        return dict(self._fatos)
+
+    def set_fact(self, key: str, value: Any, meta: Optional[Dict[str, Any]] = None) -> None:
+        self._fatos[key] = value
+        self._pendentes[f"fatos.{key}"] = value
+        self._pendentes[f"meta.{key}"] = (meta or {})
+
+    def flush(self) -> None:
+        if not self._pendentes:
+            return
+        with span("repo.state_flush"):
+            _escrever(self.usuario, _STATE, (
+                "update_one",
+                _uq(self.usuario),
+                {
+                    "$set": {
+                        **self._pendentes, "usuario_norm": norm_user(self.usuario), "atualizado_em": datetime.utcnow(),
+                    },
+                    "$setOnInsert": {"usuario": self.usuario},
+                },
+                True,
+            ))
+        self._pendentes = {}
+
+    def __enter__(self) -> "StateSnapshot":
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self.flush()
+
+@cronometrado("repo.register_event")
 def register_event(
     usuario: str,
     tipo: str,
@@ -62,54 +356,115 @@ def register_event(
     local: Optional[str] = None,
     meta: Optional[Dict[str, Any]] = None,
 ) -> None:
-    _events().insert_one({
+    _escrever(usuario, _EVENTS, ("insert_one", {
         "usuario": usuario,
+        "usuario_norm": norm_user(usuario),
         "tipo": tipo,
         "descricao": descricao,
         "local": local,
         "ts": datetime.utcnow(),
         "tags": [],
         "meta": meta or {},
-    })
+    }))
 
+@cronometrado("repo.last_event")
 def last_event(usuario: str, tipo: str):
+    _sync(usuario)
     return _events().find_one({**_uq(usuario), "tipo": tipo}, sort=[("ts", -1)])
 
+@cronometrado("repo.list_events")
 def list_events(usuario: str, limit: int = 5) -> List[Dict[str, Any]]:
+    _sync(usuario)
     cur = _events().find(_uq(usuario)).sort([("ts", -1)]).limit(limit)
     return list(cur)
 
+# -------- Uso (tokens e custo por usuario_key e modelo) --------
+def register_usage(
+    usuario: str, modelo: str, prompt_tokens: int, completion_tokens: int, custo_usd: float, ms: float,
+    estimado: bool = False,
+) -> None:
+    """Soma uma chamada ao modelo no agregado {usuario_norm, modelo} de `mary_uso`."""
+    inc: Dict[str, Any] = {
+        "chamadas": 1,
+        "prompt_tokens": int(prompt_tokens),
+        "completion_tokens": int(completion_tokens),
+        "custo_usd": float(custo_usd),
+        "ms": round(float(ms), 3),
+    }
+    if estimado:  # stream: tokens contados localmente, não pelo provedor
+        inc["chamadas_estimadas"] = 1
+    _escrever(usuario, _USO, (
+        "update_one",
+        {"usuario_norm": norm_user(usuario), "modelo": modelo},
+        {"$inc": inc, "$set": {"atualizado_em": datetime.utcnow().isoformat()}},
+        True,
+    ))
+
+@cronometrado("repo.get_usage")
+def get_usage(usuarios: Sequence[str]) -> List[Dict[str, Any]]:
+    """Agregados de uso das chaves dadas (uma linha por usuario_norm × modelo)."""
+    for u in usuarios:
+        _sync(u)
+    return list(_uso().find(
+        {"usuario_norm": {"$in": [norm_user(u) for u in usuarios]}},
+        {"_id": 0, "usuario_norm": 1, "modelo": 1, "chamadas": 1, "prompt_tokens": 1,
+         "completion_tokens": 1, "custo_usd": 1, "ms": 1},
+    ))
+
 # -------- Listagem utilitária --------
 def list_interactions(usuario: str, limit: int = 400) -> List[Dict[str, Any]]:
+    _sync(usuario)
     cur = _hist().find(_uq(usuario)).sort([("_id", 1)]).limit(limit)
     return list(cur)
 
-# -------- Deleters --------
+# -------- Deleters (esperam a fila do usuário: nada pendente cai depois) --------
 def delete_user_history(usuario: str) -> int:
+    _sync(usuario)
+    _tocar(usuario)
     res = _hist().delete_many(_uq(usuario))
+    _summary().delete_many(_uq(usuario))
+    _indice().delete_many(_uq(usuario))
     return res.deleted_count
 
 def delete_last_interaction(usuario: str) -> bool:
+    _sync(usuario)
+    _tocar(usuario)
     doc = _hist().find_one(_uq(usuario), sort=[("_id", -1)])
     if not doc:
         return False
     _hist().delete_one({"_id": doc["_id"]})
+    if doc.get("seq") is not None:
+        posts = list(_indice().find({**_uq(usuario), "seq": doc["seq"]}, {"termo": 1, "dl": 1}))
+        if posts:
+            _indice().delete_many({**_uq(usuario), "seq": doc["seq"]})
+            _indice().update_one(
+                {**_uq(usuario), "termo": retrieval.TOTAIS},
+                {"$inc": retrieval.incremento_totais(posts, posts[0]["dl"], -1)},
+            )
     return True
 
 def delete_all_user_data(usuario: str) -> Dict[str, int]:
+    _sync(usuario)
+    _tocar(usuario)
     out: Dict[str, int] = {}
     out["hist"]    = _hist().delete_many(_uq(usuario)).deleted_count
     out["state"]   = _state().delete_many(_uq(usuario)).deleted_count
     out["eventos"] = _events().delete_many(_uq(usuario)).deleted_count
     out["perfil"]  = _profile().delete_many(_uq(usuario)).deleted_count
+    out["resumo"]  = _summary().delete_many(_uq(usuario)).deleted_count
+    out["indice"]  = _indice().delete_many(_uq(usuario)).deleted_count
+    out["uso"]     = _uso().delete_many(_uq(usuario)).deleted_count
     return out
 
 def reset_nsfw(usuario: str) -> None:
     """Força NSFW OFF e limpa locks de cena."""
+    _sync(usuario)
+    _tocar(usuario)
     _state().update_one(
-        {"usuario": usuario},
+        _uq(usuario),
         {
-            "$set": {"fatos.virgem": True},
+            "$set": {"usuario_norm": norm_user(usuario), "fatos.virgem": True},
+            "$setOnInsert": {"usuario": usuario},
             "$unset": {
                 "fatos.cena_parceiro_ativo": "",
                 "fatos.cena_parceiro_ativo_ts": "",
@@ -119,3 +474,107 @@ def reset_nsfw(usuario: str) -> None:
         upsert=True,
     )
     _events().delete_many({**_uq(usuario), "tipo": "primeira_vez"})
+
+# -------- Migração --------
+# coleções com um documento por usuário: chaves que só diferem na caixa se fundem
+_UNICOS = {"state", "perfil", "resumo"}
+
+def _data(d: Dict[str, Any]) -> str:
+    return str(d.get("atualizado_em") or "")
+
+def _fundir(nome: str, docs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Um documento a partir dos de mesma chave normalizada, do mais antigo ao mais novo:
+    `fatos`/`meta` se combinam (o mais novo vence em cada chave); os resumos se
+    concatenam, com o menor `ate_id` (turnos não resumidos voltam para a fila).
+    """
+    docs = sorted(docs, key=_data)
+    if nome == "resumo":
+        base = dict(docs[-1])
+        base["resumo"] = "\n\n".join(d["resumo"] for d in docs if d.get("resumo"))
+        ids = [d["ate_id"] for d in docs if d.get("ate_id") is not None]
+        base["ate_id"] = min(ids) if ids else None
+        base["turnos"] = sum(int(d.get("turnos") or 0) for d in docs)
+        return base
+    base: Dict[str, Any] = {}
+    for d in docs:
+        for k, v in d.items():
+            if k in ("fatos", "meta") and isinstance(v, dict):
+                base.setdefault(k, {}).update(v)
+            else:
+                base[k] = v
+    return base
+
+def backfill_usuario_norm() -> Dict[str, Any]:
+    """
+    Migração única: grava `usuario_norm` nos documentos antigos (sem o campo) das
+    coleções por usuário. Idempotente; devolve quantos docs foram tocados por coleção
+    e, em "colisoes", as chaves que juntaram documentos de usuários que só diferiam
+    na caixa ({"state:ana": ["Ana", "ana"]}). Em state/perfil/resumo esses
+    documentos são fundidos num só (`_fundir`) em vez de um sobrescrever o outro.
+    """
+    global _legado
+    out: Dict[str, Any] = {}
+    colisoes: Dict[str, List[str]] = {}
+    for nome, col in (
+        ("hist", _hist()), ("state", _state()), ("eventos", _events()),
+        ("perfil", _profile()), ("resumo", _summary()),
+    ):
+        grupos: Dict[str, set] = {}
+        for d in col.find({"usuario_norm": {"$exists": False}}, {"usuario": 1}):
+            u = d.get("usuario") or ""
+            grupos.setdefault(norm_user(u), set()).add(u)
+        total = 0
+        for un, usuarios in grupos.items():
+            if nome in _UNICOS:
+                docs = [d for u in usuarios for d in col.find({"usuario_norm": {"$exists": False}, "usuario": u})]
+                docs += list(col.find({"usuario_norm": un}))
+                if len(docs) > 1:
+                    colisoes[f"{nome}:{un}"] = sorted({d.get("usuario") or "" for d in docs})
+                    novo = {**_fundir(nome, docs), "usuario_norm": un}
+                    col.replace_one({"_id": novo["_id"]}, novo)
+                    col.delete_many({"_id": {"$in": [d["_id"] for d in docs if d["_id"] != novo["_id"]]}})
+                    total += len(docs)
+                    continue
+            for u in usuarios:
+                total += col.update_many(
+                    {"usuario_norm": {"$exists": False}, "usuario": u}, {"$set": {"usuario_norm": un}}
+                ).modified_count
+        out[nome] = total
+    out["colisoes"] = colisoes
+    _legado = None
+    return out
+
+def backfill_indice(log_cada: int = 1000) -> Dict[str, int]:
+    """
+    Migração: dá `seq` aos turnos antigos (do timestamp, crescente por usuário) e
+    os põe no índice de busca. Idempotente: só toca turnos ainda sem `seq`.
+    """
+    ultimo: Dict[str, int] = {}
+    total = 0
+    pendentes = list(
+        _hist().find({"seq": {"$exists": False}}, {"usuario_norm": 1, "mensagem_usuario": 1, "resposta_mary": 1, "timestamp": 1})
+        .sort([("_id", 1)])
+    )
+    for d in pendentes:
+        un = d.get("usuario_norm") or ""
+        ts = d.get("timestamp")
+        try:
+            seq = retrieval.seq_de(ts if isinstance(ts, datetime) else datetime.fromisoformat(str(ts)))
+        except ValueError:
+            seq = 0
+        seq = max(seq, ultimo.get(un, 0) + 1)
+        ultimo[un] = seq
+        _hist().update_one({"_id": d["_id"]}, {"$set": {"seq": seq}})
+        posts, dl = retrieval.postagens(seq, f"{d.get('mensagem_usuario') or ''}\n{d.get('resposta_mary') or ''}")
+        if posts:
+            _indice().insert_many([{"usuario_norm": un, **p} for p in posts])
+            _indice().update_one(
+                {"usuario_norm": un, "termo": retrieval.TOTAIS},
+                {"$inc": retrieval.incremento_totais(posts, dl)},
+                upsert=True,
+            )
+        total += 1
+        if total % log_cada == 0:
+            print(f"índice: {total}/{len(pendentes)} turno(s)")
+    return {"hist": total}
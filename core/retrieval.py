@@ -0,0 +1,92 @@
+# core/retrieval.py
+"""
+Índice invertido (BM25) sobre o histórico de cada usuário: quando a campanha já
+não cabe no orçamento do prompt, os turnos antigos ligados ao pedido atual voltam
+como memória, sem mandar o histórico inteiro.
+
+Layout em `mary_indice` (só acréscimos): uma postagem por termo por turno,
+{usuario_norm, termo, seq, tf, dl}, gravada com um `insert_many` em
+`save_interaction`, e uma linha de totais por usuário (termo "": n, soma_dl e
+df.<termo>) mantida com $inc. A consulta lê primeiro os df dos termos do pedido
+na linha de totais e depois só as postagens dos termos mais raros, até
+settings.RECALL_MAX_POSTAGENS (termos comuns pesam pouco no BM25 e custariam a
+leitura de meia campanha). `seq` é o carimbo do turno em `mary_historia`
+(microssegundos do timestamp), crescente por usuário.
+
+Aqui ficam só as funções puras (postagens e ranking); leitura e escrita estão em
+core/repositories.py.
+"""
+import math
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .textproc import termos_busca
+
+TOTAIS = ""  # termo da linha de totais (termos_busca nunca produz "")
+K1, B = 1.2, 0.75
+_EPOCA = datetime(1970, 1, 1)
+
+
+def seq_de(ts: datetime) -> int:
+    """Carimbo inteiro do turno (microssegundos desde a época, UTC ingênuo)."""
+    d = ts - _EPOCA
+    return (d.days * 86_400 + d.seconds) * 1_000_000 + d.microseconds
+
+
+def postagens(seq: int, texto: str) -> Tuple[List[Dict[str, Any]], int]:
+    """Postagens do turno ({termo, seq, tf, dl}) e o tamanho do documento (dl)."""
+    tf = termos_busca(texto)
+    dl = sum(tf.values())
+    return [{"termo": t, "seq": seq, "tf": n, "dl": dl} for t, n in tf.items()], dl
+
+
+def incremento_totais(posts: List[Dict[str, Any]], dl: int, sinal: int = 1) -> Dict[str, int]:
+    """$inc da linha de totais para um turno que entra (sinal 1) ou sai (-1) do índice."""
+    return {"n": sinal, "soma_dl": sinal * dl, **{f"df.{p['termo']}": sinal for p in posts}}
+
+
+def escolher_termos(totais: Dict[str, Any], consulta: Iterable[str], max_postagens: int) -> List[str]:
+    """Termos da consulta que valem a leitura: do mais raro ao mais comum, até o teto de postagens."""
+    n = int(totais.get("n") or 0)
+    df = totais.get("df") or {}
+    candidatos = sorted((int(df.get(t) or 0), t) for t in set(consulta))
+    out, soma = [], 0
+    for d, t in candidatos:
+        if d <= 0:
+            continue
+        if d * 2 > n or soma + d > max_postagens:  # metade da campanha não discrimina
+            break
+        out.append(t)
+        soma += d
+    return out
+
+
+def ranquear(
+    linhas: Iterable[Dict[str, Any]], totais: Dict[str, Any], antes_de: Optional[int] = None, k: int = 3
+) -> List[int]:
+    """
+    `seq` dos k turnos de maior BM25. `linhas` são as postagens dos termos
+    escolhidos; `totais`, a linha de totais do usuário. Com `antes_de`, só turnos
+    anteriores a ele (os mais novos já estão crus no prompt).
+    """
+    n, soma_dl = int(totais.get("n") or 0), int(totais.get("soma_dl") or 0)
+    dfs = totais.get("df") or {}
+    por_termo: Dict[str, List[Dict[str, Any]]] = {}
+    for p in linhas:
+        por_termo.setdefault(p["termo"], []).append(p)
+    if n <= 0 or not por_termo:
+        return []
+    media_dl = max(soma_dl / n, 1.0)
+    placar: Dict[int, float] = {}
+    for termo, lista in por_termo.items():
+        df = int(dfs.get(termo) or len(lista))
+        idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+        for p in lista:
+            seq = p["seq"]
+            if antes_de is not None and seq >= antes_de:
+                continue
+            tf = p["tf"]
+            placar[seq] = placar.get(seq, 0.0) + idf * tf * (K1 + 1) / (
+                tf + K1 * (1 - B + B * p["dl"] / media_dl)
+            )
+    return [s for s, _ in sorted(placar.items(), key=lambda x: (-x[1], -x[0]))[:k]]
@@ -0,0 +1,267 @@
+# core/scheduler.py
+"""
+Agendador do processo para as chamadas de modelo (usado pelo service_router):
+
+- baldes de fichas por provedor: requisições e tokens por minuto
+  (settings.LIMITE_RPM / LIMITE_TPM, "OpenRouter:60;Together:30"; sem entrada =
+  sem limite), com rajada de no máximo settings.LIMITE_RAJADA da cota. Os tokens
+  são debitados pela estimativa do pedido (prompt + max_tokens) e acertados pelo
+  `usage` quando a resposta chega;
+- limite de chamadas simultâneas por usuario_key (settings.USUARIO_CONCORRENCIA);
+- fila justa por provedor: quem espera é atendido em rodízio entre usuários (um
+  pedido de cada por vez), então uma rajada de "Continuar" de um usuário não passa
+  na frente dos outros. Quem está na frente e não cabe no balde segura a fila: a
+  vazão fica na cota do provedor em vez de virar uma tempestade de 429.
+
+Quem espera recebe retorno pelo callback de `ao_esperar` (posição e estimativa),
+e a espera nunca passa do prazo do turno (core/transport.py).
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Deque, Dict, Iterator, Optional, Tuple
+
+from . import metrics
+from . import transport
+from .config import settings
+
+Aviso = Callable[[int, Optional[float]], None]  # (posição na fila, segundos estimados ou None)
+
+_usuario: ContextVar[str] = ContextVar("agenda_usuario", default="")
+_aviso: ContextVar[Optional[Aviso]] = ContextVar("agenda_aviso", default=None)
+_segurando: ContextVar[bool] = ContextVar("agenda_segurando", default=False)
+
+_AVISO_CADA_S = 1.0
+
+
+def _cotas(spec: str) -> Dict[str, float]:
+    """'Provedor:n;...' -> {Provedor: n} (n por minuto)."""
+    out: Dict[str, float] = {}
+    for par in spec.split(";"):
+        nome, sep, n = par.rpartition(":")
+        try:
+            if sep and nome.strip() and float(n) > 0:
+                out[nome.strip()] = float(n)
+        except ValueError:
+            continue
+    return out
+
+
+class _Balde:
+    """
+    Balde de fichas: reabastece continuamente na cota por minuto, mas guarda no
+    máximo settings.LIMITE_RAJADA da cota (a rajada depois de um tempo parado).
+    Pedido maior que o balde espera o balde cheio e o deixa devendo o resto.
+    """
+
+    __slots__ = ("cap", "nivel", "taxa", "t")
+
+    def __init__(self, por_minuto: float):
+        self.cap = max(1.0, por_minuto * min(1.0, max(0.0, settings.LIMITE_RAJADA)))
+        self.nivel = self.cap
+        self.taxa = por_minuto / 60.0
+        self.t = time.monotonic()
+
+    def _encher(self, agora: float) -> None:
+        self.nivel = min(self.cap, self.nivel + (agora - self.t) * self.taxa)
+        self.t = agora
+
+    def falta(self, n: float, agora: float) -> float:
+        """Segundos até caberem `n` fichas (0 = já cabem)."""
+        self._encher(agora)
+        n = min(n, self.cap)
+        return 0.0 if self.nivel >= n else (n - self.nivel) / self.taxa
+
+    def tirar(self, n: float) -> None:
+        self.nivel -= n
+
+    def devolver(self, n: float) -> None:
+        self.nivel = min(self.cap, self.nivel + n)
+
+
+class _Pedido:
+    __slots__ = ("usuario", "provedor", "requisicoes", "tokens")
+
+    def __init__(self, usuario: str, provedor: str, requisicoes: int, tokens: int):
+        self.usuario = usuario
+        self.provedor = provedor
+        self.requisicoes = requisicoes
+        self.tokens = tokens
+
+
+_cond = threading.Condition()
+_rpm = {p: _Balde(n) for p, n in _cotas(settings.LIMITE_RPM).items()}
+_tpm = {p: _Balde(n) for p, n in _cotas(settings.LIMITE_TPM).items()}
+_ativos: Dict[str, int] = {}
+_filas: Dict[str, "OrderedDict[str, Deque[_Pedido]]"] = {}
+
+
+def limita_tokens(provedor: str) -> bool:
+    """O provedor tem cota de tokens? (senão nem vale estimar o prompt)."""
+    return provedor in _tpm
+
+
+def _cabe(u: str) -> bool:
+    return settings.USUARIO_CONCORRENCIA <= 0 or _ativos.get(u, 0) < settings.USUARIO_CONCORRENCIA
+
+
+def _vez(p: _Pedido, agora: float, ignora_concorrencia: bool) -> Optional[float]:
+    """None = pode ir já; senão, quanto esperar (inf = até alguém liberar)."""
+    fila = _filas[p.provedor]
+    escolhido = next(
+        (dq[0] for u, dq in fila.items() if (ignora_concorrencia and u == p.usuario) or _cabe(u)), None
+    )
+    if escolhido is not p:
+        return float("inf")
+    falta = 0.0
+    if p.provedor in _rpm:
+        falta = _rpm[p.provedor].falta(p.requisicoes, agora)
+    if p.provedor in _tpm:
+        falta = max(falta, _tpm[p.provedor].falta(p.tokens, agora))
+    return None if falta <= 0 else falta
+
+
+def _posicao(p: _Pedido) -> int:
+    pos = 1
+    for u, dq in _filas[p.provedor].items():
+        if u == p.usuario:
+            return pos + dq.index(p)
+        pos += len(dq)
+    return pos
+
+
+def _sair_da_fila(p: _Pedido) -> None:
+    fila = _filas[p.provedor]
+    dq = fila[p.usuario]
+    dq.remove(p)
+    if dq:
+        fila.move_to_end(p.usuario)  # rodízio: o próximo desse usuário vai para o fim
+    else:
+        del fila[p.usuario]
+
+
+class Vaga:
+    """Autorização de uma chamada; `acertar` corrige o débito de tokens pelo uso real."""
+
+    __slots__ = ("provedor", "tokens")
+
+    def __init__(self, provedor: str, tokens: int):
+        self.provedor = provedor
+        self.tokens = tokens
+
+    def acertar(self, tokens_reais: int) -> None:
+        balde = _tpm.get(self.provedor)
+        if balde is None or not tokens_reais:
+            return
+        with _cond:
+            delta = tokens_reais - self.tokens
+            if delta > 0:
+                balde.tirar(delta)
+            else:
+                balde.devolver(-delta)
+                _cond.notify_all()
+        self.tokens = tokens_reais
+
+
+def _esperar_vez(p: _Pedido, aninhado: bool) -> float:
+    """Bloqueia até a vez de `p` (debitando os baldes). Retorna os segundos esperados."""
+    prazo = transport.prazo_atual()
+    t0 = agora = time.monotonic()
+    proximo_aviso = t0
+    aviso = _aviso.get()
+    with _cond:
+        fila = _filas.setdefault(p.provedor, OrderedDict())
+        fila.setdefault(p.usuario, deque()).append(p)
+        try:
+            while True:
+                agora = time.monotonic()
+                espera = _vez(p, agora, aninhado)
+                if espera is None:
+                    break
+                resta = prazo.resta()
+                if resta <= 0:
+                    raise transport.PrazoEsgotado(f"prazo do turno esgotado na fila de {p.provedor}")
+                if aviso is not None and agora >= proximo_aviso:
+                    pos = _posicao(p)
+                    _cond.release()  # o callback mexe na UI: fora do lock
+                    try:
+                        aviso(pos, None if espera == float("inf") else espera)
+                    finally:
+                        _cond.acquire()
+                    proximo_aviso = agora + _AVISO_CADA_S
+                    continue  # o estado pode ter mudado enquanto o lock estava solto
+                _cond.wait(min(espera, resta, _AVISO_CADA_S))
+        finally:
+            _sair_da_fila(p)
+            _cond.notify_all()
+        if p.provedor in _rpm:
+            _rpm[p.provedor].tirar(p.requisicoes)
+        if p.provedor in _tpm:
+            _tpm[p.provedor].tirar(p.tokens)
+        if not aninhado:
+            _ativos[p.usuario] = _ativos.get(p.usuario, 0) + 1
+    return agora - t0
+
+
+@contextmanager
+def vaga(provedor: str, requisicoes: int = 1, tokens: int = 0) -> Iterator[Vaga]:
+    """
+    Espera a vez no agendador e segura uma chamada simultânea do usuário do turno
+    até o fim do bloco. Aninhado (ex.: a chamada de reforço dentro de um stream
+    aberto) só passa pelos baldes, sem ocupar outra vaga do usuário.
+    """
+    aninhado = _segurando.get()
+    p = _Pedido(_usuario.get(), provedor, requisicoes, tokens)
+    esperou = _esperar_vez(p, aninhado)
+    if esperou > 0.001:
+        metrics.somar(fila_ms=round(esperou * 1000.0, 3))
+    token = None if aninhado else _segurando.set(True)
+    try:
+        yield Vaga(provedor, tokens)
+    finally:
+        if token is not None:
+            try:
+                _segurando.reset(token)
+            except ValueError:  # gerador finalizado em outro contexto
+                _segurando.set(False)
+            with _cond:
+                _ativos[p.usuario] -= 1
+                if not _ativos[p.usuario]:
+                    del _ativos[p.usuario]
+                _cond.notify_all()
+
+
+@contextmanager
+def _definir(var: ContextVar, valor: object, vazio: object) -> Iterator[None]:
+    token = var.set(valor)
+    try:
+        yield
+    finally:
+        try:
+            var.reset(token)
+        except ValueError:  # gerador finalizado em outro contexto
+            var.set(vazio)
+
+
+def usuario_atual() -> str:
+    """usuario_key das chamadas deste contexto ("" fora de um turno)."""
+    return _usuario.get()
+
+
+def em_nome_de(usuario_key: str):
+    """As chamadas do bloco contam para `usuario_key` (limite de concorrência e rodízio)."""
+    return _definir(_usuario, usuario_key, "")
+
+
+def ao_esperar(fn: Aviso):
+    """`fn(posição, segundos)` é chamado (no máximo 1x/s) enquanto uma chamada do bloco espera na fila."""
+    return _definir(_aviso, fn, None)
+
+
+def estado() -> Dict[str, Tuple[int, Dict[str, int]]]:
+    """{provedor: (pedidos na fila, {usuario: ativos})} para diagnóstico."""
+    with _cond:
+        ativos = dict(_ativos)
+        return {prov: (sum(len(dq) for dq in fila.values()), ativos) for prov, fila in _filas.items()}
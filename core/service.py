@@ -1,32 +1,45 @@
 # core/service.py
-from typing import List, Dict, Optional, Tuple
+from typing import Iterable, List, Dict, Optional, Sequence, Set, Tuple, Generator
 from re import error as ReError
+import asyncio
+import functools
 import re
 
-from .personas import get_persona
+from .personas import get_persona, get_alvo_saida
 from .repositories import (
-    save_interaction, get_history_docs, set_fact, get_fact,
-    get_facts, last_event, register_event,
+    save_interaction, get_recent_replies, iter_history_tail, search_history, set_fact, get_fact,
+    get_facts, last_event, register_event, StateSnapshot, get_scene_summary,
 )
 from .rules import violou_mary, reforco_system
 from .locations import infer_from_prompt
-from .textproc import strip_metacena, formatar_roleplay_profissional
+from .textproc import strip_metacena, SceneClassifier, split_frases, impressao, impressoes, termos_busca
 from .tokens import toklen
-from .service_router import route_chat_strict
+from .service_router import (
+    route_chat_strict, route_chat_strict_stream, aroute_chat_strict, vaga_para, contabilizar, ASYNC_HTTP,
+    _Cobranca, _cobrada,
+)
+from . import aio
+from . import catalog
+from . import metrics
+from . import scheduler
+from . import transport
 from .nsfw import nsfw_enabled
+from .config import settings
+from .pipeline import Pipeline, SubstitutionTable, texto, mapa, filtro, doc
+from .compaction import agendar_compactacao
+from .cache import cached_chat
 
 
 # ===== ARC / Checkpoint narrativo =====
-_ARC_BACK_TO_BOATE = re.compile(r'\b(boate|palco|camarim|priv[êe]|dj|pole|vip)\b', re.IGNORECASE)
 _ARC_LEAVING_BOATE = re.compile(
     r'\b(entrevista|shopping|loja|emprego( novo| decente)?|contrata[çc][aã]o|'
     r'curr[íi]culo|vitrine|provador|vendedor(a)?|balc[aã]o|gerente)\b', re.IGNORECASE
 )
 
-def _narrative_state(usuario_key: str) -> Dict[str, object]:
+def _narrative_state(usuario_key: str, snap: Optional[StateSnapshot] = None) -> Dict[str, object]:
     """Lê flags canônicas do arco. Tudo opcional; defaults seguros."""
     try:
-        f = get_facts(usuario_key) or {}
+        f = (snap.get_facts() if snap is not None else get_facts(usuario_key)) or {}
     except Exception:
         f = {}
     return {
@@ -50,37 +63,36 @@ def _narrative_pin_msg(state: Dict[str, object]) -> Dict[str, str]:
     ]
     return {"role": "system", "content": " ".join(regras)}
 
-def _enforce_arc(texto: str, local_atual: str, state: Dict[str, object]) -> str:
+_PONTES_ARCO = {
+    "loja":  ["Eu aperto meu currículo contra o peito e respiro fundo.", "Volto ao balcão e sigo com a entrevista."],
+    "casa":  ["Eu fecho a gaveta e seguro a xícara morna.", "Hoje eu fico aqui, focada no que importa."],
+    "praia": ["Eu ajeito a alça da bolsa e caminho pela orla.", "Um passo de cada vez, sem voltar atrás."],
+    "boate": ["Eu encaro meu reflexo e nego com a cabeça.", "Não volto.", "Viro as costas e sigo em frente."],
+}
+
+def _enforce_arc(sents: List[str], ctx: Dict[str, object]) -> List[str]:
     """
-    Pós-processo: se 'boate_locked' e o texto ainda vazou tokens de boate,
-    reescreve/limpa sentenças e injeta uma ponte coerente com o local atual.
+    Estágio do pós-processo: se 'boate_locked' e o texto ainda vazou tokens de boate,
+    descarta essas sentenças e injeta uma ponte coerente com o local atual.
     """
-    if not texto:
-        return texto
-    try:
-        if bool(state.get("boate_locked", False)) and _ARC_BACK_TO_BOATE.search(texto):
-            # 1) filtra sentenças com tokens proibidos
-            sent = re.split(r"(?<=[.!?…][”\"»']?)\s+", texto)
-            keep = [s for s in sent if not _ARC_BACK_TO_BOATE.search(s)]
-            texto = " ".join(keep).strip() or texto
-
-            # 2) injeta ponte de redirecionamento, suave e curta
-            ponte = {
-                "loja":  "Eu aperto meu currículo contra o peito e respiro fundo. Volto ao balcão e sigo com a entrevista.",
-                "casa":  "Eu fecho a gaveta e seguro a xícara morna. Hoje eu fico aqui, focada no que importa.",
-                "praia": "Eu ajeito a alça da bolsa e caminho pela orla. Um passo de cada vez, sem voltar atrás.",
-                "boate": "Eu encaro meu reflexo e nego com a cabeça. Não volto. Viro as costas e sigo em frente.",
-            }
-            alvo = "loja" if "loja" in (local_atual or "").lower() else \
-                   "casa" if "casa" in (local_atual or "").lower() or "apart" in (local_atual or "").lower() else \
-                   "praia" if "praia" in (local_atual or "").lower() or "orla" in (local_atual or "").lower() else \
-                   "boate"
-            texto = (texto.rstrip() + " " + ponte[alvo]).strip()
-        return texto
-    except ReError:
-        return texto
-
-def _maybe_update_arc_flags(usuario_key: str, prompt: str, resposta: str) -> None:
+    na_boate = [CENAS.mentions(s, "boate") for s in sents]
+    if not any(na_boate):
+        return sents
+    # 1) filtra sentenças com tokens proibidos
+    keep = [s for s, b in zip(sents, na_boate) if not b] or sents
+
+    # 2) injeta ponte de redirecionamento, suave e curta
+    local_atual = (ctx.get("local_atual") or "").lower()
+    alvo = "loja" if "loja" in local_atual else \
+           "casa" if "casa" in local_atual or "apart" in local_atual else \
+           "praia" if "praia" in local_atual or "orla" in local_atual else \
+           "boate"
+    return keep + _PONTES_ARCO[alvo]
+
+@metrics.cronometrado("arco_flags")
+def _maybe_update_arc_flags(
+    usuario_key: str, prompt: str, resposta: str, snap: Optional[StateSnapshot] = None
+) -> None:
     """
     Sobe flags do arco quando há sinal claro de 'sair da boate' ou 'seguir emprego/loja'.
     Não quebra a geração se falhar.
@@ -88,8 +100,12 @@ def _maybe_update_arc_flags(usuario_key: str, prompt: str, resposta: str) -> Non
     try:
         combo = f"{prompt}\n{resposta}"
         if _ARC_LEAVING_BOATE.search(combo):
-            set_fact(usuario_key, "arc_boate_locked", True, {"fonte": "auto/arc"})
-            set_fact(usuario_key, "arc_goal", "emprego_loja", {"fonte": "auto/arc"})
+            if snap is not None:
+                snap.set_fact("arc_boate_locked", True, {"fonte": "auto/arc"})
+                snap.set_fact("arc_goal", "emprego_loja", {"fonte": "auto/arc"})
+            else:
+                set_fact(usuario_key, "arc_boate_locked", True, {"fonte": "auto/arc"})
+                set_fact(usuario_key, "arc_goal", "emprego_loja", {"fonte": "auto/arc"})
     except Exception:
         pass
 
@@ -101,9 +117,10 @@ def _make_third_person_flag(name: str) -> re.Pattern:
 
 
 # ============================ 2) Memória enxuta ============================
-def _memory_context(usuario_key: str) -> str:
+@metrics.cronometrado("memoria")
+def _memory_context(usuario_key: str, snap: Optional[StateSnapshot] = None) -> str:
     try:
-        f = get_facts(usuario_key) or {}
+        f = (snap.get_facts() if snap is not None else get_facts(usuario_key)) or {}
     except Exception:
         f = {}
     blocos: List[str] = []
@@ -128,22 +145,94 @@ def _memory_context(usuario_key: str) -> str:
 
 
 # ============================ 3) Histórico ============================
-def _montar_historico(usuario_key: str, history_boot: List[Dict[str, str]], limite_tokens: int = 120_000) -> List[Dict[str, str]]:
-    docs = get_history_docs(usuario_key)
+_RECALL_CHARS = 400
+
+def _corta(texto: str, n: int = _RECALL_CHARS) -> str:
+    texto = re.sub(r"\s+", " ", texto or "").strip()
+    return texto if len(texto) <= n else texto[:n].rsplit(" ", 1)[0] + "…"
+
+@metrics.cronometrado("recordar")
+def _memorias_relevantes(
+    usuario_key: str, char: str, prompt_usuario: str, antes_de: Optional[int]
+) -> Optional[Dict[str, str]]:
+    """Turnos antigos (fora da janela crua) mais ligados ao pedido, via índice BM25."""
+    if settings.RECALL_TOP_K <= 0:
+        return None
+    consulta = list(termos_busca(prompt_usuario))
+    if not consulta:
+        return None
+    try:
+        docs = search_history(usuario_key, consulta, antes_de, settings.RECALL_TOP_K)
+    except Exception:
+        return None
     if not docs:
-        return history_boot[:]
+        return None
+    linhas = [
+        f"- Usuário: {_corta(d.get('mensagem_usuario') or '')}\n  {char}: {_corta(d.get('resposta_mary') or '')}"
+        for d in sorted(docs, key=lambda d: d["seq"])
+    ]
+    return {
+        "role": "system",
+        "content": (
+            "MEMÓRIAS_RELACIONADAS (turnos antigos ligados ao pedido atual; use só se ajudarem a coerência):\n"
+            + "\n".join(linhas)
+        ),
+    }
+
+def _reserva_recordacoes() -> int:
+    """Teto do bloco MEMÓRIAS_RELACIONADAS (tokens ≤ caracteres) + o reforço canônico."""
+    return settings.RECALL_TOP_K * (2 * _RECALL_CHARS + 64) + 64
+
+# persona, guias de estilo, few-shots e PINs se repetem a cada turno
+_toklen_fixo = functools.lru_cache(maxsize=256)(toklen)
+
+def _doc_tokens(d: Dict) -> int:
+    """Tokens do turno: usa as contagens salvas; docs antigos (sem elas) caem no toklen."""
+    tu, ta = d.get("tok_usuario"), d.get("tok_resposta")
+    if isinstance(tu, int) and isinstance(ta, int):
+        return tu + ta
+    return toklen(d.get("mensagem_usuario") or "") + toklen(d.get("resposta_mary") or "")
+
+@metrics.cronometrado("historico")
+def _montar_historico(
+    usuario_key: str, history_boot: List[Dict[str, str]], limite_tokens: Optional[int] = None, ate_id=None,
+    corte: Optional[Dict[str, object]] = None,
+) -> List[Dict[str, str]]:
+    """
+    Cauda do histórico que cabe no orçamento: lê do turno mais recente para trás
+    e para assim que o próximo não cabe. O custo segue o orçamento, não a campanha.
+    O orçamento (`limite_tokens`) vem do turno, pela janela do modelo; sem ele,
+    vale settings.HIST_TETO_TOKENS. Turnos até `ate_id` já estão no resumo da
+    cena e não entram crus.
+    Se a cauda foi cortada, `corte["antes_de"]` recebe o `seq` do turno cru mais
+    antigo (None se nenhum entrou): o que vem antes dele é candidato à busca.
+    """
+    if limite_tokens is None:
+        limite_tokens = settings.HIST_TETO_TOKENS
     total = 0
+    pares: List[Tuple[str, str]] = []
+    seq_min = None
+    tail = iter_history_tail(usuario_key)
+    try:
+        for d in tail:
+            t = _doc_tokens(d)
+            if (ate_id is not None and d["_id"] <= ate_id) or total + t > limite_tokens:
+                # turno cru sem `seq` (anterior ao índice): nada indexado é mais antigo que ele
+                if corte is not None and (seq_min is not None or not pares):
+                    corte["antes_de"] = seq_min
+                break
+            pares.append((d.get("mensagem_usuario") or "", d.get("resposta_mary") or ""))
+            total += t
+            seq_min = d.get("seq")
+    finally:
+        tail.close()
+    if not pares:
+        return history_boot[:]
     out: List[Dict[str, str]] = []
-    for d in reversed(docs):
-        u = d.get("mensagem_usuario") or ""
-        a = d.get("resposta_mary") or ""
-        t = toklen(u) + toklen(a)
-        if total + t > limite_tokens:
-            break
+    for u, a in reversed(pares):
         out.append({"role": "user", "content": u})
         out.append({"role": "assistant", "content": a})
-        total += t
-    return list(reversed(out)) if out else history_boot[:]
+    return out
 
 
 # ============================ 4) Tom e clareza ============================
@@ -172,37 +261,36 @@ _FORMALISMOS = [
     (re.compile(r"\bvi[sç]o\b", re.IGNORECASE), "olhar"),
 ]
 
-def _amaciar_tom(txt: str) -> str:
-    out = txt
-    for pat, repl in _SOFT_REWRITES:
-        out = pat.sub(repl, out)
-    return out
-
-def _desrebuscar(txt: str) -> str:
-    out = txt
-    for pat, repl in _FORMALISMOS:
-        out = pat.sub(repl, out)
-    return out
-
 # Anti “conflito telegráfico”: remove cronômetro/sermão e burocratês
 _CONFLITO_PATTERNS = [
     (re.compile(r"\b[Ff]altam\s+\d{1,3}\s+minutos?\b"), ""),
     (re.compile(r"\b\d{1,2}:\d{2}\b"), "mais tarde"),
     (re.compile(r"\b[Ss]ó mais uma noite\b"), "só essa noite"),
-    (re.compile(r"^\s*Trabalho\.\s*", re.IGNORECASE), ""),
     (re.compile(r"\b[Pp]or conseguinte\b"), "por isso"),
     (re.compile(r"\b[Dd]essa forma\b"), "assim"),
 ]
 
-def _suavizar_conflito(txt: str) -> str:
-    s = txt
-    for pat, repl in _CONFLITO_PATTERNS:
-        s = pat.sub(repl, s)
-    s = re.sub(r"\s{2,}", " ", s).strip()
-    return s
+# as três tabelas numa varredura só (amaciar + desrebuscar + conflito)
+_TOM = SubstitutionTable(_SOFT_REWRITES + _FORMALISMOS + _CONFLITO_PATTERNS)
+
+# Aberturas: só no começo da resposta (\A na 1ª sentença), não de cada frase
+_ABERTURAS = SubstitutionTable([
+    (re.compile(r"\A\s*Trabalho\.\s*", re.IGNORECASE), ""),
+])
+# cortar aberturas professorais/sermão (Laura/Mary)
+_ABERTURAS_COMUM = SubstitutionTable([
+    (re.compile(r'\A\s*(olha,|escuta,|veja,)\s*', re.IGNORECASE), ''),
+])
+
+def _abertura(sents: List[str], ctx: Dict[str, object]) -> List[str]:
+    if not sents:
+        return sents
+    s = sents[0] if _is_narith(ctx) else _ABERTURAS_COMUM.sub(sents[0])
+    return [_ABERTURAS.sub(s)] + sents[1:]
 
 # --- Remover bullets / inventários e prefixos tipo "Você sente:" ---
-_LIST_MARKERS = re.compile(r'^\s*(?:[-–—•✅]|\d+\.)\s+', re.MULTILINE)
+# "—"/"–" no começo da linha é travessão de fala, não marcador de lista
+_LIST_MARKERS = re.compile(r'^\s*(?:[-•✅]|\d+\.)\s+', re.MULTILINE)
 _FEEL_PREFIX  = re.compile(r'^\s*(você\s+sente|voce\s+sente|você\s+percebe|vc\s+sente):\s*',
                            re.IGNORECASE | re.MULTILINE)
 
@@ -233,96 +321,73 @@ _NARITH_HARSH = re.compile(
     re.IGNORECASE
 )
 
-def _refinar_narith(txt: str, user_prompt: str, nsfw_on: bool) -> str:
-    s = _deslistar(txt)
-
+_NARITH_REWRITES = SubstitutionTable([
     # reduzir retórica tipo “Humanos são…”
-    s = re.sub(r'\b(Humanos?|mortais)\s+são\s+[^.?!]+[.?!]\s*', '', s, flags=re.IGNORECASE)
-
+    (re.compile(r'\b(Humanos?|mortais)\s+são\s+[^.?!]+[.?!]\s*', re.IGNORECASE), ''),
     # evitar contagem/lista de tendrils (“3 tendrils”)
-    s = re.sub(r'\b\d+\s+tendrils?\b', 'tendrils', s, flags=re.IGNORECASE)
-
+    (re.compile(r'\b\d+\s+tendrils?\b', re.IGNORECASE), 'tendrils'),
     # remover tempos/contagens/apressas
-    s = _NARITH_TIME.sub('', s)
+    (_NARITH_TIME, ''),
+    # suavizar referências a dor/força excessiva
+    (re.compile(r'\bdor\s+gostos[ae]\b', re.IGNORECASE), 'pressão boa'),
+])
+# língua-tendril só com NSFW ON (menção explícita vira toque suave se OFF)
+_NARITH_LINGUA = SubstitutionTable([
+    (re.compile(r'l[ií]ngua[-\s]?tendril[^.?!]*[.?!]', re.IGNORECASE), 'Encosto os lábios com cuidado, pedindo licença.'),
+])
+
+def _refinar_narith(sent: str, ctx: Dict[str, object]) -> str:
+    s = _NARITH_REWRITES.sub(sent)
+    if not ctx.get("nsfw_on"):
+        s = _NARITH_LINGUA.sub(s)
+    return s
 
-    # filtrar frases com coerção/imperativo duro e termos ásperos/médicos/lore se não solicitados
-    sents = _split_sentences(s)
-    kept = []
-    for sent in sents:
-        if _NARITH_COERCE.search(sent):
-            continue
-        if _NARITH_HARSH.search(sent):
-            continue
-        if _NARITH_BAN.search(sent) and not _NARITH_BAN.search(user_prompt or ''):
-            continue
-        kept.append(sent)
-    if kept:
-        s = ' '.join(kept)
-
-    # língua-tendril só com NSFW ON (menção explícita vira toque suave se OFF)
-    if not nsfw_on:
-        s = re.sub(r'l[ií]ngua[-\s]?tendril[^.?!]*[.?!]', 'Encosto os lábios com cuidado, pedindo licença.', s, flags=re.IGNORECASE)
+def _narith_corta(sent: str, ctx: Dict[str, object]) -> bool:
+    """Frases com coerção/imperativo duro e termos ásperos/médicos/lore se não solicitados."""
+    if _NARITH_COERCE.search(sent) or _NARITH_HARSH.search(sent):
+        return True
+    return bool(_NARITH_BAN.search(sent)) and not _NARITH_BAN.search(ctx.get("user_prompt") or '')
 
-    # suavizar referências a dor/força excessiva
-    s = re.sub(r'\bdor\s+gostos[ae]\b', 'pressão boa', s, flags=re.IGNORECASE)
+_ANCORA_NARITH = "O portal está estável; sem pressa."
 
+def _narith_ancora(sents: List[str], _ctx: Dict[str, object]) -> List[str]:
     # adicionar uma âncora de calma se ainda houver rastro de “portal”/pressa
-    if re.search(r'\bportal\b', s, re.IGNORECASE) and 'sem pressa' not in s.lower():
-        s = s.strip() + " O portal está estável; sem pressa."
-
-    return s.strip()
+    if any(re.search(r'\bportal\b', s, re.IGNORECASE) for s in sents) and \
+            not any('sem pressa' in s.lower() for s in sents):
+        return sents + [_ANCORA_NARITH]
+    return sents
 
 # --- Refinamento comum (Laura/Mary): sensual direto, sem sermão/listas ---
-def _refinar_common_sensual(character: str, txt: str) -> str:
-    s = _deslistar(txt)
-    # cortar aberturas professorais/sermão
-    s = re.sub(r'^\s*(olha,|escuta,|veja,)\s*', '', s, flags=re.IGNORECASE)
+_COMMON_REWRITES = SubstitutionTable([
     # suavizar “explicar sentimentos” em bloco
-    s = re.sub(r'\b(eu\s+(sei|acho|penso)\s+que\s+)[^.?!]+[.?!]\s*', '', s, flags=re.IGNORECASE)
+    (re.compile(r'\b(eu\s+(sei|acho|penso)\s+que\s+)[^.?!]+[.?!]\s*', re.IGNORECASE), ''),
     # remover promessas de sermão
-    s = re.sub(r'\b(n[aã]o\s+v[ao]u\s+te\s+dar\s+um\s+serm[aã]o)[.?!]\s*', '', s, flags=re.IGNORECASE)
+    (re.compile(r'\b(n[aã]o\s+v[ao]u\s+te\s+dar\s+um\s+serm[aã]o)[.?!]\s*', re.IGNORECASE), ''),
+])
+
+def _refinar_common_sensual(sent: str, _ctx: Dict[str, object]) -> str:
+    return _COMMON_REWRITES.sub(sent)
+
+def _espacos(sent: str, _ctx: Dict[str, object]) -> str:
+    """Higieniza o que as trocas deixaram: espaços duplos e espaço antes da pontuação."""
+    s = re.sub(r"\s{2,}", " ", sent)
+    s = re.sub(r"\s+([,.;!?…])", r"\1", s)
     return s.strip()
 
-# --- Split de sentenças (compatível, sem look-behind variável) ---
-_SENT_END = re.compile(r'([.!?…]["”»\']?)\s+')
-
-def _split_sentences(text: str) -> List[str]:
-    text = re.sub(r'\s*\n+\s*', ' ', text)
-    parts, i = [], 0
-    for m in _SENT_END.finditer(text):
-        parts.append(text[i:m.end(1)].strip())
-        i = m.end()
-    tail = text[i:].strip()
-    if tail:
-        parts.append(tail)
-    return [p for p in parts if p]
-
-def _force_paragraphs(text: str, max_frases_por_par: int = 2,
-                      alvo_pars: Tuple[int, int] = (3, 5)) -> str:
+def _paragrafos(sents: List[str], ctx: Dict[str, object]) -> str:
     """
-    Garante blocos de 1–2 frases por parágrafo.
-    Respeita se o modelo já trouxe parágrafos suficientes.
+    Blocos de 1–2 frases por parágrafo, no máximo `alvo_pars[1]` parágrafos
+    (o excedente vai para o último).
     """
-    existing = [p.strip() for p in re.split(r'\n{2,}', text) if p.strip()]
-    if len(existing) >= alvo_pars[0]:
-        return text
-
-    sents = _split_sentences(text)
-    if not sents:
-        return text
-
+    max_frases_por_par = int(ctx.get("max_frases_por_par") or 2)
+    _min_p, max_p = ctx.get("alvo_pars") or (3, 5)
     chunks: List[str] = []
     for i in range(0, len(sents), max_frases_por_par):
         chunk = ' '.join(sents[i:i + max_frases_por_par]).strip()
         if chunk:
             chunks.append(chunk)
-
-    min_p, max_p = alvo_pars
     if len(chunks) > max_p:
-        head = chunks[:max_p - 1]
-        tail = ' '.join(chunks[max_p - 1:])
-        chunks = head + [tail]
-
+        chunks = chunks[:max_p - 1] + [' '.join(chunks[max_p - 1:])]
     return '\n\n'.join(chunks)
 
 
@@ -335,20 +400,21 @@ _DERAILERS = re.compile(
     re.IGNORECASE
 )
 
-def _strip_derailers(txt: str) -> str:
-    sent = re.split(r"(?<=[.!?])\s+", txt)
-    keep = [s for s in sent if not _DERAILERS.search(s)]
-    return " ".join(keep).strip() if keep else txt
+def _derailer(sent: str, _ctx: Dict[str, object]) -> bool:
+    return bool(_DERAILERS.search(sent))
 
 
 # ============================ 6) Coerência de cenário (com REWRITE) ============================
 _CTX_TOKENS = {
-    "boate": {r"\bboate\b", r"\bpalco\b", r"\bcamarim\b", r"\b(dj|dj[’'])\b", r"\bpole\b", r"\bvip\b"},
+    "boate": {r"\bboate\b", r"\bpalco\b", r"\bcamarim\b", r"\bpriv[êe]\b", r"\b(dj|dj[’'])\b", r"\bpole\b", r"\bvip\b"},
     "loja":  {r"\bloja\b", r"\bprovador\b", r"\bvitrine\b", r"\bcaixa\b", r"\bestoque\b"},
     "casa":  {r"\bapartamento\b", r"\bsala\b", r"\bsof[aá]\b", r"\bcozinha\b", r"\bquarto\b", r"\bguarda-roupa\b", r"\bportal\b"},
     "praia": {r"\bpraia\b", r"\bareia\b", r"\bquiosque\b", r"\bbrisa\b", r"\bmar\b"},
 }
 
+# compilado uma vez; compartilhado por _coerencia_local e _enforce_arc
+CENAS = SceneClassifier(_CTX_TOKENS)
+
 _CTX_REWRITE: Dict[str, List[Tuple[re.Pattern, str]]] = {
     "loja": [
         (re.compile(r"\bboate\b", re.IGNORECASE), "padaria"),
@@ -370,52 +436,120 @@ _CTX_REWRITE: Dict[str, List[Tuple[re.Pattern, str]]] = {
         (re.compile(r"\bdj\b", re.IGNORECASE), "som distante"),
     ],
 }
+_CTX_REWRITE_TABLES = {alvo: SubstitutionTable(regras) for alvo, regras in _CTX_REWRITE.items()}
+
+def _alvo_cenario(local: str) -> Optional[str]:
+    l = (local or "").lower()
+    if "boate" in l or "aurora" in l:
+        return "boate"
+    if "loja" in l or "padaria" in l or "boutique" in l:
+        return "loja"
+    if "praia" in l or "camburi" in l or "orla" in l:
+        return "praia"
+    if "apart" in l or "casa" in l or "chal" in l or "guarda-roupa" in l or "portal" in l:
+        return "casa"
+    return None
+
+def _coerencia_local(sents: List[str], ctx: Dict[str, object]) -> List[str]:
+    alvo = ctx.get("alvo")
+    # 1) reescreve termos para o alvo
+    table = _CTX_REWRITE_TABLES.get(alvo)
+    if table is not None:
+        sents = [table.sub(s) for s in sents]
+
+    # 2) filtra sentenças insistentes em outro cenário
+    keep = [s for s in sents if not CENAS.fora_de(s, alvo)]
+    return keep or sents
+
+
+# ============================ 6.5) Anti-eco + escopo de personagem ============================
+def _impressoes_do_doc(d: Dict) -> List[int]:
+    """Impressões de sentença salvas no turno; docs antigos (sem elas) caem no hash do texto."""
+    h = d.get("frases_h")
+    if isinstance(h, list):
+        return h
+    return impressoes(d.get("resposta_mary") or "")
 
-def _rewrite_to_local(alvo: Optional[str], txt: str) -> str:
-    if not alvo or alvo not in _CTX_REWRITE:
-        return txt
-    out = txt
-    for pat, repl in _CTX_REWRITE[alvo]:
-        out = pat.sub(repl, out)
+def _impressoes_recentes(u_key: str) -> Set[int]:
+    try:
+        return {h for d in get_recent_replies(u_key, settings.ANTI_ECO_JANELA) for h in _impressoes_do_doc(d)}
+    except Exception:
+        return set()
+
+def _impressoes_do_contexto(contexto: Optional[Sequence[object]]) -> Set[int]:
+    """
+    Impressões das últimas falas do assistente no contexto que a UI já tem: pares
+    (papel, texto) ou mensagens {role, content}. Só usado quando a cauda do banco veio vazia.
+    """
+    out: Set[int] = set()
+    vistas = 0
+    for item in reversed(contexto or []):
+        if vistas >= settings.ANTI_ECO_JANELA:
+            break
+        if isinstance(item, dict):
+            papel, texto = item.get("role"), item.get("content")
+        else:
+            papel, texto = item[0], item[1]
+        if papel == "assistant":
+            out.update(impressoes(texto or ""))
+            vistas += 1
     return out
 
-def _coerencia_local(local: str, txt: str) -> str:
-    if not local:
-        return txt
-    l = local.lower()
-    alvo = None
-    if "boate" in l or "aurora" in l:
-        alvo = "boate"
-    elif "loja" in l or "padaria" in l or "boutique" in l:
-        alvo = "loja"
-    elif "praia" in l or "camburi" in l or "orla" in l:
-        alvo = "praia"
-    elif "apart" in l or "casa" in l or "chal" in l or "guarda-roupa" in l or "portal" in l:
-        alvo = "casa"
+# frases de sistema (pontes do arco, âncora da Narith): repetem de propósito
+_FRASES_FIXAS = frozenset(
+    impressao(f) for f in [*(f for pontes in _PONTES_ARCO.values() for f in pontes), _ANCORA_NARITH]
+)
 
-    if not alvo:
-        return txt
+def _dedupe_against_last(sents: List[str], ctx: Dict[str, object]) -> List[str]:
+    """Anti-eco: descarta frases já ditas nas últimas respostas (impressões de 64 bits)."""
+    ultimas = ctx.get("ultimas_impressoes")
+    if not ultimas:
+        return sents
+    kept = []
+    for s in sents:
+        key = impressao(s)
+        if key in _FRASES_FIXAS or key not in ultimas:
+            kept.append(s)
+    return kept or sents
 
-    # 1) reescreve termos para o alvo
-    txt = _rewrite_to_local(alvo, txt)
+_ESCOPO_NARITH = re.compile(r"\b(narith|nerith|elfa)\b", re.IGNORECASE)
 
-    # 2) filtra sentenças insistentes em outro cenário
-    ban_tokens = set()
-    for k, pats in _CTX_TOKENS.items():
-        if k != alvo:
-            ban_tokens |= pats
+def _checa_escopo(ctx: Dict[str, object]) -> bool:
+    # Se estamos com "Laura" ou "Mary" e o usuário NÃO citou Narith,
+    # removemos menções acidentais de Narith/elfa do texto gerado.
+    return ctx.get("name") in {"laura", "mary"} and not _ESCOPO_NARITH.search(ctx.get("user_prompt") or "")
 
-    sent = re.split(r"(?<=[.!?])\s+", txt)
-    keep = []
-    for s in sent:
-        low = s.lower()
-        if any(re.search(p, low) for p in ban_tokens):
-            continue
-        keep.append(s)
-    return " ".join(keep).strip() if keep else txt
+def _fora_do_escopo(sent: str, _ctx: Dict[str, object]) -> bool:
+    return bool(_ESCOPO_NARITH.search(sent))
 
 
 # ============================ 7) Pós-processo ============================
+def _is_narith(ctx: Dict[str, object]) -> bool:
+    return ctx.get("name") in {"elfa", "nerith", "narith"}
+
+# Todos os estágios, na ordem. Texto cru -> (segmentação única) -> sentenças -> layout.
+POS_PIPELINE = Pipeline(
+    [
+        texto("metacena", lambda s, _c: strip_metacena(s)),
+        texto("deslistar", lambda s, _c: _deslistar(s)),
+        filtro("anti_derail", _derailer, when=lambda c: bool(c.get("anti_derail"))),
+        doc("coerencia_local", _coerencia_local, when=lambda c: bool(c.get("alvo"))),
+        mapa("narith", _refinar_narith, when=_is_narith),
+        filtro("narith_corta", _narith_corta, when=_is_narith),
+        mapa("comum", _refinar_common_sensual, when=lambda c: not _is_narith(c)),
+        mapa("tom", lambda s, _c: _TOM.sub(s)),
+        doc("abertura", _abertura),
+        mapa("espacos", _espacos),
+        doc("narith_ancora", _narith_ancora, when=_is_narith),
+        doc("arco", _enforce_arc, when=lambda c: bool((c.get("state") or {}).get("boate_locked"))),
+        doc("anti_eco", _dedupe_against_last),
+        filtro("escopo", _fora_do_escopo, when=_checa_escopo),
+    ],
+    segment=split_frases,
+    layout=_paragrafos,
+    desligados=[n.strip() for n in settings.POS_ESTAGIOS_OFF.split(",") if n.strip()],
+)
+
 def _pos_processar_seguro(
     texto: str,
     max_frases_por_par: int = 2,
@@ -424,27 +558,33 @@ def _pos_processar_seguro(
     character: str = "",
     user_prompt: str = "",
     nsfw_on: bool = False,
+    state: Optional[Dict[str, object]] = None,
+    ultima_resposta: str = "",
+    ctx: Optional[Dict[str, object]] = None,
+    ultimas_impressoes: Optional[Iterable[int]] = None,
 ) -> str:
+    """
+    Roda `POS_PIPELINE` sobre a resposta bruta. Em `ctx` (se passado) ficam os
+    dados do turno e `_tempos` com a duração de cada estágio. O anti-eco usa
+    `ultimas_impressoes` (já salvas com o histórico) e, se vier, `ultima_resposta`.
+    """
     if not texto:
         return texto
-    s = texto.replace("\\", "\\\\")
+    ctx = {} if ctx is None else ctx
+    ctx.update({
+        "max_frases_por_par": max_frases_por_par,
+        "alvo_pars": (3, 5),
+        "local_atual": local_atual,
+        "alvo": _alvo_cenario(local_atual),
+        "anti_derail": anti_derail,
+        "name": (character or "").strip().lower(),
+        "user_prompt": user_prompt,
+        "nsfw_on": nsfw_on,
+        "state": state or {},
+        "ultimas_impressoes": set(ultimas_impressoes or ()) | set(impressoes(ultima_resposta or "")),
+    })
     try:
-        if anti_derail:
-            s = _strip_derailers(s)
-        s = _coerencia_local(local_atual, s)
-        s = strip_metacena(s)
-        # refinamentos de estilo
-        name = (character or "").strip().lower()
-        if name in {"elfa", "nerith", "narith"}:
-            s = _refinar_narith(s, user_prompt, nsfw_on)
-        else:
-            s = _refinar_common_sensual(name, s)
-        s = formatar_roleplay_profissional(s, max_frases_por_par=max_frases_por_par)
-        s = _amaciar_tom(s)
-        s = _desrebuscar(s)
-        s = _suavizar_conflito(s)
-        s = _force_paragraphs(s, max_frases_por_par=max_frases_por_par, alvo_pars=(3, 5))
-        return s.replace("\\\\", "\\")
+        return POS_PIPELINE.run(texto, ctx)
     except ReError:
         return texto
 
@@ -558,6 +698,7 @@ def _precisa_primeira_pessoa(txt: str, character: str) -> bool:
     flag = _make_third_person_flag(character or "Mary")
     return bool(flag.search(txt))
 
+@metrics.cronometrado("primeira_pessoa")
 def _reforcar_primeira_pessoa(model: str, resposta: str) -> str:
     rewriter = [
         {"role": "system", "content": (
@@ -566,9 +707,11 @@ def _reforcar_primeira_pessoa(model: str, resposta: str) -> str:
         )},
         {"role": "user", "content": resposta}
     ]
-    data, used_model, provider = route_chat_strict(model, {
-        "model": model, "messages": rewriter, "max_tokens": 2048, "temperature": 0.5, "top_p": 0.9
-    })
+    # a reescrita tem o tamanho do original (+ folga)
+    max_saida = catalog.max_tokens(model, int(toklen(resposta) * 1.2) + 64)
+    data, used_model, provider = cached_chat(model, {
+        "model": model, "messages": rewriter, "max_tokens": max_saida, "temperature": 0.5, "top_p": 0.9
+    }, route_chat_strict)
     return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or resposta
 
 
@@ -602,6 +745,7 @@ def _fidelity_soft_append(_character: str) -> str:
         "Eu preciso ir. Alguém que eu amo não merece traição."
     )
 
+@metrics.cronometrado("fidelidade")
 def _maybe_stop_by_fidelity(
     prompt: str, resposta: str, usuario_key: str, char: str, local_atual: str, flirt_mode: bool
 ) -> str:
@@ -663,105 +807,192 @@ _PLANTAR_JANIO = re.compile(
 )
 _JANIO_NAME = re.compile(r"\bj[âa]nio\b", re.IGNORECASE)
 
-def _talvez_plantar_vinculo(usuario_key: str, char: str, prompt: str, resposta: str) -> None:
+@metrics.cronometrado("vinculo")
+def _talvez_plantar_vinculo(
+    usuario_key: str, char: str, prompt: str, resposta: str, snap: Optional[StateSnapshot] = None
+) -> None:
     try:
         if (char or "").strip().lower() != "laura":
             return
-        parceiro_atual = (get_fact(usuario_key, "parceiro_atual", "") or "").strip()
+        fact = snap.get_fact if snap is not None else (lambda k, d=None: get_fact(usuario_key, k, d))
+        parceiro_atual = (fact("parceiro_atual", "") or "").strip()
         if parceiro_atual:
             return
         texto = f"{prompt}\n{resposta}"
         if _JANIO_NAME.search(texto) and _PLANTAR_JANIO.search(texto):
-            set_fact(usuario_key, "parceiro_atual", "Janio", {"fonte": "auto"})
+            if snap is not None:
+                snap.set_fact("parceiro_atual", "Janio", {"fonte": "auto"})
+            else:
+                set_fact(usuario_key, "parceiro_atual", "Janio", {"fonte": "auto"})
             register_event(usuario_key, "vinculo_assumido", "Laura demonstrou compromisso com Janio.", None, {"origin": "auto"})
     except Exception:
         # não quebra a geração por erro de persistência
         pass
 
 
+def _is_short_followup(p: str) -> bool:
+    p0 = (p or "").strip().lower()
+    if p0.startswith("continuar") or p0.startswith("continuar:") or p0.startswith("continar:") or p0.startswith("cont"):
+        return True
+    if len(p0) <= 80:
+        if re.search(r"^(sim|ok|claro|isso|beleza|perfeito|ótimo|ta|tá|pode|vamos|quero|continua|seguir|manda|ah!?.*café|um café)", p0):
+            return True
+    return False
+
+
 # ============================ 13) Geração principal ============================
-def gerar_resposta(usuario: str, prompt_usuario: str, model: str, character: str = "Mary") -> str:
-    # --- helpers locais (anti-eco + escopo de personagem) ---
-    def _get_last_assistant_text(u_key: str) -> str:
-        try:
-            docs = get_history_docs(u_key) or []
-            if docs:
-                return (docs[-1].get("resposta_mary") or "").strip()
-        except Exception:
-            pass
-        return ""
-
-    def _norm(s: str) -> str:
-        s = re.sub(r"\s+", " ", s)
-        s = re.sub(r"[^\wáéíóúâêîôûãõàç]+", " ", s, flags=re.IGNORECASE)
-        return s.strip().lower()
-
-    def _dedupe_against_last(texto: str, u_key: str) -> str:
-        last = _get_last_assistant_text(u_key)
-        if not last:
-            return texto
-        last_sents = {_norm(s) for s in _split_sentences(last)}
-        kept = []
-        for s in _split_sentences(texto):
-            if _norm(s) in last_sents:
-                continue
-            kept.append(s)
-        if not kept:
-            return texto
-        joined = " ".join(kept)
-        # removemos parágrafos duplicados dentro da própria resposta
-        paras = [p.strip() for p in re.split(r"\n{2,}", joined) if p.strip()]
-        seen, deduped = set(), []
-        for p in paras:
-            key = _norm(p)
-            if key in seen:
-                continue
-            seen.add(key)
-            deduped.append(p)
-        return "\n\n".join(deduped).strip()
-
-    def _enforce_character_scope(texto: str, char: str, prompt: str) -> str:
-        # Se estamos com "Laura" ou "Mary" e o usuário NÃO citou Narith,
-        # removemos menções acidentais de Narith/elfa do texto gerado.
-        if (char or "").strip().lower() in {"laura", "mary"}:
-            if not re.search(r"\b(narith|nerith|elfa)\b", prompt, re.IGNORECASE):
-                sents = _split_sentences(texto)
-                sents = [s for s in sents if not re.search(r"\b(narith|nerith|elfa)\b", s, re.IGNORECASE)]
-                return _force_paragraphs(" ".join(sents), max_frases_por_par=2, alvo_pars=(3, 5))
-        return texto
+def _content_of(data: Dict) -> str:
+    return (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
 
-    def _is_short_followup(p: str) -> bool:
-        p0 = (p or "").strip().lower()
-        if p0.startswith("continuar") or p0.startswith("continuar:") or p0.startswith("continar:") or p0.startswith("cont"):
-            return True
-        if len(p0) <= 80:
-            if re.search(r"^(sim|ok|claro|isso|beleza|perfeito|ótimo|ta|tá|pode|vamos|quero|continua|seguir|manda|ah!?.*café|um café)", p0):
-                return True
-        return False
+# marcador no stream: o rascunho mostrado até aqui deve ser descartado (nova geração)
+STREAM_RESET = "\x00reset"
+
+_FIM_DE_FRASE = re.compile(r"[.!?…]")
+
+def _payload_reforcado(turno: Dict[str, object]) -> Dict[str, object]:
+    """Payload do turno com o reforço canônico da Mary logo após a persona."""
+    messages = turno["messages"]
+    return {**turno["payload"], "messages": [messages[0], reforco_system()] + messages[1:]}
+
+def _modo_especulativo(turno: Dict[str, object]) -> str:
+    if turno["char"].lower() != "mary":
+        return "off"
+    return settings.MARY_ESPECULATIVO
+
+async def _aespecular_mary(
+    turno: Dict[str, object], prazo: transport.Prazo, cobrancas: Dict[str, _Cobranca]
+) -> Tuple[Tuple[Dict, str, str], str]:
+    """
+    Dispara a chamada normal e a reforçada juntas; fica com a primeira resposta que
+    termina sem violar o canon e cancela a outra. Se nenhuma passar, vale a reforçada
+    (como no retry sequencial). Retorna (resposta, papel da vencedora); cada perna
+    deixa em `cobrancas` a própria duração e custo (ver service_router._cobrada),
+    inclusive a cancelada depois de enviada.
+    """
+    model = turno["model"]
+    reforcado = _payload_reforcado(turno)
+    pernas = {
+        "primaria": asyncio.ensure_future(
+            _cobrada(cobrancas, "primaria", model, turno["payload"],
+                     lambda: aroute_chat_strict(model, turno["payload"], prazo))
+        ),
+        "reforcada": asyncio.ensure_future(
+            _cobrada(cobrancas, "reforcada", model, reforcado, lambda: aroute_chat_strict(model, reforcado, prazo))
+        ),
+    }
+    primaria, reforcada = pernas["primaria"], pernas["reforcada"]
+    pendentes = {primaria, reforcada}
+    vencedora = None
+    try:
+        while pendentes and vencedora is None:
+            prontas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+            vencedora = next(
+                (t for t in prontas if t.exception() is None and not violou_mary(_content_of(t.result()[0]))),
+                None,
+            )
+        if vencedora is None:
+            vencedora = next(
+                (t for t in (reforcada, primaria) if t.exception() is None and _content_of(t.result()[0])), None
+            )
+    finally:
+        canceladas = [t for t in pendentes if not t.done()]
+        for t in canceladas:
+            t.cancel()
+        if canceladas:  # espera o cancelamento assentar (sonda do disjuntor, cobrança)
+            await asyncio.wait(canceladas)
+    if vencedora is not None:
+        return vencedora.result(), next(papel for papel, t in pernas.items() if t is vencedora)
+    raise primaria.exception() or reforcada.exception() or RuntimeError("resposta vazia")
+
+def _drenar(gen: Generator):
+    """Consome um gerador sem mostrar nada e devolve o seu valor de retorno."""
+    while True:
+        try:
+            next(gen)
+        except StopIteration as fim:
+            return fim.value
 
-    # --- início do fluxo original ---
+def _stream_vigiado(turno: Dict[str, object]) -> Generator[str, None, Tuple[str, str, str]]:
+    """
+    Stream da chamada normal. No modo especulativo 'stream' (Mary), confere o canon a
+    cada fim de frase: se violar, aborta o stream, emite STREAM_RESET e passa a
+    transmitir a chamada reforçada. Retorna (texto, used_model, provider).
+    """
+    vigiar = _modo_especulativo(turno) == "stream"
+    chunks, used_model, provider = route_chat_strict_stream(turno["model"], turno["payload"])
+    partes: List[str] = []
+    violou = False
+    try:
+        for piece in chunks:
+            partes.append(piece)
+            yield piece
+            if vigiar and _FIM_DE_FRASE.search(piece) and violou_mary("".join(partes)):
+                violou = True
+                break
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    if not violou:
+        return "".join(partes), used_model, provider
+
+    yield STREAM_RESET
+    turno["canon_resolvido"] = True
+    chunks, used_model, provider = route_chat_strict_stream(turno["model"], _payload_reforcado(turno))
+    partes = []
+    for piece in chunks:
+        partes.append(piece)
+        yield piece
+    return "".join(partes), used_model, provider
+
+def _usuario_key(usuario: str, char: str) -> str:
+    # chave de usuário por personagem (Mary usa legado; outras isolam)
+    return usuario if char.lower() == "mary" else f"{usuario}::{char.lower()}"
+
+@metrics.cronometrado("preparar")
+def _preparar_turno(
+    usuario: str, prompt_usuario: str, model: str, character: str, contexto: Optional[Sequence[object]] = None
+) -> Dict[str, object]:
+    """
+    Tudo o que vem antes da chamada ao modelo: fatos, histórico, PINs e payload.
+    Compartilhado por `gerar_resposta` e `gerar_resposta_stream`.
+    """
     char = (character or "Mary").strip()
     persona_text, history_boot = get_persona(char)
-    usuario_key = usuario if char.lower() == "mary" else f"{usuario}::{char.lower()}"
+    usuario_key = _usuario_key(usuario, char)
+
+    # fatos do turno: uma leitura de mary_state; escritas vão no flush do fim do turno
+    snap = StateSnapshot(usuario_key)
 
     # local (NÃO sobrescreve se não houver dica clara no prompt)
     loc = infer_from_prompt(prompt_usuario) or ""
     if loc:
-        set_fact(usuario_key, "local_cena_atual", loc, {"fonte": "service"})
+        snap.set_fact("local_cena_atual", loc, {"fonte": "service"})
 
-    # contexto
-    hist = _montar_historico(usuario_key, history_boot)
-    local_atual = get_fact(usuario_key, "local_cena_atual", "") or ""
-    memo = _memory_context(usuario_key)
+    # contexto (turnos antigos entram pelo resumo da cena, não crus)
+    try:
+        resumo = get_scene_summary(usuario_key) or {}
+    except Exception:
+        resumo = {}
+    # anti-eco: impressões salvas com as últimas respostas (uma leitura limit N);
+    # sem histórico no banco, hash das falas que a UI já tem
+    ultimas_impressoes = _impressoes_recentes(usuario_key)
+    if not ultimas_impressoes:
+        ultimas_impressoes = _impressoes_do_contexto(contexto)
+    memoria_cena = {
+        "role": "system",
+        "content": f"MEMÓRIA_DA_CENA (resumo dos turnos anteriores; é canônico):\n{resumo['resumo']}"
+    } if resumo.get("resumo") else None
+    local_atual = snap.get_fact("local_cena_atual", "") or ""
+    memo = _memory_context(usuario_key, snap)
 
     # estado narrativo + PIN
-    state = _narrative_state(usuario_key)
+    state = _narrative_state(usuario_key, snap)
     arc_pin = _narrative_pin_msg(state)
 
     # flags
-    flirt_mode = bool(get_fact(usuario_key, "flirt_mode", False))
-    nsfw_on = bool(nsfw_enabled(usuario_key))
-    parceiro = (get_fact(usuario_key, "parceiro_atual", "") or "").strip().lower()
+    flirt_mode = bool(snap.get_fact("flirt_mode", False))
+    nsfw_on = bool(nsfw_enabled(usuario_key, snap=snap))
+    parceiro = (snap.get_fact("parceiro_atual", "") or "").strip().lower()
     romance_on = (char.lower() == "laura" and parceiro in {"janio", "jânio"})
 
     # estilo + few-shots
@@ -788,37 +1019,81 @@ def gerar_resposta(usuario: str, prompt_usuario: str, model: str, character: str
         )
     } if _is_short_followup(prompt_usuario) else None
 
-    messages: List[Dict[str, str]] = (
+    cabeca: List[Dict[str, str]] = (
         [{"role": "system", "content": persona_text}, estilo_msg, local_pin, arc_pin, antirepeat_pin]
         + ([progress_pin] if progress_pin else [])
         + (few if few else [])
-        + hist
-        + [{
-            "role": "user",
-            "content": (
-                f"LOCAL_ATUAL: {local_atual}\n"
-                f"CONTEXTO_PERSISTENTE:\n{memo}\n\n"
-                f"{prompt_usuario}"
-            )
-        }]
+        + ([memoria_cena] if memoria_cena else [])
+    )
+    pedido = {
+        "role": "user",
+        "content": (
+            f"LOCAL_ATUAL: {local_atual}\n"
+            f"CONTEXTO_PERSISTENTE:\n{memo}\n\n"
+            f"{prompt_usuario}"
+        )
+    }
+
+    # orçamento: a janela do modelo menos a saída do turno e o resto do prompt (core/catalog.py)
+    max_saida = catalog.max_tokens(model, get_alvo_saida(char))
+    limite_hist = (
+        min(settings.HIST_TETO_TOKENS, catalog.orcamento_prompt(model, max_saida))
+        - sum(_toklen_fixo(m["content"]) for m in cabeca)
+        - toklen(pedido["content"])
+        - _reserva_recordacoes()
+    )
+    corte: Dict[str, object] = {}
+    hist = _montar_historico(
+        usuario_key, history_boot, limite_tokens=max(0, limite_hist),
+        ate_id=resumo.get("ate_id") if resumo.get("resumo") else None, corte=corte,
     )
+    # campanha maior que a janela: turnos antigos ligados ao pedido voltam pela busca
+    recordacoes = (
+        _memorias_relevantes(usuario_key, char, prompt_usuario, corte["antes_de"]) if "antes_de" in corte else None
+    )
+    messages: List[Dict[str, str]] = cabeca + ([recordacoes] if recordacoes else []) + hist + [pedido]
 
     payload = {
         "model": model,
         "messages": messages,
-        "max_tokens": 2048,
+        "max_tokens": max_saida,
         "temperature": 0.6,
         "top_p": 0.9,
     }
 
-    # chamada
-    data, used_model, provider = route_chat_strict(model, payload)
-    resposta = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or ""
+    return {
+        "char": char,
+        "usuario_key": usuario_key,
+        "snap": snap,
+        "prompt": prompt_usuario,
+        "model": model,
+        "messages": messages,
+        "payload": payload,
+        "local_atual": local_atual,
+        "state": state,
+        "flirt_mode": flirt_mode,
+        "nsfw_on": nsfw_on,
+        "ultimas_impressoes": ultimas_impressoes,
+    }
 
-    # Mary: reforço canônico
-    if char.lower() == "mary" and violou_mary(resposta):
-        data2, _, _ = route_chat_strict(model, {**payload, "messages": [messages[0], reforco_system()] + messages[1:]})
-        resposta = (data2.get("choices", [{}])[0].get("message", {}) or {}).get("content", "") or resposta
+@metrics.cronometrado("finalizar")
+def _finalizar_turno(turno: Dict[str, object], resposta: str, provider: str, used_model: str) -> str:
+    """Tudo o que vem depois da resposta bruta: reforços, pós-processo, flags e persistência."""
+    char = turno["char"]
+    usuario_key = turno["usuario_key"]
+    snap = turno["snap"]
+    prompt_usuario = turno["prompt"]
+    model = turno["model"]
+    local_atual = turno["local_atual"]
+    state = turno["state"]
+    flirt_mode = turno["flirt_mode"]
+    nsfw_on = turno["nsfw_on"]
+
+    # Mary: reforço canônico (o modo especulativo já resolveu antes, se ativo)
+    if char.lower() == "mary" and not turno.get("canon_resolvido") and violou_mary(resposta):
+        with metrics.span("reforco_canon"):
+            data2, _, _ = route_chat_strict(model, _payload_reforcado(turno))
+        resposta = _content_of(data2) or resposta
 
     # 1ª pessoa se escorregar
     if _precisa_primeira_pessoa(resposta, char):
@@ -827,34 +1102,103 @@ def gerar_resposta(usuario: str, prompt_usuario: str, model: str, character: str
         except Exception:
             pass
 
-    # pós-processo: coerência + tom + parágrafos (com refinadores por personagem)
-    resposta = _pos_processar_seguro(
-        resposta,
-        max_frases_por_par=2,
-        local_atual=local_atual,
-        anti_derail=True,
-        character=char,
-        user_prompt=prompt_usuario,
-        nsfw_on=nsfw_on,
-    )
-
-    # coerência do arco (impede recaída para boate) + promoção de flags do arco
-    resposta = _enforce_arc(resposta, local_atual, state)
-    _maybe_update_arc_flags(usuario_key, prompt_usuario, resposta)
-
-    # anti-eco contra a última resposta + anti-duplicação interna
-    resposta = _dedupe_against_last(resposta, usuario_key)
-    resposta = _force_paragraphs(resposta, max_frases_por_par=2, alvo_pars=(3, 5))
+    # pós-processo numa passada: coerência, refinadores por personagem, tom,
+    # arco (impede recaída para boate), anti-eco, escopo de personagem e parágrafos
+    ultimas = turno.get("ultimas_impressoes")
+    if ultimas is None:
+        ultimas = _impressoes_recentes(usuario_key)
+    pos_ctx: Dict[str, object] = {}
+    with metrics.span("pos_processar"):
+        resposta = _pos_processar_seguro(
+            resposta,
+            max_frases_por_par=2,
+            local_atual=local_atual,
+            anti_derail=True,
+            character=char,
+            user_prompt=prompt_usuario,
+            nsfw_on=nsfw_on,
+            state=state,
+            ctx=pos_ctx,
+            ultimas_impressoes=ultimas,
+        )
+        metrics.sub_tempos(pos_ctx.get("_tempos") or [])
 
-    # escopo de personagem (evita “Narith” aparecer em Laura/Mary sem pedido)
-    resposta = _enforce_character_scope(resposta, char, prompt_usuario)
+    # promoção de flags do arco
+    _maybe_update_arc_flags(usuario_key, prompt_usuario, resposta, snap)
 
     # fidelidade (Laura-only; a função já faz o gate por personagem)
     resposta = _maybe_stop_by_fidelity(prompt_usuario, resposta, usuario_key, char, local_atual, flirt_mode)
 
     # auto-plantar vínculo Laura→Janio quando houver sinal claro de compromisso
-    _talvez_plantar_vinculo(usuario_key, char, prompt_usuario, resposta)
+    _talvez_plantar_vinculo(usuario_key, char, prompt_usuario, resposta, snap)
+
+    # persistir (fatos do turno num único update_one)
+    with metrics.span("persistir"):
+        snap.flush()
+        save_interaction(usuario_key, prompt_usuario, resposta, f"{provider}:{used_model}")
+    metrics.anotar(provider=provider, used_model=used_model)
 
-    # persistir
-    save_interaction(usuario_key, prompt_usuario, resposta, f"{provider}:{used_model}")
+    # turnos que saíram da janela viram memória de cena (em segundo plano)
+    agendar_compactacao(usuario_key, model)
     return resposta
+
+def gerar_resposta(
+    usuario: str, prompt_usuario: str, model: str, character: str = "Mary",
+    contexto: Optional[Sequence[object]] = None,
+) -> str:
+    """
+    Um turno completo. `contexto` é a conversa que a UI já tem em memória (pares
+    (papel, texto) ou mensagens {role, content}); o anti-eco recorre a ele quando
+    o banco ainda não tem histórico do usuário.
+    """
+    with metrics.turno(usuario=usuario, personagem=character, modelo=model, modo="bloco"), \
+            transport.prazo_do_turno(), scheduler.em_nome_de(_usuario_key(usuario, character)):
+        turno = _preparar_turno(usuario, prompt_usuario, model, character, contexto)
+        modo = _modo_especulativo(turno)
+        with turno["snap"]:
+            # chamada
+            if modo == "paralelo" and ASYNC_HTTP:
+                cobrancas: Dict[str, _Cobranca] = {}
+                with vaga_para(model, turno["payload"], requisicoes=2) as vaga, \
+                        metrics.span("provedor.especulativo") as sp:
+                    vencedora = ""
+                    try:
+                        (data, used_model, provider), vencedora = aio.run(
+                            _aespecular_mary(turno, transport.prazo_atual(), cobrancas)
+                        )
+                    finally:
+                        # cada perna com a própria duração; a que não foi usada também custou
+                        tokens, custo = 0, 0.0
+                        for papel, cobranca in cobrancas.items():
+                            uso_perna, custo_perna = contabilizar(*cobranca)
+                            tokens += uso_perna["prompt_tokens"] + uso_perna["completion_tokens"]
+                            custo += custo_perna
+                            if papel == vencedora:
+                                uso = uso_perna
+                        vaga.acertar(tokens)
+                    sp.update(provider=provider, used_model=used_model, custo_usd=custo, **uso)
+                turno["canon_resolvido"] = True
+                resposta = _content_of(data)
+            elif modo == "stream":
+                resposta, used_model, provider = _drenar(_stream_vigiado(turno))
+            else:
+                data, used_model, provider = route_chat_strict(model, turno["payload"])
+                resposta = _content_of(data)
+
+            return _finalizar_turno(turno, resposta, provider, used_model)
+
+def gerar_resposta_stream(
+    usuario: str, prompt_usuario: str, model: str, character: str = "Mary",
+    contexto: Optional[Sequence[object]] = None,
+) -> Generator[str, None, str]:
+    """
+    Igual a `gerar_resposta`, mas em streaming: gera os pedaços de texto bruto
+    conforme o provedor os envia. O texto final (pós-processado e salvo) é o
+    valor de retorno do gerador (`StopIteration.value`), que substitui o rascunho.
+    """
+    with metrics.turno(usuario=usuario, personagem=character, modelo=model, modo="stream"), \
+            transport.prazo_do_turno(), scheduler.em_nome_de(_usuario_key(usuario, character)):
+        turno = _preparar_turno(usuario, prompt_usuario, model, character, contexto)
+        with turno["snap"]:
+            resposta, used_model, provider = yield from _stream_vigiado(turno)
+            return _finalizar_turno(turno, resposta, provider, used_model)
@@ -1,30 +1,475 @@
 # core/service_router.py
-from typing import Tuple, Dict, Any
+import asyncio
+import contextvars
+import sys
+import time
+from contextlib import ExitStack
+from typing import Tuple, Dict, Any, Iterator, AsyncIterator, Awaitable, Callable, List, Optional, Sequence, TypeVar
+
+from . import aio
+from . import catalog
+from . import latencia
+from . import metrics
+from . import scheduler
+from . import transport
+from .config import settings
+from .repositories import register_usage
+from .tokens import toklen
 
 # Importa clientes dos provedores
-from .openrouter import chat as openrouter_chat
+from .openrouter import (
+    chat as openrouter_chat, chat_stream as openrouter_chat_stream,
+    achat as openrouter_achat, achat_stream as openrouter_achat_stream,
+    httpx as _httpx,
+)
 
 try:
-    from .together import chat as together_chat
+    from .together import (
+        chat as together_chat, chat_stream as together_chat_stream,
+        achat as together_achat, achat_stream as together_achat_stream,
+    )
 except Exception as e:
     together_chat = None
+    together_chat_stream = None
+    together_achat = None
+    together_achat_stream = None
     _together_import_error = e
 
-def route_chat_strict(model: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], str, str]:
+# Provedor local de mentira (testes de carga/latência offline)
+from .local import (
+    chat as local_chat, chat_stream as local_chat_stream,
+    achat as local_achat, achat_stream as local_achat_stream,
+)
+
+# provider -> (chat, chat_stream, achat, achat_stream)
+_CLIENTES = {
+    "OpenRouter": (openrouter_chat, openrouter_chat_stream, openrouter_achat, openrouter_achat_stream),
+    "Together": (together_chat, together_chat_stream, together_achat, together_achat_stream),
+    "Local": (local_chat, local_chat_stream, local_achat, local_achat_stream),
+}
+
+# Clientes assíncronos (pool compartilhado) quando httpx existe; senão, requests síncrono.
+ASYNC_HTTP = _httpx is not None and settings.ASYNC_HTTP not in {"0", "false", "off"}
+
+def _resolve(model: str, payload: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
     """
-    Roteia a chamada sem fallback silencioso:
-    - Se começar com 'together/', envia para Together (removendo o prefixo).
-    - Caso contrário, envia para OpenRouter.
-    Retorna: (data, used_model, provider)
+    Roteamento sem fallback silencioso:
+    - Se começar com 'together/', vai para Together (removendo o prefixo).
+    - Se começar com 'local/', vai para o provedor local de mentira (core/local.py).
+    - Caso contrário, vai para OpenRouter.
+    Retorna: (provider, used_model, payload_final)
     """
+    if model.startswith("local/"):
+        pl = dict(payload)
+        pl["model"] = model[len("local/"):]
+        return "Local", pl["model"].partition("?")[0], pl
     if model.startswith("together/"):
         if together_chat is None:
             raise RuntimeError(f"Together indisponível: {_together_import_error}")
         used = model[len("together/"):]
         pl = dict(payload)
         pl["model"] = used
-        data = together_chat(pl)
-        return data, used, "Together"
-    # OpenRouter
-    data = openrouter_chat(payload)
-    return data, model, "OpenRouter"
+        return "Together", used, pl
+    return "OpenRouter", model, payload
+
+def _chave(provider: str, used: str) -> str:
+    """Chave do disjuntor (um por modelo em cada provedor)."""
+    return f"{provider}:{used}"
+
+async def aroute_chat_strict(
+    model: str, payload: Dict[str, Any], prazo: Optional[transport.Prazo] = None,
+) -> Tuple[Dict[str, Any], str, str]:
+    """
+    Versão assíncrona de `route_chat_strict` (roda no loop compartilhado de core.aio).
+    ContextVars não atravessam para o loop: quem chama de dentro de um turno passa o `prazo`.
+    """
+    provider, used, pl = _resolve(model, payload)
+    achat = _CLIENTES[provider][2]
+    data = await transport.achamar(lambda t: achat(pl, timeout=t), _chave(provider, used), prazo)
+    return data, used, provider
+
+def aroute_chat_strict_stream(model: str, payload: Dict[str, Any]) -> Tuple[AsyncIterator[str], str, str]:
+    """Versão assíncrona de `route_chat_strict_stream`."""
+    provider, used, pl = _resolve(model, payload)
+    astream = _CLIENTES[provider][3]
+    return astream(pl), used, provider
+
+# -------- contabilidade (mary_uso) --------
+def contabilizar(
+    provider: str, used: str, ms: float, data: Optional[Dict[str, Any]] = None,
+    uso: Optional[Dict[str, int]] = None,
+) -> Tuple[Dict[str, int], float]:
+    """
+    Registra uma chamada no uso do usuario_key do turno (ver scheduler.em_nome_de)
+    e no registro do turno. Tokens vêm do `usage` da resposta (`data`) ou, no
+    stream, da estimativa local (`uso`); o custo é o `usage.cost` do provedor ou o
+    do catálogo. Retorna (uso, custo_usd).
+    """
+    estimado = uso is not None
+    uso = uso if estimado else metrics.usage_do(data)
+    modelo = catalog.chave(provider, used)
+    informado = ((data or {}).get("usage") or {}).get("cost")
+    custo = float(informado) if informado is not None else catalog.custo(
+        modelo, uso["prompt_tokens"], uso["completion_tokens"]
+    )
+    metrics.somar(chamadas=1, custo_usd=custo, **uso)
+    try:
+        register_usage(
+            scheduler.usuario_atual(), modelo, uso["prompt_tokens"], uso["completion_tokens"], custo, ms, estimado
+        )
+    except Exception as e:  # contabilidade não derruba o turno
+        print(f"[uso] falha ao registrar: {e!r}", file=sys.stderr)
+    return uso, custo
+
+def _tokens_prompt(payload: Dict[str, Any]) -> int:
+    return sum(toklen(m.get("content") or "") for m in payload.get("messages") or [])
+
+# -------- agendador (core/scheduler.py) --------
+def _tokens_estimados(payload: Dict[str, Any]) -> int:
+    """Prompt + teto de saída: o débito provisório no balde de tokens."""
+    return _tokens_prompt(payload) + int(payload.get("max_tokens") or 0)
+
+def vaga_para(model: str, payload: Dict[str, Any], requisicoes: int = 1):
+    """
+    Vaga no agendador para chamar `model` (context manager; ver scheduler.vaga).
+    `requisicoes` chamadas com o mesmo pedido (ex.: normal + reforçada) debitam
+    a estimativa de tokens de cada uma.
+    """
+    provider = _resolve(model, payload)[0]
+    tokens = requisicoes * _tokens_estimados(payload) if scheduler.limita_tokens(provider) else 0
+    return scheduler.vaga(provider, requisicoes, tokens)
+
+def _na_vaga(model: str, payload: Dict[str, Any], abrir: Callable[[], Iterator[str]]) -> Iterator[str]:
+    """Stream que só pede a vaga quando é consumido e a segura até fechar."""
+    with vaga_para(model, payload):
+        chunks = abrir()
+        try:
+            yield from chunks
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+def _segurando(cm: Any, chunks: Iterator[str]) -> Iterator[str]:
+    """Stream já aberto (hedge): devolve a vaga (`cm`, já com __enter__) quando ele fecha."""
+    try:
+        yield from chunks
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        cm.__exit__(None, None, None)
+
+# -------- hedge (opt-in) --------
+T = TypeVar("T")
+
+def _equivalentes(spec: str) -> Dict[str, str]:
+    """'primario>equivalente;...' -> {primario: equivalente}."""
+    out: Dict[str, str] = {}
+    for par in spec.split(";"):
+        primario, sep, equivalente = par.partition(">")
+        if sep and primario.strip() and equivalente.strip():
+            out[primario.strip()] = equivalente.strip()
+    return out
+
+_EQUIVALENTES = _equivalentes(settings.HEDGE_EQUIVALENTES)
+
+def _equivalente(model: str) -> Optional[str]:
+    """Modelo de hedge configurado para `model` (só com o cliente assíncrono)."""
+    return _EQUIVALENTES.get(model) if ASYNC_HTTP else None
+
+def _espera_hedge(model: str, payload: Dict[str, Any], tipo: str) -> Optional[float]:
+    """p95 do primário em segundos; None enquanto não houver amostras suficientes."""
+    provider, used, _ = _resolve(model, payload)
+    p = latencia.percentis(_chave(provider, used), tipo)
+    return p[1] / 1000.0 if p else None
+
+async def _ahedge(
+    primaria: Callable[[], Awaitable[T]],
+    reserva: Callable[[], Awaitable[T]],
+    espera_s: Optional[float],
+    descartar: Optional[Callable[[T], Awaitable[Any]]] = None,
+) -> Tuple[T, bool]:
+    """
+    Dispara `primaria`; se ela não der certo em `espera_s` (falhou ou passou do
+    p95), dispara `reserva` também e fica com o primeiro sucesso, cancelando a
+    outra (e esperando o cancelamento dela). Retorna (resultado, veio_da_reserva).
+    Se as duas falharem, vale o erro da primária. Sem p95 (`espera_s` None) não
+    há hedge: só a primária.
+    """
+    if espera_s is None:
+        return await primaria(), False
+    t1 = asyncio.ensure_future(primaria())
+    t2: Optional["asyncio.Future[T]"] = None
+    try:
+        await asyncio.wait({t1}, timeout=espera_s)
+        if t1.done() and t1.exception() is None:
+            return t1.result(), False
+        t2 = asyncio.ensure_future(reserva())
+        pendentes = {t for t in (t1, t2) if not t.done()}
+        vencedora = None
+        while pendentes and vencedora is None:
+            _, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+            vencedora = next((t for t in (t1, t2) if t.done() and t.exception() is None), None)
+    finally:
+        canceladas = [t for t in (t1, t2) if t is not None and not t.done()]
+        for t in canceladas:
+            t.cancel()
+        if canceladas:  # espera o cancelamento assentar (sonda do disjuntor, vaga, cobrança)
+            await asyncio.wait(canceladas)
+    if vencedora is None:
+        raise t1.exception() or t2.exception()
+    perdedora = t2 if vencedora is t1 else t1
+    if descartar and perdedora.done() and not perdedora.cancelled() and perdedora.exception() is None:
+        await descartar(perdedora.result())
+    return vencedora.result(), vencedora is t2
+
+async def _areserva(
+    ctx: contextvars.Context, model: str, payload: Dict[str, Any], fn: Callable[[], Awaitable[T]],
+) -> Tuple[T, scheduler.Vaga]:
+    """
+    A reserva do hedge também passa pelo agendador, nos baldes do provedor dela.
+    `ctx` é o contexto do turno (usuario_key, prazo, vaga já segurada): a vaga
+    sai aninhada, sem ocupar outra chamada simultânea do usuário. A espera roda
+    numa thread do executor (o agendador bloqueia) e sem aviso na UI.
+    """
+    cm = vaga_para(model, payload)
+
+    def _entrar() -> scheduler.Vaga:
+        with scheduler.ao_esperar(None):
+            return cm.__enter__()
+
+    def _devolver(f: "asyncio.Future[scheduler.Vaga]") -> None:
+        if not f.cancelled() and f.exception() is None:
+            ctx.run(cm.__exit__, None, None, None)
+
+    entrada = asyncio.get_running_loop().run_in_executor(None, ctx.run, _entrar)
+    try:
+        vaga = await asyncio.shield(entrada)
+    except asyncio.CancelledError:  # cancelada na fila: devolve a vaga quando ela sair
+        entrada.add_done_callback(_devolver)
+        raise
+    try:
+        return await fn(), vaga
+    finally:
+        ctx.run(cm.__exit__, None, None, None)
+
+# argumentos de `contabilizar`: (provider, used, ms, data, uso)
+_Cobranca = Tuple[str, str, float, Optional[Dict[str, Any]], Optional[Dict[str, int]]]
+
+async def _cobrada(
+    cobrancas: Dict[str, _Cobranca], papel: str, model: str, payload: Dict[str, Any],
+    chamar: Callable[[], Awaitable[T]], texto: Optional[Callable[[T], str]] = None,
+) -> T:
+    """
+    Uma perna do hedge, que deixa em `cobrancas[papel]` a própria duração e o que
+    custou: a resposta (ou, com `texto`, prompt + o que chegou do stream); se for
+    cancelada depois de enviada, o prompt, que o provedor cobra mesmo assim.
+    """
+    provider, used, _ = _resolve(model, payload)
+    prompt = _tokens_prompt(payload)
+    t0 = time.perf_counter()
+    try:
+        out = await chamar()
+    except asyncio.CancelledError:
+        ms = (time.perf_counter() - t0) * 1000.0
+        cobrancas[papel] = (provider, used, ms, None, {"prompt_tokens": prompt, "completion_tokens": 0})
+        raise
+    ms = (time.perf_counter() - t0) * 1000.0
+    if texto is None:
+        cobrancas[papel] = (provider, used, ms, out[0], None)
+    else:
+        uso = {"prompt_tokens": prompt, "completion_tokens": toklen(texto(out))}
+        cobrancas[papel] = (provider, used, ms, None, uso)
+    return out
+
+async def _aroute_hedge(
+    model: str, equivalente: str, payload: Dict[str, Any], prazo: transport.Prazo, ctx: contextvars.Context,
+    cobrancas: Dict[str, _Cobranca],
+) -> Tuple[Tuple[Dict[str, Any], str, str], bool]:
+    pl = {**payload, "model": equivalente}
+
+    async def reserva() -> Tuple[Dict[str, Any], str, str]:
+        chamar = lambda: aroute_chat_strict(equivalente, pl, prazo)  # noqa: E731
+        out, vaga = await _areserva(
+            ctx, equivalente, pl, lambda: _cobrada(cobrancas, "reserva", equivalente, pl, chamar)
+        )
+        uso = metrics.usage_do(out[0])
+        vaga.acertar(uso["prompt_tokens"] + uso["completion_tokens"])
+        return out
+
+    return await _ahedge(
+        lambda: _cobrada(cobrancas, "primaria", model, payload, lambda: aroute_chat_strict(model, payload, prazo)),
+        reserva,
+        _espera_hedge(model, payload, "total"),
+    )
+
+async def _aabrir_stream(
+    model: str, payload: Dict[str, Any], prazo: transport.Prazo,
+) -> Tuple[Optional[str], AsyncIterator[str], str, str]:
+    provider, used, pl = _resolve(model, payload)
+    astream = _CLIENTES[provider][3]
+    primeiro, resto = await transport.aabrir_stream(
+        lambda t: astream(pl, timeout=t), _chave(provider, used), prazo
+    )
+    return primeiro, resto, used, provider
+
+async def _aabrir_stream_hedge(
+    model: str, equivalente: str, payload: Dict[str, Any], prazo: transport.Prazo, ctx: contextvars.Context,
+    cobrancas: Dict[str, _Cobranca],
+) -> Tuple[Tuple[Optional[str], AsyncIterator[str], str, str], bool]:
+    """Corrida pelo primeiro pedaço (p95 do TTFT); o stream perdedor é fechado."""
+    pl = {**payload, "model": equivalente}
+
+    def _primeiro(aberto: Tuple[Optional[str], AsyncIterator[str], str, str]) -> str:
+        return aberto[0] or ""
+
+    async def _fechar(aberto: Tuple[Optional[str], AsyncIterator[str], str, str]) -> None:
+        await aberto[1].aclose()
+
+    async def reserva() -> Tuple[Optional[str], AsyncIterator[str], str, str]:
+        abrir = lambda: _aabrir_stream(equivalente, pl, prazo)  # noqa: E731
+        aberto, _ = await _areserva(
+            ctx, equivalente, pl, lambda: _cobrada(cobrancas, "reserva", equivalente, pl, abrir, _primeiro)
+        )
+        return aberto
+
+    return await _ahedge(
+        lambda: _cobrada(
+            cobrancas, "primaria", model, payload, lambda: _aabrir_stream(model, payload, prazo), _primeiro
+        ),
+        reserva,
+        _espera_hedge(model, payload, "ttft"),
+        _fechar,
+    )
+
+async def _acom_primeiro(primeiro: Optional[str], resto: AsyncIterator[str]) -> AsyncIterator[str]:
+    try:
+        if primeiro is None:
+            return
+        yield primeiro
+        async for piece in resto:
+            yield piece
+    finally:
+        await resto.aclose()
+
+def route_chat_strict(model: str, payload: Dict[str, Any]) -> Tuple[Dict[str, Any], str, str]:
+    """
+    Roteia a chamada sem fallback silencioso (ver `_resolve`), pela camada de
+    core/transport.py (prazo do turno, novas tentativas e disjuntor por modelo).
+    Com um equivalente em settings.HEDGE_EQUIVALENTES, faz hedge (ver `_ahedge`);
+    `used_model`/`provider` são sempre os de quem respondeu.
+    Retorna: (data, used_model, provider)
+    """
+    with vaga_para(model, payload) as vaga, metrics.span("provedor", modelo=model) as sp:
+        t0 = time.perf_counter()
+        equivalente = _equivalente(model)
+        cobrancas: Dict[str, _Cobranca] = {}
+        if equivalente:
+            (data, used, provider), hedge = aio.run(
+                _aroute_hedge(
+                    model, equivalente, payload, transport.prazo_atual(), contextvars.copy_context(), cobrancas
+                )
+            )
+            sp["hedge"] = hedge
+            ms = cobrancas.pop("reserva" if hedge else "primaria")[2]  # a duração da perna que respondeu
+        elif ASYNC_HTTP:
+            data, used, provider = aio.run(aroute_chat_strict(model, payload, transport.prazo_atual()))
+        else:
+            provider, used, pl = _resolve(model, payload)
+            chat = _CLIENTES[provider][0]
+            data = transport.chamar(lambda t: chat(pl, timeout=t), _chave(provider, used))
+        if not equivalente:
+            ms = (time.perf_counter() - t0) * 1000.0
+        uso, custo = contabilizar(provider, used, ms, data)
+        for perdedora in cobrancas.values():  # a perna que perdeu o hedge também foi cobrada
+            custo += contabilizar(*perdedora)[1]
+        vaga.acertar(uso["prompt_tokens"] + uso["completion_tokens"])
+        sp.update(provider=provider, used_model=used, custo_usd=custo, **uso)
+        return data, used, provider
+
+def _stream_medido(
+    chunks: Iterator[str], provider: str, used: str, payload: Dict[str, Any], t0: Optional[float] = None,
+) -> Iterator[str]:
+    """
+    Stream dentro de um span com TTFT (desde `t0`, se a abertura veio antes);
+    tokens estimados localmente (o SSE não traz `usage`).
+    """
+    with metrics.span("provedor.stream", provider=provider, used_model=used) as sp:
+        t0 = t0 or time.perf_counter()
+        partes: List[str] = []
+        try:
+            for piece in chunks:
+                if not partes:
+                    sp["ttft_ms"] = round((time.perf_counter() - t0) * 1000.0, 3)
+                partes.append(piece)
+                yield piece
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+            uso, custo = contabilizar(
+                provider, used, (time.perf_counter() - t0) * 1000.0,
+                uso={"prompt_tokens": _tokens_prompt(payload), "completion_tokens": toklen("".join(partes))},
+            )
+            sp.update(estimado=True, custo_usd=custo, **uso)
+
+def route_chat_strict_stream(model: str, payload: Dict[str, Any]) -> Tuple[Iterator[str], str, str]:
+    """
+    Variante em streaming (SSE) de `route_chat_strict`, com o mesmo roteamento.
+    Retorna: (gerador de pedaços de texto, used_model, provider)
+    A requisição só parte quando o gerador é consumido; com hedge, a corrida pelo
+    primeiro pedaço acontece já aqui, para que used_model/provider sejam os do vencedor.
+    """
+    equivalente = _equivalente(model)
+    if equivalente:
+        vaga = vaga_para(model, payload)
+        vaga.__enter__()
+        cobrancas: Dict[str, _Cobranca] = {}
+        try:
+            t0 = time.perf_counter()
+            (primeiro, resto, used, provider), hedge = aio.run(
+                _aabrir_stream_hedge(
+                    model, equivalente, payload, transport.prazo_atual(), contextvars.copy_context(), cobrancas
+                )
+            )
+        except BaseException:
+            vaga.__exit__(None, None, None)
+            raise
+        cobrancas.pop("reserva" if hedge else "primaria", None)  # a vencedora é medida em _stream_medido
+        for perdedora in cobrancas.values():
+            contabilizar(*perdedora)
+        metrics.anotar(hedge=hedge)
+        chunks = aio.iterate(_acom_primeiro(primeiro, resto))
+        return _segurando(vaga, _stream_medido(chunks, provider, used, payload, t0)), used, provider
+    provider, used, pl = _resolve(model, payload)
+    if ASYNC_HTTP:
+        astream = _CLIENTES[provider][3]
+        abrir = lambda t: aio.iterate(astream(pl, timeout=t))  # noqa: E731
+    else:
+        stream = _CLIENTES[provider][1]
+        abrir = lambda t: stream(pl, timeout=t)  # noqa: E731
+    chave = _chave(provider, used)
+    chunks = _na_vaga(
+        model, payload, lambda: _stream_medido(transport.stream(abrir, chave), provider, used, payload)
+    )
+    return chunks, used, provider
+
+def route_chat_many(calls: Sequence[Tuple[str, Dict[str, Any]]]) -> List[Tuple[Dict[str, Any], str, str]]:
+    """
+    Várias chamadas independentes em paralelo (mesmo contrato de `route_chat_strict`
+    por item, resultados na ordem dada). Sem httpx, cai para chamadas em sequência.
+    """
+    if ASYNC_HTTP:
+        prazo = transport.prazo_atual()
+
+        async def _medida(m: str, p: Dict[str, Any]) -> Tuple[Tuple[Dict[str, Any], str, str], float]:
+            t0 = time.perf_counter()
+            out = await aroute_chat_strict(m, p, prazo)
+            return out, (time.perf_counter() - t0) * 1000.0
+
+        with ExitStack() as vagas:
+            for m, p in calls:
+                vagas.enter_context(vaga_para(m, p))  # a partir da 2ª, aninhadas: só os baldes
+            medidas = aio.gather(*(_medida(m, p) for m, p in calls))
+        for (data, used, provider), ms in medidas:  # cada chamada com a própria duração
+            contabilizar(provider, used, ms, data)
+        return [out for out, _ in medidas]
+    return [route_chat_strict(m, p) for m, p in calls]
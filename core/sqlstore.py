@@ -0,0 +1,369 @@
+# core/sqlstore.py
+"""
+Coleções em SQLite local (WAL) com a mesma API de `core/memstore.py` — o subconjunto
+do pymongo usado pelos repositórios. Usado com REPO_BACKEND=sqlite: deploy de um nó
+só, leitura de estado sem ida e volta ao Atlas.
+
+Cada coleção é uma tabela (_id, doc JSON). Campos indexados com `create_index` viram
+índices de expressão sobre json_extract e os filtros/ordenações sobre eles descem
+para o SQL; o resto do filtro é conferido em Python (`memstore.matches`). Convenção:
+campos indexados guardam valores escalares (usuario_norm, tipo, ts...).
+"""
+import itertools
+import json
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from .config import settings
+from .memstore import Result, _norm_sort, _Sort, apply_update, matches, project, sort_docs, upsert_doc
+
+_DT = "$dt:"
+_OPS_SQL = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+# -------- (de)serialização: datetimes viram strings ISO ordenáveis --------
+def _enc(v: Any) -> Any:
+    if isinstance(v, datetime):
+        return _DT + v.isoformat(timespec="microseconds")
+    if isinstance(v, dict):
+        return {k: _enc(x) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return [_enc(x) for x in v]
+    return v
+
+
+def _dec(v: Any) -> Any:
+    if isinstance(v, str) and v.startswith(_DT):
+        return datetime.fromisoformat(v[len(_DT):])
+    if isinstance(v, dict):
+        return {k: _dec(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [_dec(x) for x in v]
+    return v
+
+
+def _dumps(doc: Dict[str, Any]) -> str:
+    return json.dumps(_enc({k: v for k, v in doc.items() if k != "_id"}), ensure_ascii=False)
+
+
+def _row_doc(_id: Any, raw: str) -> Dict[str, Any]:
+    d = _dec(json.loads(raw))
+    return {"_id": _dec(_id), **d}
+
+
+def _ident(nome: str) -> str:
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def _expr(campo: str) -> str:
+    if campo == "_id":
+        return "_id"
+    path = "$" + "".join('."' + p.replace('"', '\\"') + '"' for p in campo.split("."))
+    return f"json_extract(doc, '{path}')"
+
+
+def _escalar(v: Any) -> bool:
+    return isinstance(v, (str, int, float, datetime))
+
+
+class SqlCursor:
+    def __init__(self, col: "SqlCollection", flt: Dict[str, Any], projection: Optional[Dict[str, Any]]):
+        self._col = col
+        self._flt = flt
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = []
+        self._skip = 0
+        self._limit = 0
+        self._batch = 100
+        self._it: Optional[Iterator[Dict[str, Any]]] = None
+        self._cur: Optional[sqlite3.Cursor] = None
+
+    def sort(self, key: _Sort, direction: int = 1) -> "SqlCursor":
+        self._sort = _norm_sort(key, direction)
+        return self
+
+    def skip(self, n: int) -> "SqlCursor":
+        self._skip = n
+        return self
+
+    def limit(self, n: int) -> "SqlCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> "SqlCursor":
+        self._batch = max(1, n)
+        return self
+
+    def close(self) -> None:
+        if self._cur is not None:
+            self._cur.close()
+        self._it = iter(())
+
+    def _linhas(self, cur: sqlite3.Cursor) -> Iterator[Tuple[Any, str]]:
+        while True:
+            rows = cur.fetchmany(self._batch)
+            if not rows:
+                return
+            yield from rows
+
+    def _run(self) -> Iterator[Dict[str, Any]]:
+        where, params, exato = self._col._where(self._flt)
+        sort_sql = all(self._col._indexado(f) for f, _ in self._sort)
+        sql = f"SELECT _id, doc FROM {self._col._t}{where}"
+        if self._sort and sort_sql:
+            sql += " ORDER BY " + ", ".join(f"{_expr(f)} {'DESC' if d < 0 else 'ASC'}" for f, d in self._sort)
+        pagina_sql = exato and (sort_sql or not self._sort)
+        if pagina_sql and (self._limit or self._skip):
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [self._limit or -1, self._skip]
+        self._cur = self._col._conn().execute(sql, params)
+        docs: Iterator[Dict[str, Any]] = (_row_doc(i, raw) for i, raw in self._linhas(self._cur))
+        if not exato:
+            docs = (d for d in docs if matches(d, self._flt))
+        if self._sort and not sort_sql:
+            docs = iter(sort_docs(list(docs), self._sort))
+        if not pagina_sql and (self._limit or self._skip):
+            docs = itertools.islice(docs, self._skip, self._skip + self._limit if self._limit else None)
+        return (project(d, self._projection) for d in docs)
+
+    def __iter__(self) -> "SqlCursor":
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self._it is None:
+            self._it = self._run()
+        return next(self._it)
+
+
+class SqlCollection:
+    def __init__(self, store: "SqlStore", name: str):
+        self.name = name
+        self._store = store
+        self._t = _ident(name)
+        self._indices: Set[str] = {"_id"}
+        with store.escrita() as c:
+            c.execute(f"CREATE TABLE IF NOT EXISTS {self._t} (_id PRIMARY KEY, doc TEXT NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        return self._store.conn()
+
+    def _indexado(self, campo: str) -> bool:
+        return campo in self._indices
+
+    def _where(self, flt: Optional[Dict[str, Any]]) -> Tuple[str, List[Any], bool]:
+        """(cláusula WHERE, parâmetros, exato?) — só campos indexados descem para o SQL."""
+        partes: List[str] = []
+        params: List[Any] = []
+        exato = True
+        for campo, cond in (flt or {}).items():
+            if not self._indexado(campo):
+                exato = False
+                continue
+            e = _expr(campo)
+            if isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond):
+                for op, arg in cond.items():
+                    if op in _OPS_SQL and _escalar(arg):
+                        partes.append(f"{e} {_OPS_SQL[op]} ?")
+                        params.append(_enc(arg))
+                    elif op == "$in" and arg and all(_escalar(x) for x in arg):
+                        partes.append(f"{e} IN ({','.join('?' * len(arg))})")
+                        params.extend(_enc(x) for x in arg)
+                    else:
+                        exato = False
+            elif _escalar(cond):
+                partes.append(f"{e} = ?")
+                params.append(_enc(cond))
+            else:
+                exato = False
+        return (" WHERE " + " AND ".join(partes) if partes else ""), params, exato
+
+    def _primeiro(self, c: sqlite3.Connection, flt: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        where, params, exato = self._where(flt)
+        cur = c.execute(f"SELECT _id, doc FROM {self._t}{where}" + (" LIMIT 1" if exato else ""), params)
+        for i, raw in cur:
+            d = _row_doc(i, raw)
+            if exato or matches(d, flt):
+                return d
+        return None
+
+    # -------- leitura --------
+    def find(self, flt: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> SqlCursor:
+        return SqlCursor(self, flt or {}, projection)
+
+    def find_one(
+        self, flt: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+        sort: Optional[_Sort] = None,
+    ) -> Optional[Dict[str, Any]]:
+        cur = self.find(flt, projection)
+        if sort:
+            cur.sort(sort)
+        try:
+            return next(iter(cur.limit(1)), None)
+        finally:
+            cur.close()
+
+    def count_documents(self, flt: Optional[Dict[str, Any]] = None) -> int:
+        where, params, exato = self._where(flt)
+        if exato:
+            return self._conn().execute(f"SELECT COUNT(*) FROM {self._t}{where}", params).fetchone()[0]
+        return sum(1 for _ in self.find(flt, {"_id": 1}))
+
+    def estimated_document_count(self) -> int:
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self._t}").fetchone()[0]
+
+    # -------- escrita --------
+    def _inserir(self, c: sqlite3.Connection, doc: Dict[str, Any]) -> Any:
+        if "_id" in doc:
+            c.execute(f"INSERT INTO {self._t} (_id, doc) VALUES (?, ?)", (_enc(doc["_id"]), _dumps(doc)))
+            return doc["_id"]
+        novo = c.execute(f"SELECT COALESCE(MAX(rowid), 0) + 1 FROM {self._t}").fetchone()[0]
+        c.execute(f"INSERT INTO {self._t} (rowid, _id, doc) VALUES (?, ?, ?)", (novo, novo, _dumps(doc)))
+        return novo
+
+    def insert_one(self, doc: Dict[str, Any]) -> Result:
+        with self._store.escrita() as c:
+            doc["_id"] = self._inserir(c, doc)
+        return Result(inserted_id=doc["_id"])
+
+    def insert_many(self, docs: Sequence[Dict[str, Any]]) -> Result:
+        with self._store.escrita() as c:
+            for d in docs:
+                d["_id"] = self._inserir(c, d)
+        return Result(inserted_ids=[d["_id"] for d in docs])
+
+    def _gravar(self, c: sqlite3.Connection, d: Dict[str, Any]) -> None:
+        c.execute(f"UPDATE {self._t} SET doc = ? WHERE _id = ?", (_dumps(d), _enc(d["_id"])))
+
+    def update_one(self, flt: Dict[str, Any], update: Dict[str, Any], upsert: bool = False) -> Result:
+        with self._store.escrita() as c:
+            d = self._primeiro(c, flt)
+            if d is not None:
+                apply_update(d, update, inserting=False)
+                self._gravar(c, d)
+                return Result(matched_count=1, modified_count=1, upserted_id=None)
+            if not upsert:
+                return Result(matched_count=0, modified_count=0, upserted_id=None)
+            novo = upsert_doc(flt, update)
+            return Result(matched_count=0, modified_count=0, upserted_id=self._inserir(c, novo))
+
+    def update_many(self, flt: Dict[str, Any], update: Dict[str, Any]) -> Result:
+        with self._store.escrita() as c:
+            where, params, _ = self._where(flt)
+            alvo = [_row_doc(i, raw) for i, raw in c.execute(f"SELECT _id, doc FROM {self._t}{where}", params)]
+            n = 0
+            for d in alvo:
+                if matches(d, flt):
+                    apply_update(d, update, inserting=False)
+                    self._gravar(c, d)
+                    n += 1
+        return Result(matched_count=n, modified_count=n)
+
+    def replace_one(self, flt: Dict[str, Any], doc: Dict[str, Any], upsert: bool = False) -> Result:
+        with self._store.escrita() as c:
+            d = self._primeiro(c, flt)
+            if d is not None:
+                novo = {**doc, "_id": doc.get("_id", d["_id"])}
+                c.execute(f"DELETE FROM {self._t} WHERE _id = ?", (_enc(d["_id"]),))
+                self._inserir(c, novo)
+                return Result(matched_count=1, modified_count=1)
+            if upsert:
+                self._inserir(c, dict(doc))
+        return Result(matched_count=0, modified_count=0)
+
+    def _apagar(self, flt: Dict[str, Any], limite: int = 0) -> Result:
+        with self._store.escrita() as c:
+            where, params, exato = self._where(flt)
+            if exato and not limite:
+                return Result(deleted_count=c.execute(f"DELETE FROM {self._t}{where}", params).rowcount)
+            ids = []
+            for i, raw in c.execute(f"SELECT _id, doc FROM {self._t}{where}", params):
+                if exato or matches(_row_doc(i, raw), flt):
+                    ids.append(i)
+                    if limite and len(ids) >= limite:
+                        break
+            c.executemany(f"DELETE FROM {self._t} WHERE _id = ?", [(i,) for i in ids])
+        return Result(deleted_count=len(ids))
+
+    def delete_many(self, flt: Dict[str, Any]) -> Result:
+        return self._apagar(flt)
+
+    def delete_one(self, flt: Dict[str, Any]) -> Result:
+        return self._apagar(flt, limite=1)
+
+    def create_index(self, keys: _Sort, **_kw: Any) -> str:
+        """Índice de expressão (json_extract) nos campos; opções do Mongo (TTL, unique...) são ignoradas."""
+        spec = _norm_sort(keys)
+        nome = re.sub(r"\W", "_", f"{self.name}__" + "__".join(f"{f}_{d}" for f, d in spec))
+        cols = ", ".join(f"{_expr(f)} {'DESC' if d < 0 else 'ASC'}" for f, d in spec)
+        with self._store.escrita() as c:
+            c.execute(f"CREATE INDEX IF NOT EXISTS {_ident(nome)} ON {self._t} ({cols})")
+        self._indices.update(f for f, _ in spec)
+        return nome
+
+
+class SqlStore:
+    """
+    Um arquivo SQLite em WAL. Por thread, uma conexão de leitura (cursores abertos
+    seguram só um snapshot) e outra de escrita: assim uma escrita no meio de uma
+    iteração não esbarra no próprio snapshot e espera o lock no busy timeout.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._cols: Dict[str, SqlCollection] = {}
+        self.conn().execute("PRAGMA journal_mode=WAL")
+
+    def _abrir(self) -> sqlite3.Connection:
+        c = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        c.execute("PRAGMA synchronous=NORMAL")
+        return c
+
+    def conn(self) -> sqlite3.Connection:
+        c = getattr(self._local, "leitura", None)
+        if c is None:
+            c = self._local.leitura = self._abrir()
+        return c
+
+    def conn_escrita(self) -> sqlite3.Connection:
+        c = getattr(self._local, "escrita", None)
+        if c is None:
+            c = self._local.escrita = self._abrir()
+        return c
+
+    class _Tx:
+        def __init__(self, store: "SqlStore"):
+            self.c = store.conn_escrita()
+
+        def __enter__(self) -> sqlite3.Connection:
+            self.c.execute("BEGIN IMMEDIATE")
+            return self.c
+
+        def __exit__(self, exc_type, exc, tb) -> None:
+            self.c.execute("ROLLBACK" if exc_type else "COMMIT")
+
+    def escrita(self) -> "SqlStore._Tx":
+        """Transação de escrita (BEGIN IMMEDIATE): ler-modificar-gravar sem corrida."""
+        return SqlStore._Tx(self)
+
+    def get_col(self, name: str) -> SqlCollection:
+        with self._lock:
+            col = self._cols.get(name)
+            if col is None:
+                col = self._cols[name] = SqlCollection(self, name)
+            return col
+
+
+_store: Optional[SqlStore] = None
+_store_lock = threading.Lock()
+
+def get_col(name: str) -> SqlCollection:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SqlStore(settings.SQLITE_PATH)
+    return _store.get_col(name)
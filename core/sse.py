@@ -0,0 +1,49 @@
+# core/sse.py
+import json
+from typing import AsyncIterator, Iterator, List, Optional
+
+
+def _deltas_of(raw: str, provider: str) -> Optional[List[str]]:
+    """
+    Pedaços de texto de uma linha SSE OpenAI-like; None no `[DONE]`.
+    Ignora comentários (": ..."), linhas vazias e JSON quebrado.
+    """
+    if not raw or raw.startswith(":") or not raw.startswith("data:"):
+        return []
+    data = raw[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        ev = json.loads(data)
+    except ValueError:
+        return []
+    if ev.get("error"):
+        raise RuntimeError(f"{provider} stream error: {ev['error']}")
+    out = []
+    for ch in ev.get("choices") or []:
+        piece = ((ch.get("delta") or {}).get("content")) or ""
+        if piece:
+            out.append(piece)
+    return out
+
+
+def iter_deltas(resp, provider: str = "provider") -> Iterator[str]:
+    """
+    Lê um stream SSE OpenAI-like (`stream: true`) de uma resposta `requests`
+    e devolve só os pedaços de texto de `choices[0].delta.content`.
+    """
+    for raw in resp.iter_lines(decode_unicode=True):
+        pieces = _deltas_of(raw, provider)
+        if pieces is None:
+            break
+        yield from pieces
+
+
+async def aiter_deltas(resp, provider: str = "provider") -> AsyncIterator[str]:
+    """Igual a `iter_deltas`, para uma resposta `httpx` em streaming."""
+    async for raw in resp.aiter_lines():
+        pieces = _deltas_of(raw, provider)
+        if pieces is None:
+            break
+        for piece in pieces:
+            yield piece
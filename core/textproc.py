@@ -1,6 +1,9 @@
 # core/textproc.py
+import hashlib
 import re
-from typing import List
+import unicodedata
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set
 
 # Split de sentenças seguro (evita dividir em abreviações simples e limpa espaços)
 _SENT_SPLIT_RE = re.compile(
@@ -52,6 +55,49 @@ def _split_sentences(text: str) -> List[str]:
             cleaned.append(s)
     return cleaned
 
+# --- Segmentação do pós-processo (compatível, sem look-behind variável) ---
+_SENT_END = re.compile(r'([.!?…]["”»\']?)\s+')
+
+def split_frases(text: str) -> List[str]:
+    """Sentenças como o pós-processo as vê (mesma regra para o anti-eco e as impressões)."""
+    text = re.sub(r'\s*\n+\s*', ' ', text)
+    parts, i = [], 0
+    for m in _SENT_END.finditer(text):
+        parts.append(text[i:m.end(1)].strip())
+        i = m.end()
+    tail = text[i:].strip()
+    if tail:
+        parts.append(tail)
+    return [p for p in parts if p]
+
+def norm_frase(s: str) -> str:
+    s = re.sub(r"\s+", " ", s)
+    s = re.sub(r"[^\wáéíóúâêîôûãõàç]+", " ", s, flags=re.IGNORECASE)
+    return s.strip().lower()
+
+def impressao(frase: str) -> int:
+    """Hash de 64 bits (blake2b) da sentença normalizada, como int64 com sinal (cabe no BSON/SQLite)."""
+    d = hashlib.blake2b(norm_frase(frase).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(d, "big", signed=True)
+
+def impressoes(texto: str) -> List[int]:
+    """Impressões das sentenças de uma resposta, sem repetição, na ordem do texto."""
+    return list(dict.fromkeys(impressao(s) for s in split_frases(texto or "")))
+
+# --- Termos de busca (índice do histórico) ---
+_STOP = frozenset("""
+    que com para pra pro por mas mais como quando onde nao sim isso isto esse essa este esta
+    aquele aquela voce voces ele ela eles elas meu minha meus minhas seu sua seus suas teu tua
+    nos dos das nas num numa uma uns umas aos ate foi ser ter tem estou esta vai vou sou era
+    muito pouco tambem ainda agora entao aqui ali mim ti lhe dele dela sem sobre the and
+""".split())
+
+def termos_busca(texto: str) -> Counter:
+    """Frequência dos termos (minúsculos, sem acento, 3+ letras, sem stopwords)."""
+    t = unicodedata.normalize("NFKD", (texto or "").lower())
+    t = "".join(c for c in t if not unicodedata.combining(c))
+    return Counter(w for w in re.findall(r"[a-z0-9]{3,}", t) if w not in _STOP)
+
 def formatar_roleplay_profissional(texto: str, max_frases_por_par: int = 2) -> str:
     """
     Reorganiza o texto em parágrafos curtos (1–max_frases_por_par frases).
@@ -82,3 +128,36 @@ def formatar_roleplay_profissional(texto: str, max_frases_por_par: int = 2) -> s
     out = "\n\n".join(paras)
     out = re.sub(r"[ \t]+$", "", out, flags=re.MULTILINE)  # tira espaços à direita
     return out.strip()
+
+class SceneClassifier:
+    """
+    Classificador de cenário por sentença. Os padrões de cada cenário viram um
+    grupo nomeado de UMA alternação compilada na criação; `classify` varre o
+    texto uma vez e devolve os cenários citados. `fora_de(alvo)` usa uma
+    alternação (em cache) só com os outros cenários: um `search` por sentença.
+    """
+
+    def __init__(self, cenarios: Dict[str, Iterable[str]]):
+        self._pats = {nome: sorted(pats) for nome, pats in cenarios.items()}
+        grupos = [f"(?P<{nome}>{'|'.join(pats)})" for nome, pats in self._pats.items()]
+        self._re = re.compile("|".join(grupos), re.IGNORECASE)
+        self._outros: Dict[Optional[str], "re.Pattern[str]"] = {}
+
+    @property
+    def cenarios(self) -> List[str]:
+        return list(self._pats)
+
+    def classify(self, text: str) -> Set[str]:
+        return {m.lastgroup for m in self._re.finditer(text or "")}
+
+    def mentions(self, text: str, cenario: str) -> bool:
+        return cenario in self.classify(text)
+
+    def fora_de(self, text: str, alvo: Optional[str]) -> bool:
+        """True se o texto cita algum cenário diferente de `alvo`."""
+        pat = self._outros.get(alvo)
+        if pat is None:
+            outros = [p for nome, pats in self._pats.items() if nome != alvo for p in pats]
+            pat = re.compile("|".join(outros) or r"(?!)", re.IGNORECASE)
+            self._outros[alvo] = pat
+        return bool(pat.search(text or ""))
@@ -1,6 +1,14 @@
 # core/together.py
-import json, time, requests
+import asyncio, json, time, requests
+from typing import AsyncIterator, Iterator
 from .config import settings
+from .sse import iter_deltas, aiter_deltas
+from .transport import ErroProvedor, erro_http, espera, transitorio
+
+try:
+    import httpx
+except Exception:  # opcional: sem httpx, o router usa só o cliente síncrono
+    httpx = None
 
 _session = requests.Session()
 _session.headers.update({
@@ -20,8 +28,67 @@ def chat(payload: dict, timeout: int = 120, retries: int = 0) -> dict:
             r = _session.post(url, data=json.dumps(payload), timeout=timeout)
             if r.ok:
                 return r.json()
-            raise RuntimeError(f"Together error: {r.text}")
+            raise erro_http("Together", r.status_code, r.text, r.headers)
+        except Exception as e:
+            last = e if isinstance(e, ErroProvedor) else ErroProvedor(f"Together error: {e}")
+            if i >= retries or not transitorio(last):
+                break  # sem espera depois da última tentativa
+        time.sleep(espera(i, last.retry_after))
+    raise last or ErroProvedor("Together unknown error")
+
+def chat_stream(payload: dict, timeout: int = 120) -> Iterator[str]:
+    """Mesma chamada de `chat`, com `stream: true`: gera os pedaços de texto conforme chegam."""
+    url = f"{settings.TOGETHER_BASE_URL}/chat/completions"
+    body = {**payload, "stream": True}
+    with _session.post(url, data=json.dumps(body), timeout=timeout, stream=True) as r:
+        if not r.ok:
+            raise erro_http("Together", r.status_code, r.text, r.headers)
+        yield from iter_deltas(r, "Together")
+
+
+# -------- Cliente assíncrono (pool compartilhado no loop de core.aio) --------
+_aclient = None
+
+def _get_aclient():
+    """Um AsyncClient por processo (keep-alive; HTTP/2 se `h2` estiver instalado)."""
+    global _aclient
+    if _aclient is None:
+        try:
+            import h2  # noqa: F401
+            http2 = True
+        except Exception:
+            http2 = False
+        _aclient = httpx.AsyncClient(
+            headers=dict(_session.headers),
+            http2=http2,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+        )
+    return _aclient
+
+async def achat(payload: dict, timeout: int = 120, retries: int = 0) -> dict:
+    """Versão assíncrona de `chat` (mesmo contrato e mesmos erros)."""
+    url = f"{settings.TOGETHER_BASE_URL}/chat/completions"
+    last = None
+    for i in range(retries + 1):
+        try:
+            r = await _get_aclient().post(url, content=json.dumps(payload), timeout=timeout)
+            if r.is_success:
+                return r.json()
+            raise erro_http("Together", r.status_code, r.text, r.headers)
         except Exception as e:
-            last = str(e)
-        time.sleep(0.5 * (2**i))
-    raise RuntimeError(last or "Together unknown error")
+            last = e if isinstance(e, ErroProvedor) else ErroProvedor(f"Together error: {e}")
+            if i >= retries or not transitorio(last):
+                break  # sem espera depois da última tentativa
+        await asyncio.sleep(espera(i, last.retry_after))
+    raise last or ErroProvedor("Together unknown error")
+
+async def achat_stream(payload: dict, timeout: int = 120) -> AsyncIterator[str]:
+    """Versão assíncrona de `chat_stream`."""
+    url = f"{settings.TOGETHER_BASE_URL}/chat/completions"
+    body = {**payload, "stream": True}
+    async with _get_aclient().stream("POST", url, content=json.dumps(body), timeout=timeout) as r:
+        if not r.is_success:
+            await r.aread()
+            raise erro_http("Together", r.status_code, r.text, r.headers)
+        async for piece in aiter_deltas(r, "Together"):
+            yield piece
@@ -1,7 +1,24 @@
+# core/tokens.py
+_enc = None
+_enc_loaded = False
+
+def _encoder():
+    """Encoder cl100k_base carregado uma vez por processo (None se tiktoken faltar)."""
+    global _enc, _enc_loaded
+    if not _enc_loaded:
+        _enc_loaded = True
+        try:
+            import tiktoken  # type: ignore
+            _enc = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _enc = None
+    return _enc
+
 def toklen(txt: str) -> int:
-    try:
-        import tiktoken  # type: ignore
-        enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(txt or ""))
-    except Exception:
-        return max(1, len((txt or "").split()))
+    enc = _encoder()
+    if enc is not None:
+        try:
+            return len(enc.encode(txt or "", disallowed_special=()))
+        except Exception:
+            pass
+    return max(1, len((txt or "").split()))
@@ -0,0 +1,368 @@
+# core/transport.py
+"""
+Camada de transporte comum às chamadas de modelo (por baixo de `route_chat_strict`):
+
+- prazo por turno: `prazo_do_turno()` abre um orçamento (settings.PROVIDER_PRAZO_S)
+  que todas as chamadas do turno dividem; cada tentativa usa
+  min(PROVIDER_TIMEOUT_S, o que resta). Fora de um turno, cada chamada tem o seu;
+- novas tentativas só para erros transitórios (rede, timeout, 408/425/429/5xx), com
+  backoff exponencial com jitter ("full jitter") e respeitando o Retry-After; sem
+  espera depois da última tentativa nem espera que não caiba no prazo;
+- disjuntor por modelo: CB_FALHAS falhas seguidas abrem o circuito por CB_ABERTO_S;
+  depois disso uma única chamada de sonda (meio-aberto) decide se fecha ou reabre.
+  Com o circuito aberto a chamada falha na hora (`CircuitoAberto`).
+
+As tentativas que dão certo alimentam core/latencia.py (total e TTFT por modelo).
+"""
+import asyncio
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Mapping, Optional, Tuple, TypeVar
+
+from . import latencia
+from .config import settings
+
+T = TypeVar("T")
+
+_TRANSITORIOS = {408, 425, 429, 500, 502, 503, 504, 529}
+
+
+class ErroProvedor(RuntimeError):
+    """Erro de um provedor, com o status HTTP (None = rede/timeout) e o Retry-After em segundos."""
+
+    def __init__(self, msg: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(msg)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CircuitoAberto(RuntimeError):
+    pass
+
+
+class PrazoEsgotado(RuntimeError):
+    pass
+
+
+def _retry_after(valor: Optional[str]) -> Optional[float]:
+    """Retry-After em segundos (número ou data HTTP)."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def erro_http(provedor: str, status: int, texto: str, headers: Mapping[str, str]) -> ErroProvedor:
+    return ErroProvedor(f"{provedor} error: {texto}", status, _retry_after(headers.get("Retry-After")))
+
+
+def transitorio(e: BaseException) -> bool:
+    """Vale tentar de novo? 4xx de requisição não; rede, timeout, 429 e 5xx sim."""
+    if isinstance(e, (CircuitoAberto, PrazoEsgotado)):
+        return False
+    if isinstance(e, ErroProvedor) and e.status is not None:
+        return e.status in _TRANSITORIOS
+    return True  # exceções de rede do requests/httpx e falhas sem status
+
+
+def espera(tentativa: int, retry_after: Optional[float] = None) -> float:
+    """Backoff da tentativa `tentativa` (0, 1, ...): jitter cheio sobre base·2^n, nunca abaixo do Retry-After."""
+    teto = min(settings.PROVIDER_BACKOFF_MAX_S, settings.PROVIDER_BACKOFF_S * (2 ** tentativa))
+    return max(random.uniform(0.0, teto), retry_after or 0.0)
+
+
+# -------- prazo --------
+class Prazo:
+    __slots__ = ("fim",)
+
+    def __init__(self, segundos: float):
+        self.fim = time.monotonic() + segundos
+
+    def resta(self) -> float:
+        return self.fim - time.monotonic()
+
+    def timeout(self) -> float:
+        """Timeout da próxima tentativa; PrazoEsgotado se não sobrou nada."""
+        resta = self.resta()
+        if resta <= 0:
+            raise PrazoEsgotado("prazo do turno esgotado antes da chamada ao modelo")
+        return min(settings.PROVIDER_TIMEOUT_S, resta)
+
+
+_prazo: ContextVar[Optional[Prazo]] = ContextVar("prazo_turno", default=None)
+
+
+@contextmanager
+def prazo_do_turno(segundos: Optional[float] = None) -> Iterator[Prazo]:
+    """Orçamento de tempo das chamadas de modelo do turno (aninhado, reaproveita o de fora)."""
+    atual = _prazo.get()
+    if atual is not None:
+        yield atual
+        return
+    p = Prazo(settings.PROVIDER_PRAZO_S if segundos is None else segundos)
+    token = _prazo.set(p)
+    try:
+        yield p
+    finally:
+        try:
+            _prazo.reset(token)
+        except ValueError:  # gerador finalizado em outro contexto
+            _prazo.set(None)
+
+
+def prazo_atual() -> Prazo:
+    """O prazo do turno em curso, ou um novo só para esta chamada."""
+    return _prazo.get() or Prazo(settings.PROVIDER_PRAZO_S)
+
+
+# -------- disjuntor --------
+class Disjuntor:
+    def __init__(self, falhas: int, aberto_s: float):
+        self.limite = max(1, falhas)
+        self.aberto_s = aberto_s
+        self._lock = threading.Lock()
+        self.estado = "fechado"
+        self.falhas = 0
+        self._reabre = 0.0
+        self._sonda = False
+
+    def permitir(self) -> bool:
+        """Pode chamar? No meio-aberto, só uma sonda por vez."""
+        with self._lock:
+            if self.estado == "aberto":
+                if time.monotonic() < self._reabre:
+                    return False
+                self.estado = "meio-aberto"
+            if self.estado == "meio-aberto":
+                if self._sonda:
+                    return False
+                self._sonda = True
+            return True
+
+    def sucesso(self) -> None:
+        with self._lock:
+            self.estado, self.falhas, self._sonda = "fechado", 0, False
+
+    def falha(self) -> None:
+        with self._lock:
+            self.falhas += 1
+            if self.estado == "meio-aberto" or self.falhas >= self.limite:
+                self.estado = "aberto"
+                self._reabre = time.monotonic() + self.aberto_s
+            self._sonda = False
+
+    def soltar(self) -> None:
+        """Sonda interrompida sem resultado (cancelamento): libera para a próxima."""
+        with self._lock:
+            self._sonda = False
+
+    def reabre_em(self) -> float:
+        return max(0.0, self._reabre - time.monotonic())
+
+
+_disjuntores: Dict[str, Disjuntor] = {}
+_disj_lock = threading.Lock()
+
+
+def disjuntor(chave: str) -> Disjuntor:
+    with _disj_lock:
+        d = _disjuntores.get(chave)
+        if d is None:
+            d = _disjuntores[chave] = Disjuntor(settings.CB_FALHAS, settings.CB_ABERTO_S)
+        return d
+
+
+def estado_disjuntores() -> Dict[str, Dict[str, Any]]:
+    with _disj_lock:
+        return {k: {"estado": d.estado, "falhas": d.falhas} for k, d in _disjuntores.items()}
+
+
+def _entrar(chave: str) -> Disjuntor:
+    d = disjuntor(chave)
+    if not d.permitir():
+        raise CircuitoAberto(f"circuito aberto para {chave} (nova tentativa em {d.reabre_em():.1f}s)")
+    return d
+
+
+def _registrar(d: Disjuntor, e: Exception) -> None:
+    # 4xx de requisição: o modelo respondeu, a culpa não é dele
+    if transitorio(e):
+        d.falha()
+    else:
+        d.sucesso()
+
+
+def _pode_repetir(e: Exception, tentativa: int, prazo: Prazo, d: Disjuntor) -> Optional[float]:
+    """Quanto esperar antes da próxima tentativa, ou None se não há próxima."""
+    if tentativa + 1 >= settings.PROVIDER_TENTATIVAS or not transitorio(e) or d.estado == "aberto":
+        return None  # circuito que abriu agora: vale o erro real, não o CircuitoAberto
+    t = espera(tentativa, getattr(e, "retry_after", None))
+    return t if t < prazo.resta() else None
+
+
+def _ms(t0: float) -> float:
+    return (time.perf_counter() - t0) * 1000.0
+
+
+# -------- chamadas --------
+# A sonda do meio-aberto sai sempre: sucesso()/falha() a liberam junto com o veredito
+# (sem janela para uma segunda sonda entre os dois) e soltar() cobre o cancelamento.
+# O timeout é tirado antes de entrar no disjuntor: prazo esgotado não ocupa a sonda.
+def chamar(fn: Callable[[float], T], chave: str, prazo: Optional[Prazo] = None) -> T:
+    """`fn(timeout)` com prazo, novas tentativas e o disjuntor de `chave` (provedor:modelo)."""
+    prazo = prazo or prazo_atual()
+    tentativa = 0
+    while True:
+        timeout = prazo.timeout()
+        d = _entrar(chave)
+        t0 = time.perf_counter()
+        try:
+            out = fn(timeout)
+        except Exception as e:
+            _registrar(d, e)
+            t = _pode_repetir(e, tentativa, prazo, d)
+            if t is None:
+                raise
+            time.sleep(t)
+            tentativa += 1
+            continue
+        except BaseException:
+            d.soltar()
+            raise
+        d.sucesso()
+        latencia.registrar(chave, "total", _ms(t0))
+        return out
+
+
+async def achamar(fn: Callable[[float], Awaitable[T]], chave: str, prazo: Optional[Prazo] = None) -> T:
+    """Versão assíncrona de `chamar`."""
+    prazo = prazo or prazo_atual()
+    tentativa = 0
+    while True:
+        timeout = prazo.timeout()
+        d = _entrar(chave)
+        t0 = time.perf_counter()
+        try:
+            out = await fn(timeout)
+        except Exception as e:
+            _registrar(d, e)
+            t = _pode_repetir(e, tentativa, prazo, d)
+            if t is None:
+                raise
+            await asyncio.sleep(t)
+            tentativa += 1
+            continue
+        except BaseException:  # cancelado (ex.: perdeu a corrida do hedge)
+            d.soltar()
+            raise
+        d.sucesso()
+        latencia.registrar(chave, "total", _ms(t0))
+        return out
+
+
+def stream(abrir: Callable[[float], Iterator[str]], chave: str, prazo: Optional[Prazo] = None) -> Iterator[str]:
+    """
+    Stream com as mesmas regras até o primeiro pedaço; depois dele não há nova
+    tentativa (o texto já foi mostrado), só o registro da falha no disjuntor.
+    """
+    prazo = prazo or prazo_atual()
+    tentativa = 0
+    while True:
+        timeout = prazo.timeout()
+        d = _entrar(chave)
+        t0 = time.perf_counter()
+        it: Optional[Iterator[str]] = None
+        try:
+            it = abrir(timeout)
+            primeiro = next(it, None)
+        except Exception as e:
+            _registrar(d, e)
+            t = _pode_repetir(e, tentativa, prazo, d)
+            if t is None:
+                raise
+            time.sleep(t)
+            tentativa += 1
+            continue
+        except BaseException:
+            d.soltar()
+            if hasattr(it, "close"):
+                it.close()
+            raise
+        d.sucesso()
+        latencia.registrar(chave, "ttft", _ms(t0))
+        break
+    try:
+        if primeiro is None:
+            return
+        yield primeiro
+        yield from it
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        _registrar(d, e)
+        raise
+    else:
+        latencia.registrar(chave, "total", _ms(t0))
+    finally:
+        if hasattr(it, "close"):
+            it.close()
+
+
+async def aabrir_stream(
+    abrir: Callable[[float], AsyncIterator[str]], chave: str, prazo: Optional[Prazo] = None
+) -> Tuple[Optional[str], AsyncIterator[str]]:
+    """
+    Abertura assíncrona de stream com as regras de `stream`: tenta até o primeiro
+    pedaço e devolve (primeiro pedaço ou None, resto do stream).
+    """
+    prazo = prazo or prazo_atual()
+    tentativa = 0
+    while True:
+        timeout = prazo.timeout()
+        d = _entrar(chave)
+        t0 = time.perf_counter()
+        it: Optional[AsyncIterator[str]] = None
+        try:
+            it = abrir(timeout)
+            primeiro: Optional[str] = await it.__anext__()
+        except StopAsyncIteration:
+            primeiro = None
+        except Exception as e:
+            _registrar(d, e)
+            t = _pode_repetir(e, tentativa, prazo, d)
+            if t is None:
+                raise
+            await asyncio.sleep(t)
+            tentativa += 1
+            continue
+        except BaseException:  # cancelado (ex.: perdeu a corrida do hedge)
+            d.soltar()
+            if it is not None:
+                await it.aclose()
+            raise
+        d.sucesso()
+        latencia.registrar(chave, "ttft", _ms(t0))
+        return primeiro, _aresto(it, d, chave, t0)
+
+
+async def _aresto(it: AsyncIterator[str], d: Disjuntor, chave: str, t0: float) -> AsyncIterator[str]:
+    try:
+        async for piece in it:
+            yield piece
+    except Exception as e:
+        _registrar(d, e)
+        raise
+    else:
+        latencia.registrar(chave, "total", _ms(t0))
+    finally:
+        await it.aclose()
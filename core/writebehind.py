@@ -0,0 +1,250 @@
+# core/writebehind.py
+"""
+Fila de gravação em segundo plano (write-behind) para as escritas do fim do turno
+(histórico, fatos, eventos): a resposta volta para a UI sem esperar o banco.
+
+- uma thread dedicada consome a fila em FIFO, então a ordem por usuário é a ordem
+  de chegada;
+- escritas seguidas na mesma coleção vão juntas num `bulk_write` ordenado (Mongo);
+  nos backends locais são aplicadas em sequência. Se o lote falha no meio, retoma
+  da primeira op que falhou: as anteriores já entraram e não são refeitas (os
+  `$inc` de totais e de uso não podem contar duas vezes);
+- o que ainda falha (ex.: Mongo fora do ar por alguns segundos) volta para a fila
+  com backoff exponencial, até settings.WB_TENTATIVAS vezes; só depois disso a
+  escrita é perdida (`erros`). `$inc` que falhou não volta: não se sabe se entrou;
+- a fila é limitada (settings.WB_MAX_PENDENTES): cheia, quem grava espera;
+- `aguardar(chave)` bloqueia até as escritas pendentes daquele usuário caírem no
+  banco (os repositórios chamam antes de ler: lê-se sempre o que se escreveu);
+- no encerramento do processo a fila é esvaziada (atexit).
+"""
+import atexit
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+from .database import get_col
+
+# op: ("insert_one", doc) | ("insert_many", docs) | ("update_one", filtro, update, upsert)
+Op = Tuple[Any, ...]
+_Item = Tuple[str, str, Op, int]  # (chave do usuário, coleção, op, tentativa)
+
+_BACKOFF_MAX_S = 30.0
+
+
+def _unitarias(itens: List[_Item]) -> List[_Item]:
+    """insert_many vira inserts avulsos: uma op por requisição do bulk."""
+    out: List[_Item] = []
+    for chave, colecao, op, tentativa in itens:
+        if op[0] == "insert_many":
+            out.extend((chave, colecao, ("insert_one", d), tentativa) for d in op[1])
+        else:
+            out.append((chave, colecao, op, tentativa))
+    return out
+
+
+def _reenviavel(op: Op) -> bool:
+    """Pode voltar para a fila? Inserts (pelo _id) e $set sim; $inc pode já ter entrado."""
+    return op[0] != "update_one" or "$inc" not in op[2]
+
+
+def _bulk_mongo(col: Any, ops: List[Op]) -> Optional[int]:
+    """
+    `bulk_write` ordenado das ops (já unitárias). None se tudo entrou; senão o
+    índice da primeira que falhou (o Mongo para nela: as anteriores entraram).
+    """
+    from pymongo import InsertOne, UpdateOne
+    from pymongo.errors import BulkWriteError
+    reqs = [InsertOne(op[1]) if op[0] == "insert_one" else UpdateOne(op[1], op[2], upsert=op[3]) for op in ops]
+    try:
+        col.bulk_write(reqs, ordered=True)
+    except BulkWriteError as e:
+        falhas = e.details.get("writeErrors") or []
+        if not falhas:  # só write concern: as escritas entraram no primário
+            print(f"[write-behind] write concern em {col.name}: {e.details!r}", file=sys.stderr)
+            return None
+        return int(falhas[0]["index"])
+    return None
+
+
+def _aplicar_um(col: Any, op: Op) -> None:
+    if op[0] == "insert_one":
+        col.insert_one(op[1])
+    elif op[0] == "insert_many":
+        if op[1]:
+            col.insert_many(op[1])
+    else:
+        col.update_one(op[1], op[2], upsert=op[3])
+
+
+class WriteBehind:
+    def __init__(self, max_pendentes: int, lote: int):
+        self.lote = max(1, lote)
+        self._q: "queue.Queue[_Item]" = queue.Queue(maxsize=max(1, max_pendentes))
+        self._cond = threading.Condition()
+        self._pend: Dict[str, int] = defaultdict(int)
+        self._total = 0
+        self.stats: Dict[str, int] = {
+            "max_pendentes": self._q.maxsize, "maior_backlog": 0,
+            "gravadas": 0, "lotes": 0, "reenvios": 0, "erros": 0, "esperas_cheia": 0,
+        }
+        threading.Thread(target=self._loop, name="write-behind", daemon=True).start()
+
+    # -------- produtor --------
+    def submit(self, chave: str, colecao: str, op: Op) -> None:
+        with self._cond:
+            self._pend[chave] += 1
+            self._total += 1
+            self.stats["maior_backlog"] = max(self.stats["maior_backlog"], self._total)
+        try:
+            self._q.put_nowait((chave, colecao, op, 0))
+        except queue.Full:
+            with self._cond:
+                self.stats["esperas_cheia"] += 1
+            self._q.put((chave, colecao, op, 0))
+
+    def aguardar(self, chave: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Espera as escritas pendentes (de um usuário, ou todas). False se estourar o timeout."""
+        fim = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while (self._pend.get(chave, 0) if chave is not None else self._total) > 0:
+                resta = None if fim is None else fim - time.monotonic()
+                if resta is not None and resta <= 0:
+                    return False
+                self._cond.wait(resta)
+        return True
+
+    def pendentes(self, chave: Optional[str] = None) -> int:
+        with self._cond:
+            return self._pend.get(chave, 0) if chave is not None else self._total
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._cond:
+            return {**self.stats, "pendentes": self._total}
+
+    # -------- consumidor --------
+    def _loop(self) -> None:
+        while True:
+            itens = [self._q.get()]
+            while len(itens) < self.lote:
+                try:
+                    itens.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            # agrupa só escritas consecutivas na mesma coleção: preserva a ordem global
+            inicio = 0
+            for i in range(1, len(itens) + 1):
+                if i == len(itens) or itens[i][1] != itens[inicio][1]:
+                    self._gravar(itens[inicio:i])
+                    inicio = i
+
+    def _gravar(self, itens: List[_Item]) -> None:
+        unitarias = _unitarias(itens)
+        ops = [op for _, _, op, _ in unitarias]
+        falhas: List[int] = []
+        try:
+            col = get_col(itens[0][1])
+            if settings.REPO_BACKEND == "mongo" and len(itens) > 1:
+                try:
+                    falhou = _bulk_mongo(col, ops)
+                except Exception:
+                    # rede/servidor: não se sabe até onde o lote foi
+                    falhas = self._retomar(col, ops, 0, incerto=True)
+                else:
+                    if falhou is not None:
+                        falhas = self._retomar(col, ops, falhou)
+            else:
+                feitas = 0
+                for _, _, op, _ in itens:
+                    try:
+                        _aplicar_um(col, op)
+                    except Exception:
+                        falhas = self._retomar(col, ops, feitas)
+                        break
+                    feitas += len(op[1]) if op[0] == "insert_many" else 1
+        except Exception as e:
+            falhas = list(range(len(ops)))
+            print(f"[write-behind] coleção {itens[0][1]} indisponível: {e!r}", file=sys.stderr)
+        de_novo = [
+            (chave, colecao, op, tentativa + 1)
+            for chave, colecao, op, tentativa in (unitarias[i] for i in falhas)
+            if _reenviavel(op) and tentativa + 1 < settings.WB_TENTATIVAS
+        ]
+        with self._cond:
+            self.stats["lotes"] += 1
+            self.stats["gravadas"] += len(unitarias) - len(falhas)
+            self.stats["reenvios"] += len(de_novo)
+            self.stats["erros"] += len(falhas) - len(de_novo)
+            for chave, _, _, _ in itens:
+                self._pend[chave] -= 1
+                if self._pend[chave] <= 0:
+                    del self._pend[chave]
+            self._total -= len(itens)
+            for chave, _, _, _ in de_novo:  # continuam pendentes: quem lê ainda espera por elas
+                self._pend[chave] += 1
+                self._total += 1
+            self._cond.notify_all()
+        if de_novo:
+            self._reenviar(de_novo)
+
+    def _reenviar(self, itens: List[_Item]) -> None:
+        """Devolve as escritas à fila depois do backoff da tentativa (thread à parte: o consumidor não para)."""
+        tentativa = max(t for _, _, _, t in itens)
+        espera = min(_BACKOFF_MAX_S, settings.WB_BACKOFF_S * (2 ** (tentativa - 1)))
+        print(f"[write-behind] {len(itens)} escrita(s) de volta à fila em {espera:.1f}s "
+              f"(tentativa {tentativa + 1}/{settings.WB_TENTATIVAS})", file=sys.stderr)
+
+        def _devolver() -> None:
+            for item in itens:
+                self._q.put(item)
+
+        t = threading.Timer(espera, _devolver)
+        t.daemon = True
+        t.start()
+
+    @staticmethod
+    def _retomar(col: Any, ops: List[Op], desde: int, incerto: bool = False) -> List[int]:
+        """
+        Aplica uma a uma as ops a partir de `desde` (as anteriores já entraram) e
+        devolve os índices das que falharam. Inserts que já estão no banco (pelo
+        _id) são pulados. `incerto`: o lote caiu sem dizer onde parou; updates com
+        `$inc` não são idempotentes e ficam de fora (falham) para não somar duas vezes.
+        """
+        falhas: List[int] = []
+        for i in range(desde, len(ops)):
+            op = ops[i]
+            try:
+                if op[0] == "insert_one":
+                    if "_id" in op[1] and col.find_one({"_id": op[1]["_id"]}, {"_id": 1}):
+                        continue
+                elif incerto and "$inc" in op[2]:
+                    falhas.append(i)
+                    print(f"[write-behind] $inc não refeito em {col.name} (lote interrompido): {op[1]!r}", file=sys.stderr)
+                    continue
+                _aplicar_um(col, op)
+            except Exception as e:
+                falhas.append(i)
+                print(f"[write-behind] falha em {col.name}: {e!r}", file=sys.stderr)
+        return falhas
+
+
+_writer: Optional[WriteBehind] = None
+_writer_lock = threading.Lock()
+
+def get_writer() -> WriteBehind:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = WriteBehind(settings.WB_MAX_PENDENTES, settings.WB_LOTE)
+            atexit.register(_writer.aguardar, None, settings.WB_TIMEOUT_S)
+        return _writer
+
+def aguardar(chave: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+    """Sem fila criada não há o que esperar."""
+    return True if _writer is None else _writer.aguardar(chave, timeout)
+
+def writebehind_stats() -> Dict[str, int]:
+    return get_writer().snapshot() if _writer is not None else {"pendentes": 0}
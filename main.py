@@ -62,7 +62,8 @@ def require_password(app_name: str = "App protegido"):
 
 # --- imports principais do app ---
 try:
-    from core.service import gerar_resposta
+    from core.service import gerar_resposta, gerar_resposta_stream, STREAM_RESET
+    from core.scheduler import ao_esperar
 except Exception as e:
     st.error(f"Falha ao importar core.service: {e}")
     raise
@@ -83,7 +84,7 @@ try:
     from core.repositories import (
         get_fact, get_facts, get_history_docs, set_fact,
         delete_user_history, delete_last_interaction, delete_all_user_data, reset_nsfw,
-        register_event, list_events,
+        register_event, list_events, ensure_indexes, state_version, get_usage,
     )
 except Exception:
     # Fallbacks para manter a aplicação utilizável mesmo sem todas as funções
@@ -97,14 +98,69 @@ except Exception:
     reset_nsfw = _noop
     register_event = _noop
     list_events = _return_empty_list
+    ensure_indexes = _noop
+    state_version = lambda _u: 0
+    get_usage = _return_empty_list
+
+# índices por usuario_norm (idempotente; roda uma vez por processo)
+try:
+    ensure_indexes()
+except Exception as e:
+    st.sidebar.warning(f"Não foi possível criar os índices: {e}")
 
 # ---------- NSFW (opcional) ----------
 try:
     from core.nsfw import nsfw_enabled
 except Exception:
-    def nsfw_enabled(_user: str) -> bool:
+    def nsfw_enabled(_user: str, *_a, **_k) -> bool:
         return False
 
+# ---------- Configuração ----------
+try:
+    from core.config import settings
+    SIDEBAR_CACHE_TTL_S = settings.SIDEBAR_CACHE_TTL_S
+except Exception:
+    SIDEBAR_CACHE_TTL_S = 30.0
+
+# ---------- Cache de chamadas auxiliares (opcional) ----------
+try:
+    from core.cache import cache_stats
+except Exception:
+    def cache_stats() -> dict:
+        return {}
+
+# ---------- Tempos por etapa do turno (opcional) ----------
+try:
+    from core.metrics import ultimo_turno, cascata
+except Exception:
+    def ultimo_turno():
+        return None
+    def cascata(_doc) -> str:
+        return ""
+
+def _painel_tempos(slot) -> None:
+    """Waterfall do último turno desta sessão num expander da sidebar."""
+    mt = st.session_state.get("metricas_turno")
+    if not mt:
+        return
+    ttft = next((s["attrs"].get("ttft_ms") for s in mt.get("spans", []) if "ttft_ms" in s.get("attrs", {})), None)
+    with slot.container():
+        with st.expander(f"⏱️ Último turno: {mt.get('total_ms', 0):.0f} ms"):
+            st.caption(
+                f"{mt.get('provider', '?')}:{mt.get('used_model', '?')} · "
+                f"prompt {mt.get('prompt_tokens', 0)} tok · resposta {mt.get('completion_tokens', 0)} tok · "
+                f"{mt.get('chamadas', 0)} chamada(s) · US$ {mt.get('custo_usd') or 0:.4f}"
+                + (f" · TTFT {ttft:.0f} ms" if ttft is not None else "")
+            )
+            st.code(cascata(mt), language=None)
+
+# ---------- Fila de gravação em 2º plano (opcional) ----------
+try:
+    from core.writebehind import writebehind_stats
+except Exception:
+    def writebehind_stats() -> dict:
+        return {}
+
 # ---------- Inferência de local ----------
 try:
     from core.locations import infer_from_prompt as infer_location
@@ -130,6 +186,87 @@ def _reload_history(user_key: str):
         st.sidebar.warning(f"Não foi possível carregar o histórico: {e}")
     st.session_state["history_loaded_for"] = user_key
 
+class _FatosView:
+    """Só o `get_fact` que o gate NSFW usa, servido de um dict já lido."""
+    def __init__(self, fatos: dict):
+        self._fatos = fatos
+
+    def get_fact(self, key: str, default=None):
+        return self._fatos.get(key, default)
+
+def _sidebar_dados(user_key: str) -> dict:
+    """
+    Fatos, gate NSFW e últimos eventos do usuário, em cache na sessão. Vale enquanto
+    o carimbo `state_version` não mudar (escritas do app) e dentro do TTL.
+    """
+    cache = st.session_state.setdefault("_sidebar_cache", {})
+    versao = state_version(user_key)
+    item = cache.get(user_key)
+    if item and item["versao"] == versao and time.time() - item["ts"] < SIDEBAR_CACHE_TTL_S:
+        return item["dados"]
+    try:
+        fatos = get_facts(user_key) or {}
+    except Exception:
+        fatos = {}
+    try:
+        evs = list_events(user_key, limit=5) or []
+    except Exception:
+        evs = []
+    dados = {
+        "fatos": fatos,
+        "nsfw": nsfw_enabled(user_key, snap=_FatosView(fatos)),
+        "eventos": evs,
+    }
+    cache[user_key] = {"versao": versao, "ts": time.time(), "dados": dados}
+    return dados
+
+def _uso_dados(usuario: str) -> list:
+    """Uso agregado das três personagens do usuário, no mesmo cache por carimbo da sidebar."""
+    chaves = [usuario] + [f"{usuario}::{p}" for p in ("laura", "narith")]
+    cache = st.session_state.setdefault("_uso_cache", {})
+    versao = tuple(state_version(k) for k in chaves)
+    item = cache.get(usuario)
+    if item and item["versao"] == versao and time.time() - item["ts"] < SIDEBAR_CACHE_TTL_S:
+        return item["linhas"]
+    try:
+        linhas = get_usage(chaves) or []
+    except Exception:
+        linhas = []
+    cache[usuario] = {"versao": versao, "ts": time.time(), "linhas": linhas}
+    return linhas
+
+def _painel_uso(usuario: str) -> None:
+    """Tokens e custo estimado por personagem e por modelo (coleção mary_uso)."""
+    linhas = _uso_dados(usuario)
+    if not linhas:
+        return
+    total = sum(l.get("custo_usd") or 0 for l in linhas)
+    por_char: dict = {}
+    for l in linhas:
+        char = (l.get("usuario_norm") or "").partition("::")[2] or "mary"
+        por_char[char] = por_char.get(char, 0.0) + (l.get("custo_usd") or 0)
+    with st.sidebar.expander(f"💸 Uso: US$ {total:.4f}"):
+        st.caption(" · ".join(f"{c.capitalize()}: US$ {v:.4f}" for c, v in sorted(por_char.items(), key=lambda x: -x[1])))
+        for l in sorted(linhas, key=lambda l: -(l.get("custo_usd") or 0)):
+            char = (l.get("usuario_norm") or "").partition("::")[2] or "mary"
+            st.caption(
+                f"**{l.get('modelo', '?')}** ({char.capitalize()}) · {l.get('chamadas', 0)} chamada(s) · "
+                f"prompt {l.get('prompt_tokens', 0)} tok · resposta {l.get('completion_tokens', 0)} tok · "
+                f"US$ {l.get('custo_usd') or 0:.4f}"
+            )
+
+def _render_stream(gen, placeholder) -> str:
+    """Pinta os pedaços no balão conforme chegam; devolve o texto final do gerador."""
+    rascunho = ""
+    while True:
+        try:
+            piece = next(gen)
+        except StopIteration as fim:
+            return fim.value or rascunho
+        # nova geração (ex.: reforço canônico): descarta o rascunho mostrado
+        rascunho = "" if piece == STREAM_RESET else rascunho + piece
+        placeholder.markdown(rascunho + "▌")
+
 # ---------- página ----------
 st.set_page_config(page_title="Roleplay | Mary Massariol", layout="centered")
 st.title("Roleplay | Mary Massariol")
@@ -141,12 +278,14 @@ st.session_state.setdefault("personagem", "Mary")
 st.session_state.setdefault("history", [])               # type: List[Tuple[str, str]]
 st.session_state.setdefault("history_loaded_for", None)
 st.session_state.setdefault("auto_loc", True)
+st.session_state.setdefault("stream", True)
 
 # ---------- estado dos WIDGETS (ui_*) ----------
 st.session_state.setdefault("ui_usuario", st.session_state["usuario"])
 st.session_state.setdefault("ui_personagem", st.session_state["personagem"])
 st.session_state.setdefault("ui_modelo", st.session_state["modelo"])
 st.session_state.setdefault("ui_auto_loc", st.session_state["auto_loc"])
+st.session_state.setdefault("ui_stream", st.session_state["stream"])
 
 # ---------- controles topo (usar chaves únicas ui_*) ----------
 c1, c2 = st.columns([2,2])
@@ -166,6 +305,8 @@ MODEL_OPTIONS = [
     "together/meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
     "together/Qwen/Qwen2.5-72B-Instruct",
     "together/Qwen/QwQ-32B",
+    # Local (provedor de mentira, para teste offline)
+    "local/mary",
 ]
 st.selectbox("🧠 Modelo", MODEL_OPTIONS, key="ui_modelo")
 
@@ -186,18 +327,30 @@ if st.session_state["history_loaded_for"] != usuario_key:
     _reload_history(usuario_key)
 
 # ---------- sidebar: STATUS ----------
-try:
-    local_atual = get_fact(usuario_key, "local_cena_atual", "—")
-except Exception:
-    local_atual = "—"
+_sb = _sidebar_dados(usuario_key)
+local_atual = _sb["fatos"].get("local_cena_atual", "—")
 
-nsfw_badge = "✅ Liberado" if nsfw_enabled(usuario_key) else "🔒 Bloqueado"
-provider = "Together" if modelo.startswith("together/") else "OpenRouter"
+nsfw_badge = "✅ Liberado" if _sb["nsfw"] else "🔒 Bloqueado"
+provider = "Together" if modelo.startswith("together/") else "Local" if modelo.startswith("local/") else "OpenRouter"
 
 st.sidebar.markdown(f"**NSFW:** {nsfw_badge}")
 st.sidebar.caption(f"Local atual: {local_atual}")
 st.sidebar.caption(f"Personagem: **{personagem}**")
 st.sidebar.caption(f"Provedor: **{provider}**")
+_cs = cache_stats()
+if _cs:
+    st.sidebar.caption(
+        f"Cache aux.: {_cs.get('hits_mem', 0) + _cs.get('hits_tier', 0)} hits · {_cs.get('misses', 0)} misses"
+    )
+_wb = writebehind_stats()
+if _wb.get("max_pendentes"):
+    st.sidebar.caption(
+        f"Gravação: {_wb.get('pendentes', 0)}/{_wb['max_pendentes']} pendentes"
+        + (f" · {_wb['erros']} erros" if _wb.get("erros") else "")
+    )
+_slot_tempos = st.sidebar.empty()
+_painel_tempos(_slot_tempos)
+_painel_uso(usuario)
 
 st.sidebar.markdown("---")
 st.session_state["ui_auto_loc"] = st.sidebar.checkbox(
@@ -205,12 +358,18 @@ st.session_state["ui_auto_loc"] = st.sidebar.checkbox(
     value=st.session_state["ui_auto_loc"],
     help="Quando ligado, tenta detectar o lugar a partir da sua mensagem e fixa em memória."
 )
+st.session_state["ui_stream"] = st.sidebar.checkbox(
+    "⚡ Streaming",
+    value=st.session_state["ui_stream"],
+    help="Mostra o texto conforme o modelo gera; a versão final (revisada) substitui o rascunho ao terminar."
+)
 # sync
 st.session_state["auto_loc"] = st.session_state["ui_auto_loc"]
+st.session_state["stream"] = st.session_state["ui_stream"]
 
 # ---------- sidebar: FLERTE (permitir quase-traição) ----------
 if personagem == "Laura":
-    flirt_fact_val = bool(get_fact(usuario_key, "flirt_mode", False))
+    flirt_fact_val = bool(_sb["fatos"].get("flirt_mode", False))
     st.session_state.setdefault("ui_flirt_mode", flirt_fact_val)
     st.session_state["ui_flirt_mode"] = st.sidebar.checkbox(
         "💃 Flerte (permitir quase-traição)",
@@ -231,10 +390,7 @@ st.sidebar.markdown("---")
 st.sidebar.subheader("🧠 Memória Canônica")
 
 # listar fatos
-try:
-    fatos = get_facts(usuario_key) or {}
-except Exception:
-    fatos = {}
+fatos = _sb["fatos"]
 if fatos:
     for k, v in fatos.items():
         st.sidebar.write(f"- `{k}` → {v}")
@@ -243,10 +399,7 @@ else:
 
 # listar últimos eventos
 st.sidebar.markdown("**Eventos (últimos 5)**")
-try:
-    evs = list_events(usuario_key, limit=5) or []
-except Exception:
-    evs = []
+evs = _sb["eventos"]
 if evs:
     for ev in evs:
         ts = ev.get("ts")
@@ -387,14 +540,37 @@ if prompt:
         except Exception:
             pass
 
-    # gerar resposta
-    with st.spinner("Gerando..."):
-        try:
-            resposta = gerar_resposta(usuario, prompt, model=modelo, character=personagem)
-        except Exception as e:
-            resposta = f"Erro ao gerar resposta: {e}"
-
-    # mostrar e guardar a resposta
+    # gerar + mostrar a resposta (streaming pinta o rascunho no próprio balão)
     with st.chat_message("assistant", avatar="💚"):
-        st.markdown(resposta)
+        placeholder = st.empty()
+
+        def _na_fila(pos: int, espera_s: Optional[float]) -> None:
+            # provedor no limite: mostra a espera no balão até a vez chegar
+            eta = f" — ~{espera_s:.0f}s" if espera_s else ""
+            placeholder.caption(f"⏳ Na fila ({pos}º){eta}")
+
+        with ao_esperar(_na_fila):
+            if st.session_state["stream"]:
+                try:
+                    resposta = _render_stream(
+                        gerar_resposta_stream(
+                            usuario, prompt, model=modelo, character=personagem,
+                            contexto=st.session_state["history"],
+                        ),
+                        placeholder,
+                    )
+                except Exception as e:
+                    resposta = f"Erro ao gerar resposta: {e}"
+            else:
+                with st.spinner("Gerando..."):
+                    try:
+                        resposta = gerar_resposta(
+                            usuario, prompt, model=modelo, character=personagem,
+                            contexto=st.session_state["history"],
+                        )
+                    except Exception as e:
+                        resposta = f"Erro ao gerar resposta: {e}"
+        placeholder.markdown(resposta)
     st.session_state["history"].append(("assistant", resposta))
+    st.session_state["metricas_turno"] = ultimo_turno()
+    _painel_tempos(_slot_tempos)
@@ -0,0 +1,105 @@
+# tests/test_repositories.py
+"""Contrato dos repositórios nos backends locais (memória e SQLite)."""
+import pytest
+
+from core import memstore, repositories as repo, sqlstore
+from core.config import settings
+
+
+@pytest.fixture(params=["memoria", "sqlite"])
+def backend(request, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "REPO_BACKEND", request.param)
+    monkeypatch.setattr(settings, "SQLITE_PATH", str(tmp_path / "repo.sqlite3"))
+    monkeypatch.setattr(sqlstore, "_store", None)
+    monkeypatch.setattr(repo, "_indexes_ready", False)
+    monkeypatch.setattr(repo, "_legado", None)
+    memstore.reset()
+    repo.ensure_indexes()
+    yield request.param
+    memstore.reset()
+
+
+def test_salvar_e_ler_historico(backend):
+    repo.save_interaction("Ana", "oi", "Eu sorrio. Oi.", modelo="m1")
+    repo.save_interaction("Ana", "tudo bem?", "Tudo. E você?", modelo="m1")
+
+    docs = repo.get_history_docs("Ana")
+    assert [d["mensagem_usuario"] for d in docs] == ["oi", "tudo bem?"]
+    ultimo = repo.get_last_interaction("Ana")
+    assert ultimo["resposta_mary"] == "Tudo. E você?"
+    assert ultimo["modelo"] == "m1"
+    cauda = list(repo.iter_history_tail("Ana"))
+    assert [d["mensagem_usuario"] for d in cauda] == ["tudo bem?", "oi"]
+    assert all(isinstance(d["tok_resposta"], int) for d in cauda)
+
+
+def test_busca_por_usuario_norm_ignora_caixa(backend):
+    repo.save_interaction("Ana", "oi", "Oi.")
+    repo.save_interaction("Beto", "olá", "Olá.")
+    repo.set_fact("ANA", "parceiro_atual", "Janio")
+
+    assert [d["mensagem_usuario"] for d in repo.get_history_docs("aNa")] == ["oi"]
+    assert repo.get_fact("ana", "parceiro_atual") == "Janio"
+    assert repo.get_facts("Beto") == {}
+
+
+def test_apagar_ultima_interacao(backend):
+    repo.save_interaction("Ana", "primeira", "Um.")
+    repo.save_interaction("Ana", "segunda", "Dois.")
+
+    assert repo.delete_last_interaction("ana") is True
+    assert [d["mensagem_usuario"] for d in repo.get_history_docs("Ana")] == ["primeira"]
+    assert repo.delete_last_interaction("Ana") is True
+    assert repo.delete_last_interaction("Ana") is False
+    assert repo.get_last_interaction("Ana") is None
+
+
+def test_snapshot_e_eventos(backend):
+    with repo.StateSnapshot("Ana") as snap:
+        snap.set_fact("virgem", False)
+        assert snap.get_fact("virgem") is False
+    repo.register_event("Ana", "primeira_vez", "na praia", local="praia")
+
+    assert repo.get_fact("Ana", "virgem") is False
+    assert repo.last_event("ana", "primeira_vez")["local"] == "praia"
+    apagados = repo.delete_all_user_data("Ana")
+    assert apagados["state"] == 1 and apagados["eventos"] == 1
+
+
+def test_migracao_funde_chaves_que_so_diferem_na_caixa(backend):
+    from core.database import get_col
+
+    get_col("mary_state").insert_one(
+        {"usuario": "Ana", "fatos": {"virgem": True, "local": "casa"}, "atualizado_em": "2024-01-01"}
+    )
+    get_col("mary_state").insert_one({"usuario": "ana", "fatos": {"local": "praia"}, "atualizado_em": "2024-02-01"})
+    get_col("mary_historia").insert_one({"usuario": "ANA", "mensagem_usuario": "antigo", "resposta_mary": "Oi."})
+
+    out = repo.backfill_usuario_norm()
+
+    assert out["colisoes"] == {"state:ana": ["Ana", "ana"]}
+    assert repo.get_facts("ana") == {"virgem": True, "local": "praia"}
+    assert get_col("mary_state").count_documents({}) == 1
+    assert [d["mensagem_usuario"] for d in repo.get_history_docs("Ana")] == ["antigo"]
+    assert repo.backfill_usuario_norm() == {
+        "hist": 0, "state": 0, "eventos": 0, "perfil": 0, "resumo": 0, "colisoes": {},
+    }
+
+
+def test_filtro_sem_legado_e_por_igualdade(backend):
+    repo.save_interaction("Ana", "oi", "Oi.")
+    assert repo._uq("Ana") == {"usuario_norm": "ana"}
+
+
+def test_filtro_volta_a_igualdade_depois_da_migracao_em_outro_processo(backend, monkeypatch):
+    cols = {c.name: c for c in (repo._hist(), repo._state(), repo._events(), repo._profile(), repo._summary())}
+    cols["mary_state"].insert_one({"usuario": "Ana", "fatos": {"virgem": True}})
+    # só o Mongo tem legado: finge o Mongo sobre as coleções do backend local
+    monkeypatch.setattr(settings, "REPO_BACKEND", "mongo")
+    monkeypatch.setattr(repo, "get_col", cols.__getitem__)
+    monkeypatch.setattr(repo, "_LEGADO_REVER_S", 0.0)
+    assert "$or" in repo._uq("Ana")
+
+    # a migração roda em outro processo: aqui só some o documento sem a chave
+    cols["mary_state"].update_many({}, {"$set": {"usuario_norm": "ana"}})
+    assert repo._uq("Ana") == {"usuario_norm": "ana"}
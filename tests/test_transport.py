@@ -0,0 +1,146 @@
+# tests/test_transport.py
+"""Disjuntor (fechado → aberto → meio-aberto → fechado), sonda sempre liberada e prazo do turno."""
+import asyncio
+import time
+
+import pytest
+
+from core import transport
+from core.config import settings
+from core.transport import CircuitoAberto, ErroProvedor, Prazo, PrazoEsgotado
+
+CHAVE = "Teste:modelo"
+
+
+@pytest.fixture(autouse=True)
+def _transporte(monkeypatch):
+    monkeypatch.setattr(settings, "CB_FALHAS", 2)
+    monkeypatch.setattr(settings, "CB_ABERTO_S", 60.0)
+    monkeypatch.setattr(settings, "PROVIDER_TENTATIVAS", 1)
+    monkeypatch.setattr(settings, "PROVIDER_BACKOFF_S", 0.0)
+    monkeypatch.setattr(settings, "PROVIDER_TIMEOUT_S", 60.0)
+    monkeypatch.setattr(transport, "_disjuntores", {})
+
+
+def _cai(_timeout):
+    raise ErroProvedor("Teste error: 503", 503)
+
+
+def _abrir_e_vencer() -> transport.Disjuntor:
+    """Abre o circuito com CB_FALHAS falhas e adianta o relógio até o meio-aberto."""
+    for _ in range(settings.CB_FALHAS):
+        with pytest.raises(ErroProvedor):
+            transport.chamar(_cai, CHAVE)
+    d = transport.disjuntor(CHAVE)
+    assert d.estado == "aberto"
+    d._reabre = time.monotonic()
+    return d
+
+
+def test_circuito_abre_sonda_e_fecha():
+    d = _abrir_e_vencer()
+    d._reabre = time.monotonic() + 60
+    chamadas = []
+    with pytest.raises(CircuitoAberto):
+        transport.chamar(lambda t: chamadas.append(t), CHAVE)
+    assert chamadas == []  # aberto: falha na hora, sem chamar o provedor
+
+    d._reabre = time.monotonic()
+
+    def sonda(_timeout):
+        assert d.estado == "meio-aberto"
+        assert not d.permitir()  # só uma sonda por vez
+        return "ok"
+
+    assert transport.chamar(sonda, CHAVE) == "ok"
+    assert (d.estado, d.falhas, d._sonda) == ("fechado", 0, False)
+
+
+def test_sonda_que_falha_reabre():
+    d = _abrir_e_vencer()
+    with pytest.raises(ErroProvedor):
+        transport.chamar(_cai, CHAVE)
+    assert d.estado == "aberto" and not d._sonda
+    with pytest.raises(CircuitoAberto):
+        transport.chamar(lambda _t: "ok", CHAVE)
+
+
+def test_sonda_liberada_quando_abrir_do_stream_falha():
+    d = _abrir_e_vencer()
+
+    def abrir(_timeout):
+        raise ErroProvedor("Teste error: conexão recusada")
+
+    with pytest.raises(ErroProvedor):
+        list(transport.stream(abrir, CHAVE))
+    assert d.estado == "aberto" and not d._sonda
+
+    d._reabre = time.monotonic()
+    assert list(transport.stream(lambda _t: iter(["Oi", "."]), CHAVE)) == ["Oi", "."]
+    assert d.estado == "fechado"
+
+
+def test_prazo_esgotado_no_meio_aberto_nao_prende_a_sonda():
+    d = _abrir_e_vencer()
+    vencido = Prazo(0)
+    abertos = []
+
+    with pytest.raises(PrazoEsgotado):
+        list(transport.stream(lambda t: abertos.append(t) or iter(["x"]), CHAVE, vencido))
+    with pytest.raises(PrazoEsgotado):
+        asyncio.run(transport.aabrir_stream(lambda t: abertos.append(t), CHAVE, vencido))
+    assert abertos == []
+    assert not d._sonda
+    assert d.permitir()  # a próxima chamada ainda pode ser a sonda
+
+
+def test_sonda_liberada_quando_o_stream_assincrono_e_cancelado():
+    d = _abrir_e_vencer()
+
+    async def pendurado():
+        await asyncio.sleep(60)
+        yield "nunca"
+
+    async def corrida():
+        tarefa = asyncio.ensure_future(transport.aabrir_stream(lambda _t: pendurado(), CHAVE))
+        await asyncio.sleep(0.01)
+        assert d._sonda
+        tarefa.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await tarefa
+
+    asyncio.run(corrida())
+    assert d.estado == "meio-aberto" and not d._sonda
+    assert d.permitir()
+
+
+def test_prazo_acaba_entre_tentativas(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_TENTATIVAS", 5)
+    monkeypatch.setattr(settings, "CB_FALHAS", 10)
+    timeouts = []
+
+    def lenta(timeout):
+        timeouts.append(timeout)
+        time.sleep(0.3)
+        raise ErroProvedor("Teste error: 503", 503)
+
+    with pytest.raises(ErroProvedor):  # o erro real, não PrazoEsgotado nem CircuitoAberto
+        transport.chamar(lenta, CHAVE, Prazo(0.5))
+    assert len(timeouts) == 2  # a 3ª já não cabe no prazo
+    assert timeouts[0] <= 0.5 and timeouts[1] <= 0.2  # cada tentativa só leva o que resta
+    assert not transport.disjuntor(CHAVE)._sonda
+
+
+def test_retry_after_maior_que_o_prazo_desiste_na_hora(monkeypatch):
+    monkeypatch.setattr(settings, "PROVIDER_TENTATIVAS", 5)
+    chamadas = []
+
+    def limitada(_timeout):
+        chamadas.append(1)
+        raise ErroProvedor("Teste error: 429", 429, retry_after=30)
+
+    t0 = time.monotonic()
+    with pytest.raises(ErroProvedor):
+        transport.chamar(limitada, CHAVE, Prazo(5))
+    assert len(chamadas) == 1
+    assert time.monotonic() - t0 < 1  # não dorme uma espera que não cabe
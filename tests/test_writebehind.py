@@ -0,0 +1,156 @@
+# tests/test_writebehind.py
+"""Lote da write-behind que falha no meio: nada que já entrou é refeito."""
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from core import memstore, retrieval, writebehind
+from core.config import settings
+
+_TOTAIS = {"usuario_norm": "ana", "termo": retrieval.TOTAIS}
+
+
+def _ops_do_turno(seq: int, texto: str):
+    posts, dl = retrieval.postagens(seq, texto)
+    return [
+        ("insert_many", [{"usuario_norm": "ana", **p} for p in posts]),
+        ("update_one", dict(_TOTAIS), {"$inc": retrieval.incremento_totais(posts, dl)}, True),
+    ]
+
+
+class _MongoDeMentira:
+    """Coleção em memória com `bulk_write` que aplica as `falha_em` primeiras requisições e cai."""
+
+    def __init__(self, nome: str, falha_em: int, erro: str):
+        self._col = memstore.get_col(nome)
+        self.name = nome
+        self.falha_em = falha_em
+        self.erro = erro
+
+    def __getattr__(self, nome):
+        return getattr(self._col, nome)
+
+    def bulk_write(self, reqs, ordered=True):
+        for i, r in enumerate(reqs):
+            if i == self.falha_em:
+                self.falha_em = -1  # só na primeira vez
+                if self.erro == "rede":
+                    raise AutoReconnect("conexão caiu")
+                raise BulkWriteError({"writeErrors": [{"index": i, "code": 91, "errmsg": "desligando"}]})
+            if hasattr(r, "_upsert"):
+                self._col.update_one(r._filter, r._doc, upsert=r._upsert)
+            else:
+                self._col.insert_one(r._doc)
+
+
+@pytest.fixture
+def wb(monkeypatch):
+    memstore.reset()
+    w = writebehind.WriteBehind(max_pendentes=100, lote=100)
+    yield w
+    memstore.reset()
+
+
+def _gravar(wb, ops):
+    wb._gravar([("ana", "mary_indice", op, 0) for op in ops])
+
+
+def _totais():
+    return memstore.get_col("mary_indice").find_one(_TOTAIS)
+
+
+def test_bulk_retoma_da_op_que_falhou(wb, monkeypatch):
+    ops = _ops_do_turno(1, "gato preto no telhado") + _ops_do_turno(2, "gato branco na janela")
+    n_posts1 = len(ops[0][1])
+    # cai no $inc do 2º turno: as postagens e o $inc do 1º já entraram
+    falha = n_posts1 + 1 + len(ops[2][1])
+    col = _MongoDeMentira("mary_indice", falha, "bulk")
+    monkeypatch.setattr(settings, "REPO_BACKEND", "mongo")
+    monkeypatch.setattr(writebehind, "get_col", lambda _nome: col)
+
+    _gravar(wb, ops)
+
+    t = _totais()
+    assert t["n"] == 2
+    assert t["df"]["gato"] == 2
+    assert memstore.get_col("mary_indice").count_documents({"termo": "gato"}) == 2
+    assert wb.stats["erros"] == 0
+
+
+def test_bulk_interrompido_nao_repete_inc(wb, monkeypatch):
+    ops = _ops_do_turno(1, "gato preto no telhado") + _ops_do_turno(2, "gato branco na janela")
+    # a rede cai depois do $inc do 1º turno, sem dizer onde o lote parou
+    col = _MongoDeMentira("mary_indice", len(ops[0][1]) + 1 + 1, "rede")
+    monkeypatch.setattr(settings, "REPO_BACKEND", "mongo")
+    monkeypatch.setattr(writebehind, "get_col", lambda _nome: col)
+
+    _gravar(wb, ops)
+
+    assert _totais()["n"] == 1  # o 2º $inc fica de fora (erro), mas nada conta duas vezes
+    assert memstore.get_col("mary_indice").count_documents({"termo": "gato"}) == 2
+    assert wb.stats["erros"] == 2  # os dois $inc ficam sem confirmação
+
+
+def test_backend_local_retoma_sem_refazer(wb, monkeypatch):
+    ops = _ops_do_turno(1, "gato preto no telhado") + _ops_do_turno(2, "gato branco na janela")
+    col = memstore.get_col("mary_indice")
+    original = col.update_one
+    chamadas = []
+
+    def update_instavel(flt, update, upsert=False):
+        chamadas.append(1)
+        if len(chamadas) == 2:
+            raise RuntimeError("disco cheio")
+        return original(flt, update, upsert=upsert)
+
+    monkeypatch.setattr(settings, "REPO_BACKEND", "memoria")
+    monkeypatch.setattr(col, "update_one", update_instavel)
+
+    _gravar(wb, ops)
+
+    t = _totais()
+    assert t["n"] == 2
+    assert t["df"]["gato"] == 2
+    assert wb.stats["erros"] == 0
+
+
+def test_escrita_que_falha_volta_para_a_fila(wb, monkeypatch):
+    col = memstore.get_col("mary_historia")
+    original = col.insert_one
+    quedas = []
+
+    def insert_fora_do_ar(doc):
+        if len(quedas) < 3:  # a gravação e a retomada imediata falham, e o 1º reenvio também
+            quedas.append(1)
+            raise RuntimeError("servidor indisponível")
+        return original(doc)
+
+    monkeypatch.setattr(settings, "REPO_BACKEND", "memoria")
+    monkeypatch.setattr(settings, "WB_BACKOFF_S", 0.01)
+    monkeypatch.setattr(col, "insert_one", insert_fora_do_ar)
+
+    wb.submit("ana", "mary_historia", ("insert_one", {"usuario_norm": "ana", "mensagem_usuario": "oi"}))
+
+    assert wb.aguardar("ana", timeout=5)
+    assert col.count_documents({"usuario_norm": "ana"}) == 1
+    assert wb.stats["reenvios"] == 1 and wb.stats["erros"] == 0
+
+
+def test_escrita_desiste_depois_das_tentativas_e_inc_nao_volta(wb, monkeypatch):
+    col = memstore.get_col("mary_indice")
+
+    def fora_do_ar(*_a, **_k):
+        raise RuntimeError("servidor indisponível")
+
+    monkeypatch.setattr(settings, "REPO_BACKEND", "memoria")
+    monkeypatch.setattr(settings, "WB_BACKOFF_S", 0.01)
+    monkeypatch.setattr(settings, "WB_TENTATIVAS", 3)
+    monkeypatch.setattr(col, "update_one", fora_do_ar)
+
+    _gravar(wb, [
+        ("update_one", {"usuario_norm": "ana", "termo": "x"}, {"$set": {"df": 1}}, True),
+        ("update_one", dict(_TOTAIS), {"$inc": {"n": 1}}, True),
+    ])
+
+    assert wb.aguardar("ana", timeout=5)
+    assert wb.stats["reenvios"] == 2  # só o $set volta, duas vezes
+    assert wb.stats["erros"] == 2  # o $inc na hora, o $set na 3ª tentativa